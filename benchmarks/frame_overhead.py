@@ -0,0 +1,45 @@
+'''
+Per-query overhead of small frames on a small database, the case of hot
+ dispatch frames: `python benchmarks/frame_overhead.py`
+'''
+import timeit
+from jsonlddb.oop import JsonLDDatabase
+from jsonlddb.core import jsonld_frame_with_multi_index
+
+def per_call(fn, n):
+  ''' Best of 5 runs of n calls, in microseconds
+  '''
+  return min(timeit.repeat(fn, number=n, repeat=5)) / n * 1e6
+
+def main(n=5000):
+  db = JsonLDDatabase().update([
+    {
+      '@id': str(i),
+      '@type': 'Person',
+      'email': 'p{}@example.com'.format(i),
+      'owns': {'@type': 'Car', 'model': 'm{}'.format(i % 5)},
+    }
+    for i in range(1000)
+  ])
+  frames = {
+    'id': {'@id': '5'},
+    'literal': {'@type': 'Person', 'email': 'p5@example.com'},
+    'nested': {'@type': 'Person', 'owns': {'model': 'm3'}, 'email': 'p5@example.com'},
+  }
+  for name, frame in frames.items():
+    print('{:8} jsonld_frame_with_multi_index {:6.1f}us  len(db[frame]) {:6.1f}us'.format(
+      name,
+      per_call(lambda: list(jsonld_frame_with_multi_index([db.index], frame)), n),
+      per_call(lambda: len(db[frame]), n),
+    ))
+  try:
+    from jsonlddb.plan import Param
+  except ImportError:
+    return
+  frame = db[{'@type': 'Person', 'email': Param('email')}]
+  print('{:8} len(db[frame].bind(...)) {:6.1f}us'.format(
+    'param', per_call(lambda: len(frame.bind(email='p5@example.com')), n),
+  ))
+
+if __name__ == '__main__':
+  main()
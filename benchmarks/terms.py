@@ -0,0 +1,68 @@
+'''
+Throughput of inserting and framing, and the memory held per triple, which
+ are all bound by the cost of RDFTerms: `python benchmarks/terms.py`
+'''
+import gc
+import sys
+import time
+import tracemalloc
+from jsonlddb.oop import JsonLDDatabase
+from jsonlddb.index import JsonLDIndex
+from jsonlddb.terms import TermDictionary
+
+def records(n):
+  return [
+    {
+      '@id': 'node/{}'.format(i),
+      '@type': 'Person',
+      'name': 'person {}'.format(i),
+      'age': i % 90,
+      'knows': [{'@id': 'node/{}'.format((i * 7) % n)}, {'@id': 'node/{}'.format((i * 13) % n)}],
+    }
+    for i in range(n)
+  ]
+
+def best(fn, repeat=3):
+  ''' Best of `repeat` runs, in seconds
+  '''
+  times = []
+  for _ in range(repeat):
+    gc.collect()
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+def new_db():
+  return JsonLDDatabase(JsonLDIndex(terms=TermDictionary()))
+
+def main(n=20000):
+  data = records(n)
+  db = new_db().update(data)
+  n_triples = sum(db.index.counts.values())
+  insert = best(lambda: new_db().update(data))
+  print('insert  {:10.0f} triples/s'.format(n_triples / insert))
+  frames = [{'@type': 'Person', 'age': 42}, {'knows': {'age': 7}}, {'name': 'person 5'}]
+  frame = best(lambda: [list(db[frame]) for frame in frames for _ in range(10)])
+  print('frame   {:10.0f} nodes/s'.format(sum(len(db[frame]) for frame in frames) * 10 / frame))
+  tracemalloc.start()
+  db = None
+  gc.collect()
+  before = tracemalloc.get_traced_memory()[0]
+  db = new_db().update(data)
+  gc.collect()
+  after = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  print('memory  {:10.1f} bytes/triple'.format((after - before) / n_triples))
+  terms = db.index.terms
+  print('terms   {:10.1f} bytes/term'.format(
+    sum(term_size(term) for term in terms.terms) / len(terms)
+  ))
+
+def term_size(term):
+  ''' The bytes of an RDFTerm object itself (not of its value)
+  '''
+  return sys.getsizeof(term) + (sys.getsizeof(term.__dict__) if hasattr(term, '__dict__') else 0)
+
+if __name__ == '__main__':
+  main()
@@ -14,7 +14,9 @@ It is quite computationally efficient using hashtables and sets to
 While perhaps space-prohibitive for large amounts of data, for small to
  mid-ranged amounts of data like what I anticipate to use this for
  (Json-LD Dispatch), this approach will have no extensive negative
- performance impacts.
+ performance impacts. Large, mostly-static datasets can instead use a
+ CompactJsonLDIndex (`JsonLDDatabase(index=CompactJsonLDIndex())`) which
+ keeps the same lookups in sorted integer arrays.
 
 It works somewhat intuitively--allowing you to access the database as you
  might a json object--using frames for selection.
@@ -29,5 +31,9 @@ Important assumptions made by this architecture:
 
 '''
 
-from . import oop
+from . import oop, compact, cache, compiled, plan
 JsonLDDatabase = oop.JsonLDDatabase
+CompactJsonLDIndex = compact.CompactJsonLDIndex
+FrameCache = cache.FrameCache
+compile_frame = compiled.compile_frame
+Param = plan.Param
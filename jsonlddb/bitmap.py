@@ -0,0 +1,217 @@
+'''
+A roaring-style compressed set of term ids for posting lists with a high
+ fanout (e.g. the subjects of a given '@type').
+
+Ids are split on their high bits into chunks of 2**16. A chunk is stored
+ as a sorted array of its (16 bit) low bits while it holds at most
+ `array_max` ids, as a bitmap (a 8KB bytearray) beyond that, costing at
+ most 2 bytes per id rather than the ~60 of a set. Bitmaps are
+ intersected and united chunk by chunk as big ints, without visiting
+ their ids.
+'''
+import array
+import bisect
+import functools
+import operator
+
+chunk_bits = 16
+chunk_mask = (1 << chunk_bits) - 1
+bitmap_bytes = (1 << chunk_bits) // 8
+array_max = 4096
+
+# The set bits of every byte
+byte_bits = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+def bitmap_from_int(n):
+  return bytearray(n.to_bytes(bitmap_bytes, 'little'))
+
+def bitmap_from_array(lows):
+  bitmap = bytearray(bitmap_bytes)
+  for low in lows:
+    bitmap[low >> 3] |= 1 << (low & 7)
+  return bitmap
+
+# int.bit_count is new in python 3.10
+popcount = getattr(int, 'bit_count', None) or (lambda n: bin(n).count('1'))
+
+def container_has(container, low):
+  if type(container) == bytearray:
+    return container[low >> 3] >> (low & 7) & 1
+  i = bisect.bisect_left(container, low)
+  return i < len(container) and container[i] == low
+
+def container_size(container):
+  if type(container) == bytearray:
+    return popcount(int.from_bytes(container, 'little'))
+  return len(container)
+
+def container_from_int(n):
+  ''' The bitmap container for the bitmask `n` and its size. Results of
+  combining bitmaps stay bitmaps even when sparse: finding their bits
+  again for an array would cost more than the memory saved.
+  '''
+  return bitmap_from_int(n), popcount(n)
+
+def container_and(a, b):
+  if type(a) == bytearray and type(b) == bytearray:
+    return container_from_int(int.from_bytes(a, 'little') & int.from_bytes(b, 'little'))
+  if type(a) == bytearray:
+    a, b = b, a
+  if type(b) == bytearray:
+    lows = array.array('H', (low for low in a if b[low >> 3] >> (low & 7) & 1))
+  else:
+    lows = array.array('H', sorted(set(a).intersection(b)))
+  return lows, len(lows)
+
+def container_or(a, b):
+  if type(a) == bytearray or type(b) == bytearray or len(a) + len(b) > array_max:
+    return container_from_int(
+      int.from_bytes(a if type(a) == bytearray else bitmap_from_array(a), 'little')
+      | int.from_bytes(b if type(b) == bytearray else bitmap_from_array(b), 'little')
+    )
+  lows = array.array('H', sorted(set(a).union(b)))
+  return lows, len(lows)
+
+class Bitmap:
+  ''' A mutable set of non-negative ints, see the module documentation
+  '''
+  __slots__ = ('_chunks', '_len')
+  #
+  def __init__(self, ids=()):
+    self._chunks = {}
+    self._len = 0
+    for id in sorted(ids):
+      self.add(id)
+  #
+  @staticmethod
+  def _from_chunks(chunks, size):
+    bitmap = Bitmap()
+    bitmap._chunks = chunks
+    bitmap._len = size
+    return bitmap
+  #
+  def copy(self):
+    return Bitmap._from_chunks(
+      {high: container[:] for high, container in self._chunks.items()},
+      self._len,
+    )
+  #
+  def add(self, id):
+    high, low = id >> chunk_bits, id & chunk_mask
+    container = self._chunks.get(high)
+    if container is None:
+      self._chunks[high] = array.array('H', [low])
+    elif type(container) == bytearray:
+      byte, bit = container[low >> 3], 1 << (low & 7)
+      if byte & bit:
+        return
+      container[low >> 3] = byte | bit
+    else:
+      i = bisect.bisect_left(container, low)
+      if i < len(container) and container[i] == low:
+        return
+      if len(container) < array_max:
+        container.insert(i, low)
+      else:
+        container = self._chunks[high] = bitmap_from_array(container)
+        container[low >> 3] |= 1 << (low & 7)
+    self._len += 1
+  #
+  def discard(self, id):
+    high, low = id >> chunk_bits, id & chunk_mask
+    container = self._chunks.get(high)
+    if container is None:
+      return
+    elif type(container) == bytearray:
+      byte, bit = container[low >> 3], 1 << (low & 7)
+      if not byte & bit:
+        return
+      container[low >> 3] = byte & ~bit
+      if container.count(0) == bitmap_bytes:
+        del self._chunks[high]
+    else:
+      i = bisect.bisect_left(container, low)
+      if i == len(container) or container[i] != low:
+        return
+      del container[i]
+      if not container:
+        del self._chunks[high]
+    self._len -= 1
+  #
+  def remove(self, id):
+    if id not in self:
+      raise KeyError(id)
+    self.discard(id)
+  #
+  def __contains__(self, id):
+    container = self._chunks.get(id >> chunk_bits)
+    return container is not None and bool(container_has(container, id & chunk_mask))
+  #
+  def __len__(self):
+    return self._len
+  #
+  def __iter__(self):
+    for high in sorted(self._chunks):
+      base = high << chunk_bits
+      container = self._chunks[high]
+      if type(container) == bytearray:
+        for i, byte in enumerate(container):
+          if byte:
+            for bit in byte_bits[byte]:
+              yield base + i * 8 + bit
+      else:
+        for low in container:
+          yield base + low
+  #
+  def __and__(self, other):
+    chunks, size = {}, 0
+    for high in self._chunks.keys() & other._chunks.keys():
+      container, n = container_and(self._chunks[high], other._chunks[high])
+      if n:
+        chunks[high] = container
+        size += n
+    return Bitmap._from_chunks(chunks, size)
+  #
+  def __or__(self, other):
+    chunks = {high: container[:] for high, container in self._chunks.items()}
+    size = self._len
+    for high, container in other._chunks.items():
+      mine = chunks.get(high)
+      if mine is None:
+        chunks[high] = container[:]
+        size += container_size(container)
+      else:
+        size -= container_size(mine)
+        chunks[high], n = container_or(mine, container)
+        size += n
+    return Bitmap._from_chunks(chunks, size)
+  #
+  def __eq__(self, other):
+    if type(other) == Bitmap:
+      return self._len == other._len and all(a == b for a, b in zip(self, other))
+    return set(self) == other
+  #
+  def __repr__(self):
+    return 'Bitmap({})'.format(list(self))
+  #
+  def nbytes(self):
+    ''' The bytes held by the containers
+    '''
+    return sum(
+      len(container) if type(container) == bytearray else container.itemsize * len(container)
+      for container in self._chunks.values()
+    )
+
+def bitmap_intersection(bitmaps):
+  ''' A new Bitmap of the ids in all `bitmaps`, which are left untouched
+  '''
+  if len(bitmaps) == 1:
+    return bitmaps[0].copy()
+  return functools.reduce(operator.and_, sorted(bitmaps, key=len))
+
+def bitmap_union(bitmaps):
+  ''' A new Bitmap of the ids in any of `bitmaps`
+  '''
+  if len(bitmaps) == 1:
+    return bitmaps[0].copy()
+  return functools.reduce(operator.or_, bitmaps)
@@ -0,0 +1,96 @@
+import sys
+import threading
+import collections
+from jsonlddb.compiled import canonical_frame, compile_frame
+from jsonlddb.plan import base_predicate
+
+class FrameCache:
+  ''' An LRU cache of framed subjects bounded both by its number of entries
+  and the (approximate) bytes its results occupy.
+
+  Entries are keyed on the canonical frame, its params and the uids of
+  the indexes it was framed against. Each remembers the predicates its frame read and the
+  versions of those predicates in each index, so only writes to one of
+  those predicates invalidate it.
+
+  Entries hold the subjects in the order of iteration without a cache
+  (see `FramePlan.ordered`), e.g. best match first for `$text`.
+  '''
+  def __init__(self, max_entries=1024, max_bytes=64 * 2**20):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+  #
+  @staticmethod
+  def _versions(multi_index, preds):
+    return tuple(
+      index.versions.get(pred, 0)
+      for index in multi_index
+      for pred in preds
+    )
+  #
+  def frame(self, multi_index, frame, params=None):
+    ''' Like `jsonld_frame_with_multi_index` (`ordered`) but materialized
+    and cached
+    '''
+    compiled = compile_frame(frame)
+    key = (
+      canonical_frame(compiled.frame),
+      canonical_frame(params or {}),
+      tuple(index.uid for index in multi_index),
+    )
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        preds, versions, subjs, _ = entry
+        if self._versions(multi_index, preds) == versions:
+          self.hits += 1
+          self._entries.move_to_end(key)
+          return subjs
+        self.invalidations += 1
+        self._discard(key)
+      self.misses += 1
+    preds = tuple(sorted({base_predicate(pred) for pred in compiled.predicates()}))
+    versions = self._versions(multi_index, preds)
+    subjs = tuple(compiled.plan.ordered(compiled.context(multi_index, params)))
+    self._put(key, preds, versions, subjs)
+    return subjs
+  #
+  def _put(self, key, preds, versions, subjs):
+    size = sys.getsizeof(subjs)
+    if size > self.max_bytes:
+      return
+    with self._lock:
+      self._discard(key)
+      self._entries[key] = (preds, versions, subjs, size)
+      self.bytes += size
+      while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+        _, (_, _, _, evicted) = self._entries.popitem(last=False)
+        self.bytes -= evicted
+        self.evictions += 1
+  #
+  def _discard(self, key):
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self.bytes -= entry[3]
+  #
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.bytes = 0
+  #
+  def stats(self):
+    return {
+      'entries': len(self._entries),
+      'bytes': self.bytes,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'invalidations': self.invalidations,
+    }
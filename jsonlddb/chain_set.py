@@ -1,29 +1,82 @@
-import itertools
 import collections
+from jsonlddb.bitmap import Bitmap, bitmap_intersection, bitmap_union
+from jsonlddb.compact import PostingList
+from jsonlddb.index import SegmentedKeys
 
 dict_keys = type({}.keys())
-def is_set(v):
-  return type(v) in [set, dict_keys]
+# Inputs whose elements are all known (and can be tested for membership)
+#  are combined in bulk, anything else is consumed lazily
+materialized_types = frozenset([set, frozenset, dict_keys, PostingList, Bitmap, SegmentedKeys])
+def is_materialized(v):
+  return type(v) in materialized_types
+
+# Probing each element of a set against a posting list beats scanning the
+#  posting list once it is this many times larger
+probe_ratio = 16
 
 # These functions allow us to (hopefully efficiently) compute
-#  set union/intersections on sets or iterators or both
+#  set union/intersections on sets or iterators or both. Materialized
+#  inputs are combined with the builtin set operations (never in place)
+#  and only iterators are round-robined.
 
-def chain_set_union(generators):
-  # Process sets first
-  S = set()
-  iterators = collections.deque()
+def split_bitmaps(sets):
+  bitmaps, others = [], []
+  for s in sets:
+    (bitmaps if type(s) == Bitmap else others).append(s)
+  return bitmaps, others
+
+def set_union(sets):
+  bitmaps, others = split_bitmaps(sets)
+  if bitmaps and not others:
+    return bitmap_union(bitmaps)
+  return set().union(*sets)
+
+def set_intersection(sets):
+  ''' The intersection of materialized sets, smallest first
+  '''
+  bitmaps, others = split_bitmaps(sets)
+  if bitmaps:
+    # bitmaps intersect chunk by chunk without visiting their ids
+    bitmap = bitmap_intersection(bitmaps)
+    if not others:
+      return bitmap
+    sets = others + [bitmap]
+  sets = sorted(sets, key=len)
+  result = set(sets[0])
+  for other in sets[1:]:
+    if not result:
+      break
+    if type(other) in (set, frozenset):
+      result &= other
+    elif type(other) == dict_keys:
+      # iterates the smaller of the two
+      result = other & result
+    elif type(other) == Bitmap or len(other) > probe_ratio * len(result):
+      result = {v for v in result if v in other}
+    else:
+      result.intersection_update(other)
+  return result
+
+def partition(generators):
+  sets, iterators = [], collections.deque()
   for gen in generators:
-    if is_set(gen):
-      # Yield 'em as we get 'em
-      for s in gen - S:
-        yield s
-      S |= gen
+    if is_materialized(gen):
+      sets.append(gen)
     else:
       iterators.append(iter(gen))
-  # No actual iterators? we're already done
+  return sets, iterators
+
+def chain_set_union(generators):
+  sets, iterators = partition(generators)
+  # No actual iterators? union in bulk
   if not iterators:
-    return
-  # Otherwise return a generator which yields the current elements
+    return set_union(sets)
+  return lazy_union(set().union(*sets), iterators)
+
+def lazy_union(S, iterators):
+  # Yield 'em as we get 'em
+  yield from S
+  # Then round-robin the iterators
   while iterators:
     it = iterators.popleft()
     try:
@@ -36,53 +89,47 @@ def chain_set_union(generators):
       pass
 
 def chain_set_intersection(generators):
-  # Process sets first
-  S_ = None
-  # Record element hashes that are missing from some of the sets
-  impossible = set()
-  i = itertools.count()
-  iterators = collections.deque()
-  # Shortest to largest will be the most efficient way to process these
-  for gen in generators:
-    if is_set(gen):
-      if S_ is None:
-        S_ = gen
-      else:
-        impossible |= S_ - gen
-        S_ &= gen
-    else:
-      iterators.append((next(i), iter(gen)))
-  if S_ is None:
-    S_ = set()
+  sets, iterators = partition(generators)
+  S = set_intersection(sets) if sets else None
   # No actual iterators? just return the intersecting set
   if not iterators:
-    return S_
-  # Otherwise proceed with checking generators
-  if S_:
-    n_iterators = len(iterators) + 1
-    S = {s: {-1} for s in S_}
-  else:
-    n_iterators = len(iterators)
-    S = {}
-  #
-  def G():
-    while iterators:
-      i, it = iterators.popleft()
-      try:
-        v = next(it)
-        # only if we know it's not impossible
-        if v not in impossible:
-          # create a new element if it doesn't yet exist
-          if S.get(v) is None:
-            S[v] = set()
-          # has this iterator not registered this element yet?
-          if i not in S[v]:
-            S[v].add(i)
-            # all generators registered--we can yield it
-            if len(S[v]) == n_iterators:
-              yield v
-        iterators.append((i, it))
-      except StopIteration:
-        pass
-  #
-  return G()
+    return set() if S is None else S
+  # Nothing can intersect an empty set
+  if S is not None and not S:
+    return S
+  return lazy_intersection(S, iterators)
+
+def lazy_intersection(S, iterators):
+  ''' Round-robin the iterators yielding the elements seen in all of them
+  (and in S, the intersection of the materialized inputs, if any)
+  '''
+  n_iterators = len(iterators)
+  if n_iterators == 1:
+    # (the common case of a lazily filtered set) no bookkeeping needed
+    seen = set()
+    for v in iterators[0]:
+      if (S is None or v in S) and v not in seen:
+        seen.add(v)
+        yield v
+    return
+  iterators = collections.deque(enumerate(iterators))
+  # The iterators which have yielded each element so far
+  seen = {}
+  while iterators:
+    i, it = iterators.popleft()
+    try:
+      v = next(it)
+      # only if we know it's not impossible
+      if S is None or v in S:
+        registered = seen.get(v)
+        if registered is None:
+          registered = seen[v] = set()
+        # has this iterator not registered this element yet?
+        if i not in registered:
+          registered.add(i)
+          # all generators registered--we can yield it
+          if len(registered) == n_iterators:
+            yield v
+      iterators.append((i, it))
+    except StopIteration:
+      pass
@@ -0,0 +1,395 @@
+import array
+import bisect
+import itertools
+import threading
+from jsonlddb.index import index_uids, write_clock
+from jsonlddb.terms import TermDictionary
+
+def ids_array(values=()):
+  return array.array('q', values)
+
+def sorted_find(keys, key):
+  ''' Position of `key` in the sorted sequence `keys` or None
+  '''
+  i = bisect.bisect_left(keys, key)
+  return i if i < len(keys) and keys[i] == key else None
+
+def merge_sorted(items, changes):
+  ''' The sorted iterable `items` with the sorted [(item, insert)] `changes`
+  applied: items inserted are added unless present, those not inserted
+  are removed if present
+  '''
+  changes = iter(changes)
+  change = next(changes, None)
+  for item in items:
+    while change is not None and change[0] < item:
+      if change[1]:
+        yield change[0]
+      change = next(changes, None)
+    if change is not None and change[0] == item:
+      if change[1]:
+        yield item
+      change = next(changes, None)
+    else:
+      yield item
+  while change is not None:
+    if change[1]:
+      yield change[0]
+    change = next(changes, None)
+
+class PostingList:
+  ''' A read-only, sorted run of term ids
+  '''
+  __slots__ = ('ids',)
+  #
+  def __init__(self, ids):
+    self.ids = ids
+  #
+  def __len__(self):
+    return len(self.ids)
+  #
+  def __iter__(self):
+    return iter(self.ids)
+  #
+  def __contains__(self, id):
+    return sorted_find(self.ids, id) is not None
+  #
+  def __repr__(self):
+    return 'PostingList({})'.format(list(self.ids))
+
+class CompactMap:
+  ''' A read-only mapping of the sorted `keys` to the posting lists
+  `values[offsets[i]:offsets[i+1]]`, answering the same lookups as
+  one level of the dict-of-set indexes.
+  '''
+  def __init__(self, keys, offsets, values):
+    self._keys = keys
+    self._offsets = offsets
+    self._values = values
+  #
+  @staticmethod
+  def from_sorted(pairs):
+    ''' Build from (key, value) pairs sorted by key then value
+    '''
+    keys, offsets, values = ids_array(), ids_array([0]), ids_array()
+    for key, group in itertools.groupby(pairs, key=lambda kv: kv[0]):
+      keys.append(key)
+      values.extend(v for _, v in group)
+      offsets.append(len(values))
+    return CompactMap(memoryview(keys), memoryview(offsets), memoryview(values))
+  #
+  def _posting(self, i):
+    return PostingList(self._values[self._offsets[i]:self._offsets[i+1]])
+  #
+  def get(self, key, default=None):
+    i = sorted_find(self._keys, key)
+    return default if i is None else self._posting(i)
+  #
+  def __getitem__(self, key):
+    i = sorted_find(self._keys, key)
+    if i is None:
+      raise KeyError(key)
+    return self._posting(i)
+  #
+  def __contains__(self, key):
+    return sorted_find(self._keys, key) is not None
+  #
+  def __len__(self):
+    return len(self._keys)
+  #
+  def __iter__(self):
+    return iter(self._keys)
+  #
+  def keys(self):
+    return PostingList(self._keys)
+  #
+  def values(self):
+    for i in range(len(self._keys)):
+      yield self._posting(i)
+  #
+  def items(self):
+    return zip(self._keys, self.values())
+  #
+  def pairs(self):
+    ''' The (key, value) pairs in sorted order
+    '''
+    offsets, values = self._offsets, self._values
+    for i, key in enumerate(self._keys):
+      for value in values[offsets[i]:offsets[i+1]]:
+        yield key, value
+
+class CompactSPO(CompactMap):
+  ''' The subject table: `values` holds the objects of each subject
+  sorted by predicate, `preds` holds the matching predicate of each,
+  `get` groups these back into {pred: PostingList}.
+  '''
+  def __init__(self, keys, offsets, values, preds, pred_names):
+    CompactMap.__init__(self, keys, offsets, values)
+    self._preds = preds
+    self._pred_names = pred_names
+  #
+  @staticmethod
+  def from_sorted(triples, pred_names):
+    ''' Build from (subj, pred index, obj) triples in sorted order
+    '''
+    keys, offsets, values, preds = ids_array(), ids_array([0]), ids_array(), ids_array()
+    for subj, group in itertools.groupby(triples, key=lambda spo: spo[0]):
+      keys.append(subj)
+      for _, pred, obj in group:
+        preds.append(pred)
+        values.append(obj)
+      offsets.append(len(values))
+    return CompactSPO(
+      memoryview(keys), memoryview(offsets), memoryview(values),
+      memoryview(preds), pred_names,
+    )
+  #
+  def _posting(self, i):
+    po = {}
+    start = self._offsets[i]
+    hi = self._offsets[i+1]
+    while start < hi:
+      pred = self._preds[start]
+      end = bisect.bisect_right(self._preds, pred, start, hi)
+      po[self._pred_names[pred]] = PostingList(self._values[start:end])
+      start = end
+    return po
+  #
+  def triples(self):
+    ''' The (subj, pred, obj) triples in sorted order
+    '''
+    offsets, preds, values, pred_names = self._offsets, self._preds, self._values, self._pred_names
+    for i, subj in enumerate(self._keys):
+      for j in range(offsets[i], offsets[i+1]):
+        yield subj, pred_names[preds[j]], values[j]
+
+class CompactJsonLDIndex:
+  ''' A read-optimized alternative to JsonLDIndex storing each permutation
+  of the triples (SPO, POS and the inverse PSO used for `~pred`) as sorted
+  integer arrays with offset tables, costing ~32 bytes per triple.
+
+  `spo` and `pos` answer the same `get` lookups as the dict-of-set
+  indexes, but with read-only PostingLists. Writes are buffered and merged
+  into the arrays on the next read: each table written to is rebuilt by
+  merging it with the sorted buffered writes, so besides the buffer the
+  arrays of the tables being rebuilt are held twice while it runs (those
+  of predicates left untouched are kept as they are). This suits large,
+  mostly-static datasets loaded in big batches. Its `literal_index`es are
+  likewise rebuilt on the first lookup after a write to their predicate.
+
+  Built tables are never changed, so a `snapshot()` simply shares them.
+  Writers only hold the lock while queueing their encoded writes, the
+  merge is left to readers (serialized by a lock of their own), so
+  writers never wait for it.
+  '''
+  frozen = False
+  #
+  def __init__(self, triples=(), terms=None):
+    self.terms = TermDictionary() if terms is None else terms
+    self.uid = next(index_uids)
+    self.version = 0
+    self.versions = {}
+    self._pending = []
+    self._literal_indexes = {}
+    self._lock = threading.RLock()
+    self._merge_lock = threading.RLock()
+    # the version and versions of the tables (once merged)
+    self._merged = (0, {})
+    self._build(())
+    self.insert_triples(triples)
+  #
+  @staticmethod
+  def from_index(index):
+    ''' Compact an existing JsonLDIndex sharing its term dictionary
+    '''
+    compact = CompactJsonLDIndex(terms=index.terms)
+    compact._pending = [
+      (True, (subj, pred, obj))
+      for subj, po in index.spo.items()
+      for pred, objs in po.items()
+      for obj in objs
+    ]
+    return compact
+  #
+  @staticmethod
+  def from_tables(spo, pos, counts, terms):
+    ''' Wrap already built tables (e.g. those of a snapshot)
+    '''
+    compact = CompactJsonLDIndex(terms=terms)
+    compact._spo, compact._pos, compact._counts = spo, pos, counts
+    return compact
+  #
+  def _build(self, triples):
+    ''' Replace the tables with those of `triples`
+    '''
+    self._spo, self._pos, self._counts = CompactSPO.from_sorted((), []), {}, {}
+    self._merge(dict.fromkeys(triples, True))
+  #
+  def _merge(self, changes):
+    ''' Apply `changes` {(subj, pred, obj): insert} to the tables, merging
+    each of them with the changes to it in sorted order
+    '''
+    changes = sorted(changes.items())
+    old_spo, old_pos, old_counts = self._spo, self._pos, self._counts
+    pred_names = sorted(set(old_counts) | {pred for (_, pred, _), _ in changes})
+    pred_ids = {pred: i for i, pred in enumerate(pred_names)}
+    spo = CompactSPO.from_sorted(
+      (
+        (subj, pred_ids[pred], obj)
+        for subj, pred, obj in merge_sorted(old_spo.triples(), changes)
+      ),
+      pred_names,
+    )
+    # the (subj, obj) changes of each predicate, in sorted order
+    by_pred = {}
+    for (subj, pred, obj), insert in changes:
+      by_pred.setdefault(pred, []).append(((subj, obj), insert))
+    pos, counts = {}, {}
+    for pred in pred_names:
+      inverse = old_pos.get('~' + pred)
+      delta = by_pred.get(pred)
+      if delta is not None:
+        inverse = CompactMap.from_sorted(merge_sorted(() if inverse is None else inverse.pairs(), delta))
+        if not len(inverse):
+          continue
+        pos[pred] = CompactMap.from_sorted(merge_sorted(
+          old_pos[pred].pairs() if pred in old_counts else (),
+          sorted(((obj, subj), insert) for (subj, obj), insert in delta),
+        ))
+        counts[pred] = len(inverse._values)
+      elif inverse is not None:
+        pos[pred] = old_pos[pred]
+        counts[pred] = old_counts[pred]
+      else:
+        continue
+      pos['~' + pred] = inverse
+    self._spo, self._pos, self._counts = spo, pos, counts
+  #
+  def _compact(self):
+    ''' Merge the queued writes into the tables
+    '''
+    with self._merge_lock:
+      with self._lock:
+        pending, self._pending = self._pending, []
+        merged = (self.version, dict(self.versions))
+      if pending:
+        # the last write of each triple decides
+        changes = {}
+        for insert, triple in pending:
+          changes[triple] = insert
+        self._merge(changes)
+      self._merged = merged
+  #
+  @property
+  def spo(self):
+    if self._pending:
+      self._compact()
+    return self._spo
+  #
+  @property
+  def pos(self):
+    if self._pending:
+      self._compact()
+    return self._pos
+  #
+  @property
+  def counts(self):
+    if self._pending:
+      self._compact()
+    return self._counts
+  #
+  def snapshot(self):
+    ''' A read-only CompactJsonLDIndex of the triples as they are now
+    '''
+    if self.frozen:
+      return self
+    with self._merge_lock:
+      self._compact()
+      snapshot = CompactJsonLDIndex.from_tables(self._spo, self._pos, self._counts, self.terms)
+      snapshot.uid = self.uid
+      snapshot.version, snapshot.versions = self._merged
+      # entries are validated by the versions of their predicate
+      snapshot._literal_indexes = self._literal_indexes
+      snapshot.frozen = True
+      return snapshot
+  #
+  def insert_triples(self, triples):
+    if self.frozen:
+      raise Exception('Snapshots are read-only')
+    encode = self.terms.encode
+    pending = [(True, (encode(subj), pred, encode(obj))) for subj, pred, obj in triples]
+    self._queue(pending)
+    return self
+  #
+  def _queue(self, pending):
+    ''' Queue encoded (insert, triple) writes as one version
+    '''
+    with self._lock:
+      self.version += 1
+      for _, (_, pred, _) in pending:
+        self.versions[pred] = self.versions['@id'] = self.version
+      self._pending.extend(pending)
+      write_clock.tick()
+  #
+  def remove_triples(self, triples):
+    if self.frozen:
+      raise Exception('Snapshots are read-only')
+    lookup = self.terms.lookup
+    pending = []
+    for subj, pred, obj in triples:
+      subj, obj = lookup(subj), lookup(obj)
+      if subj is not None and obj is not None:
+        pending.append((False, (subj, pred, obj)))
+    self._queue(pending)
+    return self
+  #
+  def literal_index(self, pred, kind):
+    version = self.versions.get(pred)
+    cached = self._literal_indexes.get((pred, kind))
+    if cached is None or cached[0] != version:
+      cached = self._literal_indexes[(pred, kind)] = (version, kind.from_index(self, pred))
+    return cached[1]
+  #
+  def bulk_loader(self):
+    if self.frozen:
+      raise Exception('Snapshots are read-only')
+    return CompactBulkLoader(self)
+  #
+  def iter_spo(self):
+    ''' Iterate over (subj, {pred: [obj, ...]}) with ids decoded
+    '''
+    decode = self.terms.decode
+    for subj, po in self.spo.items():
+      yield decode(subj), {
+        pred: [decode(obj) for obj in objs]
+        for pred, objs in po.items()
+      }
+
+class CompactBulkLoader:
+  ''' JsonLDBulkLoader for a CompactJsonLDIndex, which buffers its writes
+  anyway: encoded triples are gathered, queued on `close` and compacted
+  on the next read.
+  '''
+  def __init__(self, index):
+    self.index = index
+    self.count = 0
+    self._pending = []
+  #
+  def __enter__(self):
+    return self
+  #
+  def __exit__(self, *args):
+    self.close()
+  #
+  def insert(self, triples):
+    pending = self._pending
+    for triple in triples:
+      pending.append((True, triple))
+      self.count += 1
+    return self
+  #
+  def close(self):
+    if self._pending is None:
+      return
+    pending, self._pending = self._pending, None
+    self.index._queue(pending)
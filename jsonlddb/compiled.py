@@ -0,0 +1,94 @@
+'''
+Frames compiled once into reusable plans.
+
+`compile_frame` parses a frame into a FramePlan a single time (frames are
+ compiled transparently, and remembered, by `jsonld_frame_with_multi_index`
+ and so `JsonLDFrame`). Literal values can be left as `Param` slots so
+ frames differing only in those values share one compiled plan:
+
+  by_email = {'@type': 'Person', 'email': Param('email')}
+  db[by_email].bind(email='p1@example.com')
+  jsonld_frame_with_multi_index([db.index], compile_frame(by_email), params={'email': ...})
+'''
+import weakref
+import threading
+import collections
+from jsonlddb.plan import FramePlan, PlanContext, Param, multi_index_terms
+
+def canonical_frame(frame):
+  ''' A hashable form of `frame` equal for equal frames regardless of key
+  order, keeping the types of literals apart (1, 1.0 and True differ).
+  '''
+  if type(frame) == dict:
+    return (dict, tuple(sorted(
+      ((k, canonical_frame(v)) for k, v in frame.items()),
+      key=lambda kv: kv[0],
+    )))
+  elif type(frame) == list:
+    return (list, tuple(canonical_frame(v) for v in frame))
+  else:
+    return (type(frame), frame)
+
+def bind_frame(frame, params):
+  ''' `frame` with its Params replaced by their values in `params`
+  '''
+  if type(frame) == dict:
+    return {k: bind_frame(v, params) for k, v in frame.items()}
+  elif type(frame) == list:
+    return [bind_frame(v, params) for v in frame]
+  elif type(frame) == Param:
+    return params[frame.name]
+  else:
+    return frame
+
+class CompiledFrame:
+  ''' A frame parsed into a FramePlan, executed any number of times against
+  any indexes with its Params bound to the `params` of each execution.
+  The term ids of its other values are looked up once per term dictionary.
+  '''
+  def __init__(self, frame):
+    self.frame = frame
+    self.plan = FramePlan.from_frame(frame)
+    self._static_ids = weakref.WeakKeyDictionary()
+    self._memo = None
+  #
+  def context(self, multi_index, params=None):
+    terms = multi_index_terms(multi_index)
+    static_ids = self._static_ids.get(terms)
+    if static_ids is None:
+      static_ids = self._static_ids[terms] = {}
+    # the plan of the last execution holds while the indexes are unchanged
+    key = (
+      tuple((index.uid, index.version) for index in multi_index),
+      canonical_frame(params) if params else None,
+    )
+    memo = self._memo
+    if memo is None or memo[0] != key:
+      memo = self._memo = (key, ({}, {}, {}))
+    return PlanContext(multi_index, params, static_ids, memo[1])
+  #
+  def predicates(self):
+    return self.plan.predicates()
+
+# Frames compiled by `compile_frame`, least recently used first
+compiled_frames = collections.OrderedDict()
+compiled_frames_lock = threading.Lock()
+max_compiled_frames = 1024
+
+def compile_frame(frame):
+  ''' The CompiledFrame of `frame`, shared by all equal frames
+  '''
+  if type(frame) == CompiledFrame:
+    return frame
+  key = canonical_frame(frame)
+  with compiled_frames_lock:
+    compiled = compiled_frames.get(key)
+    if compiled is not None:
+      compiled_frames.move_to_end(key)
+      return compiled
+  compiled = CompiledFrame(frame)
+  with compiled_frames_lock:
+    compiled_frames[key] = compiled
+    while len(compiled_frames) > max_compiled_frames:
+      compiled_frames.popitem(last=False)
+  return compiled
@@ -1,37 +1,91 @@
 import uuid
 import enum
+import hashlib
+import array
 import logging
-import collections
-import sortedcontainers
+import functools
+import itertools
 from jsonlddb import json
-from jsonlddb.chain_set import chain_set_union, chain_set_intersection
-from jsonlddb.index import JsonLDIndex
+from jsonlddb.compiled import compile_frame
+from jsonlddb.plan import multi_index_terms
 from jsonlddb.rdf import RDFTerm, RDFTermType
+from jsonlddb.terms import TermDictionary
 
+literal_types = frozenset([type(None), str, int, float, bool, uuid.UUID, RDFTerm])
 def isLiteral(v):
-  return type(v) in [type(None), str, int, float, bool, uuid.UUID, RDFTerm]
+  return type(v) in literal_types
 
 def force_list(v):
   return v if type(v) == list else [v]
 
-def canonical_uuid(j):
-  return uuid.uuid5(uuid.UUID('00000000-0000-0000-0000-000000000000'), json.dumps(j))
+# identical blank nodes recur often, skip re-hashing them
+@functools.lru_cache(maxsize=2**16)
+def uuid5(s):
+  return uuid.uuid5(uuid.UUID('00000000-0000-0000-0000-000000000000'), s)
 
-def jsonld_to_triples(jsonld):
+@functools.lru_cache(maxsize=2**16)
+def blake2b_uuid(s):
+  return uuid.UUID(bytes=hashlib.blake2b(s.encode(), digest_size=16).digest())
+
+def canonical_uuid(literals):
+  ''' The id of a node without an @id from its distinguishing `literals`
+  [(pred, value)]: the (SHA-1 based) uuid5 of their json encoding, so
+  nodes with the same literals (in the same order) are the same node
+  '''
+  return uuid5(json.canonical_dumps(literals))
+
+def canonical_blake2b(literals):
+  ''' `canonical_uuid` from a 128-bit blake2b hash, about twice as fast
+  but giving other ids: data must be identified with one or the other
+  throughout
+  '''
+  return blake2b_uuid(json.canonical_dumps(literals))
+
+def jsonld_id(value):
+  ''' The @id of the IRI `value`: blank nodes (identified by UUIDs, see
+  `canonical_uuid`) are labelled '_:<uuid>', which `jsonld_to_triples`
+  reads back as that UUID
+  '''
+  return '_:{}'.format(value) if type(value) == uuid.UUID else value
+
+def iri_value(id):
+  ''' The IRI value of the @id `id`, see `jsonld_id`
+  '''
+  if type(id) == str and id.startswith('_:'):
+    try:
+      value = uuid.UUID(id[2:])
+    except ValueError:
+      return id
+    if str(value) == id[2:]:
+      return value
+  return id
+
+iri_term = functools.partial(RDFTerm, RDFTermType.IRI)
+literal_term = functools.partial(RDFTerm, RDFTermType.LITERAL)
+
+def jsonld_to_triples(jsonld, iri=iri_term, literal=literal_term, canonical_id=canonical_uuid):
+  ''' Convert jsonld into (subj, pred, obj) triples, `iri` and `literal`
+  construct subjects/objects from their values: RDFTerms by default, term
+  ids when given e.g. TermDictionary.encode_iri/encode_literal.
+  `canonical_id` identifies nodes without an @id (see `canonical_uuid`),
+  '_:<uuid>' @ids refer to those (see `jsonld_id`).
+  '''
+  # (parent node, predicate, object) -- only the immediate parent is
+  #  needed to register a relationship
   Q = [
-    ([], None, obj)
+    (None, None, obj)
     for obj in (jsonld if type(jsonld) == list else [jsonld])
   ]
   warned = False
   while Q:
-    subjs, pred, obj = Q.pop()
+    parent, pred, obj = Q.pop()
     if type(obj) != dict:
       if type(obj) == list:
         if not warned:
           logging.warning('JSON-LD Formatting error, recovering by flattening list')
           warned = True
         Q += [
-          (subjs, pred, o)
+          (parent, pred, o)
           for o in obj
         ]
         continue
@@ -46,111 +100,105 @@ def jsonld_to_triples(jsonld):
     literals = []
     relationships = []
     for p, O in obj.items():
-      for o in force_list(O):
+      for o in (O if type(O) == list else (O,)):
         if p == '@id':
           assert existing_id is None, 'Only one @id is acceptable'
           existing_id = o
-        elif isLiteral(o):
+        elif type(o) in literal_types:
           literals.append((p, o))
         elif type(o) == dict and list(o.keys()) == ['@value']: # Force treat object as literal
           literals.append((p, json.JSON(o['@value'])))
         else:
           relationships.append((p, o))
     # construct a canonical id for the node using the distinguishing literals
-    node_id = RDFTerm(
-      RDFTermType.IRI,
-      existing_id if existing_id is not None else canonical_uuid(literals)
+    node_id = iri(
+      iri_value(existing_id) if existing_id is not None else canonical_id(literals)
     )
-    # register this relationship to its parent(s)
-    if subjs:
-      subj = subjs[-1]
-      yield (subj, pred, node_id)
-      # yield (subj, '*', node_id)
-      # for s in subjs:
-      #   yield (s, '**', node_id)
+    # register this relationship to its parent
+    if parent is not None:
+      yield (parent, pred, node_id)
     #
     # register this node's literals
     for p, o in literals:
-      yield (node_id, p, RDFTerm(RDFTermType.LITERAL, o))
+      yield (node_id, p, literal(o))
     # add the remaining object relationships to Q to be processed in future iterations
     Q += [
-      (subjs + [node_id], p, o)
+      (node_id, p, o)
       for p, o in relationships
     ]
 
-def pathset_from_object(obj):
-  Q = [
-    ([p], o)
-    for p, o in obj.items()
-  ]
-  while Q:
-    path, obj = Q.pop()
-    if type(obj) == dict and obj:
-      Q += [
-        (path + [p], o)
-        for p, o in obj.items()
-      ]
-    else:
-      yield path, obj
-
-def jsonld_resolve_frame_object_with_multi_index(multi_index, pred, obj):
-  if pred == '@id':
-    subj = RDFTerm(RDFTermType.IRI, obj)
-    return {subj} if any(subj in index.spo for index in multi_index) else set()
-  if obj == {}:
-    return chain_set_union(subjs for index in multi_index for subjs in index.pos.get(pred, {}).values())
-  else:
-    return chain_set_union(
-      index.pos.get(pred, {}).get(RDFTerm(RDFTermType.LITERAL, obj), set())
-      for index in multi_index
-    )
+def jsonld_to_encoded_triples(jsonld, canonical_id=canonical_uuid):
+  ''' The distinct triples of jsonld in a compact form suitable for shipping
+  between processes: (iris, values, preds, ids) where values lists the
+  distinct term values (iris flagging those which are IRIs), preds the
+  distinct predicates and ids holds flattened (subj, pred, obj) positions
+  into them.
+  '''
+  terms = TermDictionary()
+  preds = {}
+  seen = set()
+  ids = array.array('q')
+  for subj, pred, obj in jsonld_to_triples(jsonld, iri=terms.encode_iri, literal=terms.encode_literal, canonical_id=canonical_id):
+    p = preds.get(pred)
+    if p is None:
+      p = preds[pred] = len(preds)
+    triple = (subj, p, obj)
+    if triple not in seen:
+      seen.add(triple)
+      ids.extend(triple)
+  return (
+    bytes(term.type is RDFTermType.IRI for term in terms.terms),
+    [term.value for term in terms.terms],
+    list(preds),
+    ids,
+  )
 
-def jsonld_frame_with_multi_index(multi_index, frame):
+def jsonld_frame_with_multi_index(multi_index, frame, skip=0, limit=None, params=None, stream=False, ordered=False):
   '''
   This is the core of everything--the helper classes simply build off of
     frames.
-  
-  Here we use lambda for lazy evaluation; the result is that this function actually
-   just prepares the necessary lookups, but we ultimately compute all intersections
-   at the same time -- this should help with reducing the amount of memory
-   being used as well as helping with CPU optimizations.
+
+  The frame is planned (see `jsonlddb.plan`) against the statistics of the
+   indexes, most selective constraints first, and evaluated lazily with
+   generators where possible -- this should help with reducing the amount
+   of memory being used as well as helping with CPU optimizations.
+
+  Frames are compiled once (see `jsonlddb.compiled`), `params` binding
+   the values of their Params.
+
+  With a `limit` only the subjects `skip:skip+limit` are produced, pipelined
+   so that evaluation stops once they are, as are all of them with
+   `stream`. Otherwise the subjects are computed in bulk, in another order
+   unless `ordered`: streamed subjects and `ordered` ones come in the same
+   order whatever the skip and limit (see `FramePlan.ordered`).
+
+  Subjects are produced as term ids, see `multi_index_terms` to decode them.
   '''
-  # S looks like: (sizeof(path), path): lazy[possible_subjects]
-  # sizeof(path) is what orders our dict.
-  S = sortedcontainers.SortedDict()
-  for path, obj in pathset_from_object(frame):
-    key = (len(path[:-1]), tuple(path[:-1]))
-    s = lambda _p=path[-1], _o=force_list(obj): chain_set_union(
-      jsonld_resolve_frame_object_with_multi_index(multi_index, _p, o)
-      for o in _o
-    )
-    if S.get(key) is None:
-      S[key] = s
-    else:
-      S[key] = lambda _s=s, __s=S[key]: chain_set_intersection((_s(), __s()))
-  #
-  # Each iteration we pop one of the largest paths
-  #  and intersect it with its parent, Once we get an
-  #  empty path length we're done.
-  while S:
-    (L, path), subjs = S.popitem()
-    if L == 0:
-      return subjs()
-    parent = tuple(path[:-1])
-    pred = path[-1]
-    #
-    s = lambda _s=subjs, _p=pred: chain_set_union(
-      index.pos.get(_p, {}).get(o, set())
-      for index in multi_index
-      for o in _s()
-    )
-    if S.get((L-1, parent)) is None:
-      S[(L-1, parent)] = s
-    else:
-      S[(L-1, parent)] = lambda _s=S[(L-1, parent)], __s=s: chain_set_intersection((_s(), __s()))
-  # If we got here, then S is empty, meaning the frame is empty,
-  #  meaning we actually just want all subjects.
-  return chain_set_union(
-    index.spo.keys()
-    for index in multi_index
-  )
+  compiled = compile_frame(frame)
+  ctx = compiled.context(multi_index, params)
+  if limit is None and not skip and not stream:
+    return compiled.plan.ordered(ctx) if ordered else compiled.plan.subjects(ctx)
+  return itertools.islice(compiled.plan.stream(ctx), skip, None if limit is None else skip + limit)
+
+def jsonld_count_with_multi_index(multi_index, frame, params=None, sized_only=False):
+  ''' The number of subjects `jsonld_frame_with_multi_index` produces. With
+  `sized_only` None when the sizes of the index don't give it, rather than
+  evaluating the frame.
+  '''
+  compiled = compile_frame(frame)
+  ctx = compiled.context(multi_index, params)
+  if sized_only and not compiled.plan.sized(ctx):
+    return None
+  return compiled.plan.cardinality(ctx)
+
+def jsonld_estimate_with_multi_index(multi_index, frame, params=None):
+  ''' The planner's estimate of that number, from index statistics only
+  '''
+  compiled = compile_frame(frame)
+  return compiled.context(multi_index, params).estimate(compiled.plan)
+
+def jsonld_explain_with_multi_index(multi_index, frame, params=None):
+  ''' Describe how `jsonld_frame_with_multi_index` evaluates `frame`
+  '''
+  compiled = compile_frame(frame)
+  return compiled.plan.explain(compiled.context(multi_index, params))
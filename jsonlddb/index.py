@@ -1,37 +1,572 @@
-def dds_insert(d, s, p, o):
+import weakref
+import itertools
+import threading
+from jsonlddb.bitmap import Bitmap
+from jsonlddb.terms import TermDictionary
+
+# Distinguishes indexes for the lifetime of the process (unlike `id`)
+index_uids = itertools.count()
+
+class WriteClock:
+  ''' Counts the writes to all indexes, so views over several of them (see
+  `jsonlddb.overlay`) needn't look for changes in each while it stands still
+  '''
+  def __init__(self):
+    self.time = 0
+  #
+  def tick(self):
+    self.time += 1
+
+write_clock = WriteClock()
+
+# Segments of a SegmentedMap hold the ids sharing their high bits
+segment_bits = 8
+# Segments of a HashedSegmentedMap, by the low bits of the key hashes
+segment_mask = 0xff
+
+class SegmentedKeys:
+  ''' The keys of a SegmentedMap, materialized like dict keys
+  '''
+  __slots__ = ('_map',)
+  #
+  def __init__(self, map):
+    self._map = map
+  #
+  def __len__(self):
+    return len(self._map)
+  #
+  def __contains__(self, key):
+    return key in self._map
+  #
+  def __iter__(self):
+    return iter(self._map)
+
+class SegmentedMap:
+  ''' A dict of term ids split into segments, the dicts of the ids sharing
+  `id >> segment_bits`. A copy shares the segments and either copies a
+  segment before writing to it, so copies cost what is written to them
+  rather than the size of the map.
+  '''
+  __slots__ = ('_segments', '_owned', '_len')
+  #
+  def __init__(self, items=()):
+    self._segments = {}
+    # the segments written since the last copy
+    self._owned = set()
+    self._len = 0
+    for key, value in items:
+      self[key] = value
+  #
+  @staticmethod
+  def _segment(key):
+    return key >> segment_bits
+  #
+  def copy(self):
+    copy = self.__class__()
+    copy._segments = self._segments.copy()
+    copy._len = self._len
+    # both now share every segment
+    self._owned = set()
+    return copy
+  #
+  def _writable(self, n):
+    segment = self._segments.get(n)
+    if segment is None:
+      segment = self._segments[n] = {}
+    elif n in self._owned:
+      return segment
+    else:
+      segment = self._segments[n] = segment.copy()
+    self._owned.add(n)
+    return segment
+  #
+  def get(self, key, default=None):
+    segment = self._segments.get(key >> segment_bits)
+    return default if segment is None else segment.get(key, default)
+  #
+  def __getitem__(self, key):
+    return self._segments.get(key >> segment_bits, empty_segment)[key]
+  #
+  def __contains__(self, key):
+    return key in self._segments.get(key >> segment_bits, empty_segment)
+  #
+  def __setitem__(self, key, value):
+    segment = self._writable(self._segment(key))
+    if key not in segment:
+      self._len += 1
+    segment[key] = value
+  #
+  def __delitem__(self, key):
+    n = self._segment(key)
+    if key not in self._segments.get(n, empty_segment):
+      raise KeyError(key)
+    segment = self._writable(n)
+    del segment[key]
+    self._len -= 1
+    if not segment:
+      del self._segments[n]
+      self._owned.discard(n)
+  #
+  def add_to_sets(self, pairs, owned):
+    ''' Add the value of each (key, value) of `pairs` to the set self[key],
+    made when absent and copied when its id isn't `owned` (see
+    `dds_writable`), returning the keys which were absent
+    '''
+    added = []
+    last_n = segment = None
+    for key, value in pairs:
+      n = self._segment(key)
+      if n != last_n:
+        segment, last_n = self._writable(n), n
+      values = segment.get(key)
+      if values is None:
+        values = segment[key] = set()
+        owned.add(id(values))
+        added.append(key)
+      elif id(values) not in owned:
+        values = segment[key] = values.copy()
+        owned.add(id(values))
+      values.add(value)
+    self._len += len(added)
+    return added
+  #
+  def __len__(self):
+    return self._len
+  #
+  def __iter__(self):
+    for segment in self._segments.values():
+      yield from segment
+  #
+  def keys(self):
+    return SegmentedKeys(self)
+  #
+  def values(self):
+    for segment in self._segments.values():
+      yield from segment.values()
+  #
+  def items(self):
+    for segment in self._segments.values():
+      yield from segment.items()
+  #
+  def __eq__(self, other):
+    return dict(self.items()) == (dict(other.items()) if isinstance(other, SegmentedMap) else other)
+  #
+  def __repr__(self):
+    return '{}({})'.format(self.__class__.__name__, dict(self.items()))
+
+empty_segment = {}
+
+class HashedSegmentedMap(SegmentedMap):
+  ''' A SegmentedMap of any keys, spread over a fixed number of segments
+  by their hashes
+  '''
+  __slots__ = ()
+  #
+  @staticmethod
+  def _segment(key):
+    return hash(key) & segment_mask
+  #
+  def get(self, key, default=None):
+    segment = self._segments.get(hash(key) & segment_mask)
+    return default if segment is None else segment.get(key, default)
+  #
+  def __getitem__(self, key):
+    return self._segments.get(hash(key) & segment_mask, empty_segment)[key]
+  #
+  def __contains__(self, key):
+    return key in self._segments.get(hash(key) & segment_mask, empty_segment)
+
+def dds_writable(d, k, empty, owned):
+  ''' d[k] to write to: made with `empty` when absent and copied when a
+  snapshot shares it, i.e. when its id isn't `owned`
+  '''
+  child = d.get(k)
+  if child is None:
+    child = d[k] = empty()
+  elif id(child) in owned:
+    return child
+  else:
+    child = d[k] = child.copy()
+  owned.add(id(child))
+  return child
+
+def dds_insert(d, s, p, o, owned=None, empty=dict):
+  ''' Insert o into d[s][p], d[s] being made with `empty`, returning
+  whether it was absent. With `owned` (see `dds_writable`) containers
+  shared with snapshots are copied first.
+  '''
+  if owned is not None:
+    objs = d.get(s, empty_segment).get(p)
+    if objs is not None and o in objs:
+      return False
+    dds_writable(dds_writable(d, s, empty, owned), p, set, owned).add(o)
+    return True
   if d.get(s) is None:
-    d[s] = {}
+    d[s] = empty()
   if d[s].get(p) is None:
     d[s][p] = set()
+  if o in d[s][p]:
+    return False
   d[s][p].add(o)
+  return True
 
-def dds_remove(d, s, p, o):
-  if d.get(s) is not None and d[s].get(p) is not None:
+def dds_remove(d, s, p, o, owned=None):
+  ''' Remove o from d[s][p], returning whether it was present
+  '''
+  objs = d.get(s, empty_segment).get(p)
+  if objs is not None and o in objs:
+    if owned is not None:
+      dds_writable(dds_writable(d, s, dict, owned), p, set, owned)
     d[s][p].remove(o)
     if not d[s][p]:
       del d[s][p]
       if not d[s]:
         del d[s]
+    return True
+  return False
+
+def dds_changes(old, new):
+  ''' The (removed, added) (s, p, o) of two versions of a SegmentedMap
+  dict of dicts of sets, `new` written since `old` was copied: only the
+  segments and containers the writes copied (see `dds_writable`) are
+  compared
+  '''
+  removed, added = [], []
+  empty = frozenset()
+  for n in old._segments.keys() | new._segments.keys():
+    old_segment, new_segment = old._segments.get(n, empty_segment), new._segments.get(n, empty_segment)
+    if old_segment is new_segment:
+      continue
+    for s in old_segment.keys() | new_segment.keys():
+      old_po, new_po = old_segment.get(s, empty_segment), new_segment.get(s, empty_segment)
+      if old_po is new_po:
+        continue
+      for p in old_po.keys() | new_po.keys():
+        old_objs, new_objs = old_po.get(p, empty), new_po.get(p, empty)
+        if old_objs is not new_objs:
+          removed.extend((s, p, o) for o in old_objs - new_objs)
+          added.extend((s, p, o) for o in new_objs - old_objs)
+  return removed, added
 
 class JsonLDIndex:
-  def __init__(self, spo=None, pos=None):
-    self.spo = {} if spo is None else spo
-    self.pos = {} if pos is None else pos
+  ''' spo & pos hash indexes over term ids, `terms` is the TermDictionary
+  used to translate RDFTerms to and from those ids (a new one by default,
+  indexes framed together without translation must share one). spo and
+  the maps of pos are SegmentedMaps.
+
+  `counts` holds the number of triples of each predicate; together with
+  the posting list sizes in `pos` these are the cardinality statistics
+  used for frame planning.
+
+  `uid` identifies the index and `version` is bumped by every write, so
+  (uid, version) pins its contents for caching. `versions` records the
+  version at which each predicate was last written ('@id' standing for
+  the set of subjects) so that caches can invalidate only what a write
+  touched.
+
+  The subjects of a predicate/object pair are stored in a compressed
+  Bitmap rather than a set once there are `bitmap_fanout` of them (None
+  never uses bitmaps).
+
+  `literal_index(pred, kind)` is a secondary index of the literal objects
+  of `pred` for frame operators: SortedLiterals (by value, for ranges and
+  prefixes) or TextIndex (by word, for `$text`). Each is built the first
+  time it is asked for and maintained by writes from then on.
+
+  `snapshot()` is a read-only view of the index as of the last write.
+  Every write ends by publishing one, which later writes leave untouched:
+  they copy the segments, posting lists and literal index chunks they
+  change rather than writing to them, so a write costs what it changes
+  and versions nobody reads are reclaimed by the garbage collector.
+  Writes are serialized, taking or reading a snapshot never waits.
+  '''
+  frozen = False
+  #
+  def __init__(self, spo=None, pos=None, terms=None, bitmap_fanout=1024):
+    self.spo = SegmentedMap(() if spo is None else spo.items())
+    self.pos = {
+      pred: SegmentedMap(objs.items())
+      for pred, objs in ({} if pos is None else pos).items()
+    }
+    self.terms = TermDictionary() if terms is None else terms
+    self.bitmap_fanout = bitmap_fanout
+    self.counts = {
+      pred: sum(len(subjs) for subjs in objs.values())
+      for pred, objs in self.pos.items()
+      if not pred.startswith('~')
+    }
+    self.uid = next(index_uids)
+    self.version = 0
+    self.versions = {}
+    # pred -> {kind: literal index}
+    self._literal_indexes = {}
+    self._lock = threading.RLock()
+    # the ids of the containers made or copied by the write in progress
+    #  (None between writes)
+    self._owned = None
+    self._published = JsonLDIndexSnapshot(self)
+  #
+  def literal_index(self, pred, kind):
+    indexes = self._literal_indexes.get(pred)
+    if indexes is None:
+      indexes = self._literal_indexes[pred] = {}
+    literal_index = indexes.get(kind)
+    if literal_index is None:
+      literal_index = indexes[kind] = kind.from_index(self, pred)
+    return literal_index
+  #
+  def _adopt_literal_index(self, pred, kind, literal_index, version):
+    ''' Maintain `literal_index` built by a snapshot at `version` from now
+    on, unless a write is in progress (the snapshot doesn't wait for it)
+    '''
+    if not self._lock.acquire(blocking=False):
+      return
+    try:
+      indexes = self._literal_indexes.get(pred)
+      if indexes is None:
+        indexes = self._literal_indexes[pred] = {}
+      if self.version == version and kind not in indexes:
+        indexes[kind] = literal_index
+    finally:
+      self._lock.release()
+  #
+  def _writable_literal_indexes(self, pred):
+    ''' The literal indexes of `pred` to write to, see `dds_writable`
+    '''
+    literal_indexes = self._literal_indexes.get(pred)
+    owned = self._owned
+    if literal_indexes and owned is not None:
+      for kind, literal_index in literal_indexes.items():
+        if id(literal_index) not in owned:
+          literal_index = literal_indexes[kind] = literal_index.copy()
+          owned.add(id(literal_index))
+    return literal_indexes
+  #
+  def snapshot(self):
+    ''' A read-only JsonLDIndex of the triples as of the last write
+    '''
+    return self._published
+  #
+  def _begin_write(self):
+    ''' Prepare to write, holding the lock: everything the published
+    snapshot shares is copied when written
+    '''
+    self._owned = set()
+    self.spo = self.spo.copy()
+    self.pos = dict(self.pos)
+  #
+  def _publish(self):
+    ''' End a write, publishing its snapshot
+    '''
+    self._owned = None
+    self._published = JsonLDIndexSnapshot(self)
+    write_clock.tick()
   #
   def insert_triples(self, triples):
-    for subj, pred, obj in triples:
-      dds_insert(self.spo, subj, pred, obj)
-      # dds_insert(self.spo, obj, '~'+pred, subj)
-      dds_insert(self.pos, pred, obj, subj)
-      dds_insert(self.pos, '~'+pred, subj, obj)
-    #
+    with self._lock:
+      self._begin_write()
+      self.version += 1
+      version = self.version
+      owned = self._owned
+      encode = self.terms.encode
+      for subj, pred, term in triples:
+        subj, obj = encode(subj), encode(term)
+        if subj not in self.spo:
+          self.versions['@id'] = version
+        if dds_insert(self.spo, subj, pred, obj, owned):
+          self.counts[pred] = self.counts.get(pred, 0) + 1
+          self.versions[pred] = version
+        # dds_insert(self.spo, obj, '~'+pred, subj)
+        if self._literal_indexes.get(pred) and obj not in self.pos.get(pred, empty_segment):
+          for literal_index in self._writable_literal_indexes(pred).values():
+            literal_index.add(term, obj)
+        if dds_insert(self.pos, pred, obj, subj, owned, SegmentedMap) and self.bitmap_fanout is not None:
+          subjs = self.pos[pred][obj]
+          if len(subjs) == self.bitmap_fanout and type(subjs) == set:
+            self.pos[pred][obj] = Bitmap(subjs)
+        dds_insert(self.pos, '~'+pred, subj, obj, owned, SegmentedMap)
+      #
+      self._publish()
     return self
   #
   def remove_triples(self, triples):
+    with self._lock:
+      self._begin_write()
+      self.version += 1
+      version = self.version
+      owned = self._owned
+      lookup = self.terms.lookup
+      for subj, pred, term in triples:
+        subj, obj = lookup(subj), lookup(term)
+        if subj is None or obj is None:
+          continue
+        if dds_remove(self.spo, subj, pred, obj, owned):
+          self.counts[pred] -= 1
+          if not self.counts[pred]:
+            del self.counts[pred]
+          self.versions[pred] = version
+          if subj not in self.spo:
+            self.versions['@id'] = version
+        # dds_remove(self.spo, obj, '~'+pred, subj)
+        dds_remove(self.pos, pred, obj, subj, owned)
+        dds_remove(self.pos, '~'+pred, subj, obj, owned)
+        if self._literal_indexes.get(pred) and obj not in self.pos.get(pred, empty_segment):
+          for literal_index in self._writable_literal_indexes(pred).values():
+            literal_index.discard(term, obj)
+      #
+      self._publish()
+    return self
+  #
+  def iter_spo(self):
+    ''' Iterate over (subj, {pred: [obj, ...]}) with ids decoded
+    '''
+    decode = self.terms.decode
+    for subj, po in self.spo.items():
+      yield decode(subj), {
+        pred: [decode(obj) for obj in objs]
+        for pred, objs in po.items()
+      }
+  #
+  def bulk_loader(self):
+    return JsonLDBulkLoader(self)
+
+class JsonLDIndexSnapshot(JsonLDIndex):
+  ''' The read-only snapshot of a JsonLDIndex (see `JsonLDIndex.snapshot`),
+  with its uid and version
+  '''
+  frozen = True
+  #
+  def __init__(self, index):
+    # writes replace these rather than changing them
+    self.spo = index.spo
+    self.pos = index.pos
+    self.terms = index.terms
+    self.bitmap_fanout = index.bitmap_fanout
+    self.counts = dict(index.counts)
+    self.uid = index.uid
+    self.version = index.version
+    self.versions = dict(index.versions)
+    self._literal_indexes = {
+      pred: dict(indexes)
+      for pred, indexes in index._literal_indexes.items()
+    }
+    self._index = weakref.ref(index)
+  #
+  def literal_index(self, pred, kind):
+    indexes = self._literal_indexes.get(pred)
+    if indexes is None:
+      indexes = self._literal_indexes[pred] = {}
+    literal_index = indexes.get(kind)
+    if literal_index is None:
+      literal_index = indexes[kind] = kind.from_index(self, pred)
+      # saves building it for the next snapshots
+      index = self._index()
+      if index is not None:
+        index._adopt_literal_index(pred, kind, literal_index, self.version)
+    return literal_index
+  #
+  def snapshot(self):
+    return self
+  #
+  def insert_triples(self, triples):
+    raise Exception('Snapshots are read-only')
+  #
+  def remove_triples(self, triples):
+    raise Exception('Snapshots are read-only')
+  #
+  def bulk_loader(self):
+    raise Exception('Snapshots are read-only')
+
+class JsonLDBulkLoader:
+  ''' Insert large amounts of encoded (subj id, pred, obj id) triples into
+  a JsonLDIndex. spo is filled as triples arrive, reusing the entries of
+  consecutive triples which share a subject and predicate, while pos and
+  its `~` inverses are built for all new triples in a single pass on
+  `close`, which publishes the loaded triples. Snapshots taken meanwhile
+  see the index as it was, other writes wait for the loader to be closed.
+  '''
+  def __init__(self, index):
+    self.index = index
+    self.count = 0
+    self._added = {}
+    self._new_subjects = False
+    index._lock.acquire()
+    index._begin_write()
+    index.version += 1
+  #
+  def __enter__(self):
+    return self
+  #
+  def __exit__(self, *args):
+    self.close()
+  #
+  def insert(self, triples):
+    spo = self.index.spo
+    owned = self.index._owned
+    added = self._added
+    last_subj = last_pred = po = objs = subjs_added = objs_added = None
+    count = 0
     for subj, pred, obj in triples:
-      dds_remove(self.spo, subj, pred, obj)
-      # dds_remove(self.spo, obj, '~'+pred, subj)
-      dds_remove(self.pos, pred, obj, subj)
-      dds_remove(self.pos, '~'+pred, subj, obj)
-    #
+      count += 1
+      # containers made here are copied once if written to again later,
+      #  which is rarer than recording them in `owned`
+      if subj != last_subj:
+        po = spo.get(subj)
+        if po is None:
+          po = spo[subj] = {}
+          self._new_subjects = True
+        elif id(po) not in owned:
+          po = dds_writable(spo, subj, dict, owned)
+        last_subj, last_pred = subj, None
+      if pred != last_pred:
+        objs = po.get(pred)
+        if objs is None:
+          objs = po[pred] = set()
+        elif id(objs) not in owned:
+          objs = dds_writable(po, pred, set, owned)
+        if added.get(pred) is None:
+          added[pred] = ([], [])
+        subjs_added, objs_added = added[pred]
+        last_pred = pred
+      if obj not in objs:
+        objs.add(obj)
+        subjs_added.append(subj)
+        objs_added.append(obj)
+    self.count += count
     return self
+  #
+  def close(self):
+    if self._added is None:
+      return
+    try:
+      self._close()
+    finally:
+      self._added = None
+      self.index._publish()
+      self.index._lock.release()
+  #
+  def _close(self):
+    index = self.index
+    owned = index._owned
+    index.version += 1
+    version = index.version
+    for pred, (subjs_added, objs_added) in self._added.items():
+      os = dds_writable(index.pos, pred, SegmentedMap, owned)
+      so = dds_writable(index.pos, '~' + pred, SegmentedMap, owned)
+      new_objs = os.add_to_sets(zip(objs_added, subjs_added), owned)
+      so.add_to_sets(zip(subjs_added, objs_added), owned)
+      literal_indexes = index._writable_literal_indexes(pred)
+      if literal_indexes:
+        for obj in new_objs:
+          term = index.terms.decode(obj)
+          for literal_index in literal_indexes.values():
+            literal_index.add(term, obj)
+      if index.bitmap_fanout is not None:
+        for obj in set(objs_added):
+          subjs = os[obj]
+          if len(subjs) >= index.bitmap_fanout and type(subjs) == set:
+            os[obj] = Bitmap(subjs)
+      index.counts[pred] = index.counts.get(pred, 0) + len(subjs_added)
+      index.versions[pred] = version
+    if self._new_subjects:
+      index.versions['@id'] = version
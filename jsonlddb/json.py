@@ -1,4 +1,5 @@
 import json
+import json.encoder
 import functools
 from jsonlddb.rdf import RDFTerm, RDFTermType
 
@@ -25,15 +26,119 @@ def prepare(o):
   else:
     return o
 
+def prepared_term(o, terms=None):
+  ''' The RDFTerm `o` was prepared from: an IRI or a literal wrapped in a
+  list (a tuple from msgpack), interned in the TermDictionary `terms`
+  if given
+  '''
+  if not isinstance(o, (list, tuple)):
+    return RDFTerm(RDFTermType.IRI, o) if terms is None else terms.intern_iri(o)
+  value = JSON(o[0]) if isinstance(o[0], (dict, list)) else o[0]
+  return RDFTerm(RDFTermType.LITERAL, value) if terms is None else terms.intern_literal(value)
+
+def prepare_default(o):
+  ''' `prepare` for the objects json can't serialize itself (used as the
+  json.dumps `default` hook)
+  '''
+  if isinstance(o, (JSON, RDFTerm, set)):
+    return prepare(o)
+  raise TypeError('Object of type {} is not JSON serializable'.format(type(o).__name__))
+
+def _dumps(obj, **kwargs):
+  try:
+    # avoids copying obj with `prepare` when only values need preparing
+    return json.dumps(obj, default=prepare_default, **kwargs)
+  except TypeError:
+    return json.dumps(prepare(obj), **kwargs)
+
+# a reusable C encoder producing the output of `_dumps`, json.dumps
+#  builds a new one for every call which costs more than encoding small
+#  values
+_c_encoder = json.encoder.c_make_encoder and json.encoder.c_make_encoder(
+  None, prepare_default, json.encoder.c_encode_basestring_ascii, None,
+  ': ', ', ', False, False, True,
+)
+
+def canonical_dumps(obj):
+  ''' `dumps(obj)`, faster for the many small values it is used to identify
+  '''
+  if _c_encoder is None:
+    return _dumps(obj)
+  try:
+    return ''.join(_c_encoder(obj, 0))
+  except TypeError:
+    return json.dumps(prepare(obj))
+
+def iter_items(fp, chunk_size=2**16):
+  ''' Iterate over the (key, value) pairs of the JSON object in the text
+  file `fp`, reading it `chunk_size` characters at a time so that only
+  one value at a time is held in memory.
+  '''
+  decoder = json.JSONDecoder()
+  buf, pos, eof = '', 0, False
+  def read():
+    nonlocal buf, pos, eof
+    # read at least as much as is buffered to keep retries of long values linear
+    chunk = fp.read(max(chunk_size, len(buf) - pos))
+    eof = not chunk
+    buf, pos = buf[pos:] + chunk, 0
+  def token():
+    ''' The next non-whitespace character
+    '''
+    nonlocal pos
+    while True:
+      while pos < len(buf) and buf[pos] in ' \t\n\r':
+        pos += 1
+      if pos < len(buf):
+        return buf[pos]
+      if eof:
+        raise json.JSONDecodeError('Unexpected end of data', buf, pos)
+      read()
+  def value():
+    nonlocal pos
+    token()
+    while True:
+      try:
+        v, end = decoder.raw_decode(buf, pos)
+        # a value ending the buffer (e.g. a number) could still be cut short
+        if end < len(buf) or eof:
+          pos = end
+          return v
+      except json.JSONDecodeError:
+        if eof:
+          raise
+      read()
+  def expect(chars):
+    nonlocal pos
+    c = token()
+    if c not in chars:
+      raise json.JSONDecodeError('Expecting one of {!r}'.format(chars), buf, pos)
+    pos += 1
+    return c
+  expect('{')
+  if token() == '}':
+    return
+  while True:
+    k = value()
+    expect(':')
+    yield k, value()
+    if expect(',}') == '}':
+      return
+
 load = json.load
 loads = json.loads
 dump = lambda obj, fp, **kwargs: json.dump(prepare(obj), fp, **kwargs)
-dumps = lambda obj, **kwargs: json.dumps(prepare(obj), **kwargs)
+dumps = _dumps
 
 class JSON(object):
   ''' Use an object normally in python with awareness that it should
   be json, allowing us to hash/serialize it using json methods.
+
+  The hash is computed once, values mustn't be mutated in place after
+  being hashed (e.g. once used in a triple) except through `__setitem__`.
   '''
+  _hash = None
+  #
   def __init__(self, value):
     self.value = value
   #
@@ -41,7 +146,9 @@ class JSON(object):
     return dumps(self.value)
   #
   def __hash__(self):
-    return hash(dumps(self.value))
+    if self._hash is None:
+      self._hash = hash(canonical_dumps(self.value))
+    return self._hash
   #
   def __repr__(self):
     return repr(self.value)
@@ -51,6 +158,11 @@ class JSON(object):
   #
   def __setitem__(self, k, v):
     self.value[k] = v
+    self._hash = None
+  #
+  def __getstate__(self):
+    # hashes of strings differ between processes
+    return {'value': self.value}
   #
   def __eq__(self, other):
     if isinstance(other, JSON):
@@ -60,5 +172,6 @@ class JSON(object):
   def __getattribute__(self, attr):
     try:
       return object.__getattribute__(self, attr)
-    except:
-      return self.value.__getattribute__(attr)
+    except AttributeError:
+      # `value` is absent while unpickling
+      return object.__getattribute__(self, 'value').__getattribute__(attr)
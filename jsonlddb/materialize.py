@@ -0,0 +1,136 @@
+'''
+Nodes rendered as nested documents straight from the indexes, for the
+ reprs of JsonLDFrames and JsonLDNodes and for `to_jsonld` exports.
+
+Navigating a node one predicate at a time frames `{'~pred': frame}` for
+ each of them, resolving the frame above it again. A Materializer instead
+ reads the objects of each subject from `spo` and renders a node once per
+ depth, sharing that rendering wherever the node recurs.
+'''
+import itertools
+from jsonlddb import json
+from jsonlddb.core import jsonld_id
+from jsonlddb.plan import multi_index_terms
+from jsonlddb.rdf import RDFTerm, RDFTermType
+
+class Ellipse:
+  def __repr__(self):
+    return '...'
+  def __str__(self):
+    return '...'
+ellipse = Ellipse()
+
+def is_shown(pred):
+  return pred not in ['*', '**'] and not pred.startswith('~')
+
+def copy_value(value):
+  ''' A copy of the dicts and lists of the json `value`
+  '''
+  if type(value) == dict:
+    return {key: copy_value(v) for key, v in value.items()}
+  elif type(value) == list:
+    return [copy_value(v) for v in value]
+  return value
+
+class Materializer:
+  ''' Renders subjects (term ids) of the indexes `multi_index`, `limit`
+  predicates of a node and objects of a predicate at a time in reprs
+  '''
+  def __init__(self, multi_index, limit=10):
+    self.multi_index = multi_index
+    self.limit = limit
+    self.terms = multi_index_terms(multi_index)
+    # (subj, depth) -> rendering
+    self._reprs = {}
+    self._documents = {}
+  #
+  def lookup_iri(self, value):
+    return self.terms.lookup(RDFTerm(RDFTermType.IRI, value))
+  #
+  def predicates(self, subj):
+    ''' {pred: objects} of `subj`
+    '''
+    if len(self.multi_index) == 1:
+      return self.multi_index[0].spo.get(subj, {})
+    po = {}
+    for index in self.multi_index:
+      for pred, objs in index.spo.get(subj, {}).items():
+        po[pred] = po[pred] | objs if pred in po else objs
+    return po
+  #
+  def node_repr(self, subj, depth, skip=0, limit=10):
+    ''' JsonLDNode._repr: the predicates skip:skip+limit of `subj`, only
+    shared when they're the first `self.limit`
+    '''
+    if not depth:
+      return ellipse
+    shared = not skip and limit == self.limit
+    if shared:
+      rendered = self._reprs.get((subj, depth))
+      if rendered is not None:
+        return rendered
+    po = self.predicates(subj)
+    rendered = {
+      pred: self.frame_repr(itertools.islice(po[pred], self.limit), depth - 1, limit=self.limit)
+      for pred in itertools.islice(
+        (pred for pred in po.keys() if is_shown(pred)),
+        skip, None if limit is None else skip + limit,
+      )
+    }
+    if shared:
+      self._reprs[(subj, depth)] = rendered
+    return rendered
+  #
+  def frame_repr(self, subjs, depth, skip=0, limit=10, values=False):
+    ''' JsonLDFrame._repr of `subjs`, the page skip:skip+limit of a frame,
+    with only their values when `values` (i.e. for '~@id' frames)
+    '''
+    if not depth:
+      return ellipse
+    vals = [self.value_repr(subj, depth, values) for subj in subjs]
+    if len(vals) == 1:
+      return vals[0]
+    elif limit is not None and len(vals) >= limit:
+      if skip > 0:
+        return [ellipse, *vals, ellipse]
+      else:
+        return [*vals, ellipse]
+    else:
+      if skip > 0:
+        return [ellipse, *vals]
+      else:
+        return vals
+  #
+  def value_repr(self, id, depth, values=False):
+    term = self.terms.decode(id)
+    if values or term.type == RDFTermType.LITERAL:
+      return term.value
+    return self.node_repr(id, depth, limit=self.limit)
+  #
+  def document(self, subj, depth):
+    ''' The JSON-LD document of `subj`: its '@id' (see `jsonld_id`) and a
+    list of values for each predicate, related nodes expanded `depth - 1`
+    levels further and referenced by their '@id' beyond that. Nodes
+    reached again at the same depth share this document.
+    '''
+    document = self._documents.get((subj, depth))
+    if document is not None:
+      return document
+    document = {'@id': jsonld_id(self.terms.decode(subj).value)}
+    if depth > 0:
+      po = self.predicates(subj)
+      for pred in sorted(pred for pred in po.keys() if is_shown(pred)):
+        document[pred] = [self.jsonld_value(obj, depth - 1) for obj in po[pred]]
+    self._documents[(subj, depth)] = document
+    return document
+  #
+  def jsonld_value(self, id, depth, values=False):
+    term = self.terms.decode(id)
+    if values or term.type == RDFTermType.LITERAL:
+      if isinstance(term.value, json.JSON):
+        # changing the document mustn't change the term
+        return {'@value': copy_value(term.value.value)}
+      elif term.type == RDFTermType.IRI:
+        return jsonld_id(term.value)
+      return json.prepare(term.value)
+    return self.document(id, depth)
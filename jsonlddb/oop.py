@@ -1,15 +1,83 @@
+import gc
+import os
+import time
+import asyncio
+import logging
+import functools
 import itertools
+import collections
+import concurrent.futures
 from pprint import pformat
-from jsonlddb.core import jsonld_frame_with_multi_index, jsonld_to_triples, isLiteral
+from jsonlddb.core import jsonld_frame_with_multi_index, jsonld_count_with_multi_index, jsonld_estimate_with_multi_index, jsonld_explain_with_multi_index, jsonld_to_triples, jsonld_to_encoded_triples, jsonld_id, isLiteral, canonical_uuid
+from jsonlddb.compiled import bind_frame, compile_frame
 from jsonlddb.index import JsonLDIndex
+from jsonlddb.overlay import overlay_of, translated
+from jsonlddb.materialize import Materializer, ellipse
+from jsonlddb import json
 from jsonlddb.rdf import RDFTerm, RDFTermType
+from jsonlddb.wal import TripleLog
 
-class Ellipse:
-  def __repr__(self):
-    return '...'
-  def __str__(self):
-    return '...'
-ellipse = Ellipse()
+def batches(jsonld, batch_size):
+  ''' Lists of up to batch_size records of jsonld (a record or iterable)
+  '''
+  records = iter([jsonld] if type(jsonld) == dict else jsonld)
+  while True:
+    batch = list(itertools.islice(records, batch_size))
+    if not batch:
+      return
+    yield batch
+
+def encode_batch(batch, canonical_id=canonical_uuid):
+  return len(batch), jsonld_to_encoded_triples(batch, canonical_id)
+
+def ordered_map(executor, fn, items, window):
+  ''' executor.map without submitting more than `window` items ahead
+  '''
+  pending = collections.deque()
+  for item in items:
+    pending.append(executor.submit(fn, item))
+    if len(pending) >= window:
+      yield pending.popleft().result()
+  while pending:
+    yield pending.popleft().result()
+
+def take(it, n):
+  return list(itertools.islice(it, n))
+
+async def run_on(executor, fn, *args):
+  ''' fn(*args) on `executor` (a thread pool), in this thread when None
+  '''
+  if executor is None:
+    return fn(*args)
+  return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+def multi_index_of(dbs):
+  ''' Snapshots of the indexes of `dbs` to frame from
+  '''
+  if len(dbs) == 1:
+    return [dbs[0].index.snapshot()]
+  # framed as one index in the terms of the first, see `jsonlddb.overlay`
+  terms = dbs[0].index.terms
+  return [overlay_of([translated(db.index.snapshot(), terms) for db in dbs])]
+
+def check_canonical_id(path, canonical_id):
+  ''' Record the name of `canonical_id` in the database directory `path`,
+  raising if it was created with another one (databases written before
+  it was recorded used `canonical_uuid`)
+  '''
+  record = os.path.join(path, 'canonical_id')
+  name = canonical_id.__name__
+  if os.path.exists(record):
+    with open(record, 'r') as fr:
+      recorded = fr.read().strip()
+  elif os.listdir(path):
+    recorded = canonical_uuid.__name__
+  else:
+    with open(record, 'w') as fw:
+      fw.write(name)
+    return
+  if recorded != name:
+    raise Exception('The database at {} identifies blank nodes with {}, not {}'.format(path, recorded, name))
 
 class JsonLDNode:
   ''' Represents a single node, providing the ability to observe and interact
@@ -27,14 +95,27 @@ class JsonLDNode:
   def _repr(self):
     if '~@id' in self._frame:
       return self._subj
-    else:
-      return dict({
-        pred: objs._repr() if isinstance(objs, JsonLDFrame) else objs
-        for pred, objs in itertools.islice(
-          self.items(),
-          self._skip, None if self._limit is None else (self._skip + self._limit)
-        )
-      }) if self._depth else ellipse
+    if not self._depth:
+      return ellipse
+    materializer = Materializer(multi_index_of([self._db] + self._additional))
+    subj = materializer.lookup_iri(self._subj)
+    if subj is None:
+      return {}
+    return materializer.node_repr(subj, self._depth, self._skip, self._limit)
+  #
+  def to_jsonld(self, depth=None):
+    ''' The JSON-LD document of this node, with related nodes nested `depth`
+    (defaulting to the depth of the node) levels deep and referenced by
+    their '@id' beyond that. Blank nodes are labelled '_:<uuid>' (see
+    `core.jsonld_id`), so updating a database with the document adds
+    back the same nodes. As with JsonLDFrame.to_jsonld, nested documents
+    may be shared.
+    '''
+    materializer = Materializer(multi_index_of([self._db] + self._additional))
+    subj = materializer.lookup_iri(self._subj)
+    if subj is None:
+      return {'@id': jsonld_id(self._subj)}
+    return materializer.document(subj, self._depth if depth is None else depth)
   #
   def __repr__(self):
     return pformat(self._repr())
@@ -66,8 +147,8 @@ class JsonLDNode:
   def keys(self):
     return {
       pred
-      for index in [db.index for db in ([self._db] + self._additional)]
-      for pred in index.spo.get(RDFTerm(RDFTermType.IRI, self._subj), {}).keys()
+      for index in [db.index.snapshot() for db in ([self._db] + self._additional)]
+      for pred in index.spo.get(index.terms.lookup(RDFTerm(RDFTermType.IRI, self._subj)), {}).keys()
       if pred not in ['*', '**'] and not pred.startswith('~')
     }
   #
@@ -122,9 +203,11 @@ class JsonLDFrame:
   ''' Represent a frame, providing the ability to observe and interact
   with the complete set of all nodes which satisfy the frame.
   '''
-  def __init__(self, db, frame={}, skip=0, limit=10, depth=4, additional=[]):
+  def __init__(self, db, frame={}, skip=0, limit=10, depth=4, additional=[], params={}):
     self._db = db
     self._frame = frame
+    self._params = params
+    self._compiled_frame = None
     self._skip = skip
     self._limit = limit
     self._depth = depth
@@ -133,24 +216,26 @@ class JsonLDFrame:
   def _repr(self):
     if not self._depth:
       return ellipse
-    vals = [
-      obj._repr() if getattr(obj, '_repr', None) is not None else obj
-      for obj in itertools.islice(
-        self, self._skip, None if self._limit is None else (self._skip + self._limit)
-      )
+    multi_index = self._multi_index()
+    return Materializer(multi_index).frame_repr(
+      self.frame(self._frame, skip=self._skip, limit=self._limit, multi_index=multi_index),
+      self._depth, self._skip, self._limit, values='~@id' in self._frame,
+    )
+  #
+  def to_jsonld(self, depth=None):
+    ''' The JSON-LD documents of all nodes in the frame (see
+    JsonLDNode.to_jsonld). Nodes reached more than once at the same depth
+    share one document (the same dict), so copy the result (e.g. with
+    `copy.deepcopy`) before changing it in place.
+    '''
+    multi_index = self._multi_index()
+    materializer = Materializer(multi_index)
+    depth = self._depth if depth is None else depth
+    values = '~@id' in self._frame
+    return [
+      materializer.jsonld_value(subj, depth, values)
+      for subj in self.frame(self._frame, multi_index=multi_index)
     ]
-    if len(vals) == 1:
-      return vals[0]
-    elif len(vals) >= self._limit:
-      if self._skip > 0:
-        return [ellipse, *vals, ellipse]
-      else:
-        return [*vals, ellipse]
-    else:
-      if self._skip > 0:
-        return [ellipse, *vals]
-      else:
-        return vals
   #
   def __repr__(self):
     return pformat(self._repr())
@@ -164,10 +249,11 @@ class JsonLDFrame:
         self._db,
         frame={'~' + pred: self._frame},
         depth=self._depth,
-        additional=self._additional
+        additional=self._additional,
+        params=self._params,
       )
     elif type(pred) == int:
-      return next(iter(itertools.islice(self, pred, pred + 1)))
+      return next(self._page(pred, 1))
     elif type(pred) == slice:
       if pred.step is None or pred.step == 1 and (pred.start is None or pred.stop is None or pred.start < pred.stop):
         return self.skip(pred.start).limit(None if pred.stop is None else pred.stop - pred.start)
@@ -180,24 +266,109 @@ class JsonLDFrame:
         frame=dict(self._frame, **pred),
         depth=self._depth,
         additional=self._additional,
+        params=self._params,
       )
   #
   def __iter__(self):
-    for subj in self.frame(self._frame):
+    return self._page(0, None)
+  #
+  def _page(self, skip, limit):
+    ''' Iterate over the nodes skip:skip+limit, only evaluating the frame
+    as far as needed
+    '''
+    multi_index = self._multi_index()
+    return self._nodes(self.frame(self._frame, skip=skip, limit=limit, multi_index=multi_index), multi_index)
+  #
+  def _nodes(self, subjs, multi_index):
+    ''' The nodes of `subjs`, framed from the snapshots `multi_index` which
+    are held until the iteration ends
+    '''
+    decode = self._db.index.terms.decode
+    # nodes are framed by the frame with its params filled in
+    frame = bind_frame(self._frame, self._params) if self._params else self._frame
+    for subj in subjs:
+      subj = decode(subj)
       if subj.type == RDFTermType.LITERAL or '~@id' in self._frame:
         yield subj.value
       else:
         yield JsonLDNode(
           self._db, subj.value,
-          frame=self._frame,
+          frame=frame,
           depth=self._depth,
           additional=self._additional,
         )
   #
+  def _stream(self, multi_index):
+    ''' The subjects in the order of iteration, streamed from
+    `multi_index` and planned on the first `next`
+    '''
+    yield from jsonld_frame_with_multi_index(multi_index, self._compiled(), params=self._params, stream=True)
+  #
+  async def aiter(self, chunk_size=1000, executor=None):
+    ''' Iterate over the nodes from asyncio (`async for node in
+    frame.aiter()`), streaming the frame `chunk_size` subjects at a time
+    and letting the event loop run in between, or on `executor` (e.g. a
+    ThreadPoolExecutor for frames with large intersections). Abandoning
+    the iteration (closing it or cancelling its task) stops evaluation
+    after the chunk in progress. The frame cache isn't used, nodes come
+    in the order of iteration all the same.
+    '''
+    multi_index = self._multi_index()
+    subjs = self._stream(multi_index)
+    while True:
+      chunk = await run_on(executor, take, subjs, chunk_size)
+      for node in self._nodes(chunk, multi_index):
+        yield node
+      if len(chunk) < chunk_size:
+        return
+      if executor is None:
+        await asyncio.sleep(0)
+  #
+  async def acount(self, chunk_size=1000, executor=None):
+    ''' len() from asyncio: on `executor`, or without one from the sizes
+    of the index when they give it and otherwise by counting the subjects
+    streamed like `aiter`
+    '''
+    if executor is not None:
+      return await run_on(executor, len, self)
+    multi_index = self._multi_index()
+    n = jsonld_count_with_multi_index(multi_index, self._compiled(), params=self._params, sized_only=True)
+    if n is not None:
+      return n
+    subjs, n = self._stream(multi_index), 0
+    while True:
+      chunk = take(subjs, chunk_size)
+      n += len(chunk)
+      if len(chunk) < chunk_size:
+        return n
+      await asyncio.sleep(0)
+  #
   def __len__(self):
-    return sum(
-      1 for _ in self.frame(self._frame)
+    if self._db.cache is not None:
+      return len(self.frame(self._frame))
+    return jsonld_count_with_multi_index(self._multi_index(), self._compiled(), params=self._params)
+  #
+  def estimate_len(self):
+    ''' An approximation of len() from index statistics alone (an upper
+    bound of it for conjunctive frames), without evaluating the frame
+    '''
+    return jsonld_estimate_with_multi_index(self._multi_index(), self._compiled(), params=self._params)
+  #
+  def bind(self, **params):
+    ''' Fill in the Params of this frame (see `jsonlddb.compiled`)
+    '''
+    bound = JsonLDFrame(
+      self._db,
+      frame=self._frame,
+      skip=self._skip,
+      limit=self._limit,
+      depth=self._depth,
+      additional=self._additional,
+      params=dict(self._params, **params),
     )
+    # the same frame, so the same compiled plan
+    bound._compiled_frame = self._compiled()
+    return bound
   #
   def skip(self, skip):
     return JsonLDFrame(
@@ -207,6 +378,7 @@ class JsonLDFrame:
       limit=self._limit,
       depth=self._depth,
       additional=self._additional,
+      params=self._params,
     )
   #
   def limit(self, limit):
@@ -217,6 +389,7 @@ class JsonLDFrame:
       limit=limit,
       depth=self._depth,
       additional=self._additional,
+      params=self._params,
     )
   #
   def depth(self, depth):
@@ -226,6 +399,7 @@ class JsonLDFrame:
       limit=self._limit,
       depth=depth,
       additional=self._additional,
+      params=self._params,
     )
   #
   def with_db(self, db):
@@ -236,82 +410,351 @@ class JsonLDFrame:
       limit=self._limit,
       depth=self._depth,
       additional=self._additional + [db],
+      params=self._params,
     )
   #
-  def frame(self, frame):
-    return jsonld_frame_with_multi_index(
-      [
-        db.index
-        for db in ([self._db] + self._additional)
-      ], frame.get('~@id', frame)
-    )
+  def _multi_index(self):
+    ''' Snapshots of the indexes to frame, iterating over a frame sees
+    them as they were when it started whatever is written meanwhile
+    '''
+    return multi_index_of([self._db] + self._additional)
+  #
+  def _compiled(self):
+    ''' This frame compiled, once per JsonLDFrame
+    '''
+    if self._compiled_frame is None:
+      self._compiled_frame = compile_frame(self._frame.get('~@id', self._frame))
+    return self._compiled_frame
+  #
+  def frame(self, frame, skip=0, limit=None, multi_index=None):
+    if multi_index is None:
+      multi_index = self._multi_index()
+    frame = self._compiled() if frame is self._frame else frame.get('~@id', frame)
+    if self._db.cache is not None:
+      subjs = self._db.cache.frame(multi_index, frame, params=self._params)
+      if limit is None and not skip:
+        return subjs
+      return itertools.islice(subjs, skip, None if limit is None else skip + limit)
+    # pages are streamed in the order of iteration, which evaluates in bulk
+    return jsonld_frame_with_multi_index(multi_index, frame, skip=skip, limit=limit, params=self._params, ordered=True)
+  #
+  def explain(self, frame=None):
+    ''' The plan chosen for `frame` (defaults to this frame) with its
+    estimated and actual row counts, and the constraint whose stream
+    orders iteration and pages.
+    '''
+    frame = self._compiled() if frame is None else frame.get('~@id', frame)
+    return jsonld_explain_with_multi_index(self._multi_index(), frame, params=self._params)
 
 class JsonLDDatabase(JsonLDFrame):
-  def __init__(self):
+  ''' A JsonLDFrame over its own index, `index` selects the backend
+  (e.g. a CompactJsonLDIndex for large, mostly-static data) and defaults
+  to a fresh JsonLDIndex. Frames are served from `cache` (a FrameCache)
+  when one is given. See `open` for a database persisted with a
+  write-ahead log.
+
+  Nodes without an @id are identified by `canonical_id` (see
+  `core.canonical_uuid`), which must stay the same for all writes to the
+  same data.
+  '''
+  def __init__(self, index=None, cache=None, canonical_id=canonical_uuid):
     JsonLDFrame.__init__(self, self, {})
-    self.index = JsonLDIndex()
+    self.index = JsonLDIndex() if index is None else index
+    self.cache = cache
+    self.canonical_id = canonical_id
+    self.path = None
+    self.log = None
+    self.checkpoint_bytes = None
+  #
+  @staticmethod
+  def open(path, fsync=True, checkpoint_bytes=64 * 2**20, mmap=False, cache=None, canonical_id=canonical_uuid):
+    ''' The database persisted in the directory `path`: its last checkpoint
+    (a snapshot) with the write-ahead log of later writes replayed on top.
+    Further writes are logged (see `jsonlddb.wal`) and a checkpoint is
+    made whenever the log outgrows `checkpoint_bytes`.
+
+    With `mmap` the checkpoint is queried in place as a CompactJsonLDIndex
+    (suiting mostly-static data) instead of being loaded into memory.
+
+    The name of `canonical_id` is recorded with the database, which can't
+    be opened with another one: its blank nodes would no longer match.
+    '''
+    from jsonlddb.snapshot import load_snapshot
+    os.makedirs(path, exist_ok=True)
+    check_canonical_id(path, canonical_id)
+    db = JsonLDDatabase(cache=cache, canonical_id=canonical_id)
+    snapshot = os.path.join(path, 'snapshot')
+    if os.path.exists(snapshot):
+      if mmap:
+        db.index = load_snapshot(snapshot)
+      else:
+        db.update_triples(
+          (s, p, o)
+          for s, pO in load_snapshot(snapshot).iter_spo()
+          for p, O in pO.items()
+          for o in O
+        )
+    log = TripleLog(os.path.join(path, 'log'), fsync=fsync)
+    for op, triples in log.replay():
+      if op == '+':
+        db.index.insert_triples(triples)
+      else:
+        db.index.remove_triples(triples)
+    db.path = path
+    db.log = log
+    db.checkpoint_bytes = checkpoint_bytes
+    return db
+  #
+  def checkpoint(self):
+    ''' Persist the whole database as a snapshot and empty the log
+    '''
+    if self.path is None:
+      raise Exception('Only databases from JsonLDDatabase.open can checkpoint')
+    tmp = os.path.join(self.path, 'snapshot.tmp')
+    with open(tmp, 'wb') as fw:
+      self.dump(fw, fmt='snapshot')
+      fw.flush()
+      os.fsync(fw.fileno())
+    os.replace(tmp, os.path.join(self.path, 'snapshot'))
+    # replaying a log already in the snapshot is harmless, so a crash
+    #  before truncating it loses nothing
+    self.log.truncate()
+    return self
+  #
+  def close(self):
+    if self.log is not None:
+      self.log.close()
+      self.log = None
+  #
+  def _maybe_checkpoint(self):
+    if self.log is not None and self.log.size > self.checkpoint_bytes:
+      self.checkpoint()
   #
   def update(self, jsonld):
-    self.update_triples(jsonld_to_triples(jsonld))
+    terms = self.index.terms
+    self.update_triples(jsonld_to_triples(
+      jsonld, iri=terms.intern_iri, literal=terms.intern_literal, canonical_id=self.canonical_id,
+    ))
+    return self
+  #
+  async def aupdate(self, jsonld, batch_size=1000, executor=None):
+    ''' `update` from asyncio, `batch_size` records at a time on `executor`
+    or letting the event loop run in between. Frames being iterated keep
+    their snapshots meanwhile. Each batch is written whole, cancelling
+    leaves those written so far.
+    '''
+    for batch in batches(jsonld, batch_size):
+      await run_on(executor, self.update, batch)
+      if executor is None:
+        await asyncio.sleep(0)
     return self
   #
   def update_triples(self, triples):
+    if self.log is not None:
+      triples = list(triples)
     self.index.insert_triples(triples)
+    # logged once applied, so a write that fails is never replayed
+    if self.log is not None:
+      self.log.append('+', triples)
+    self._maybe_checkpoint()
+    return self
+  #
+  def bulk_update(self, jsonld, batch_size=10000, report=None):
+    ''' A fast path for `update` with large amounts of JSON-LD records
+    (a list or any iterable): records are converted straight to term ids
+    `batch_size` at a time and inserted with the index's bulk loader.
+    Frames see the database as it was until the load completes.
+
+    `report` is called with the running throughput after each batch and
+    at the end, by default only the totals are logged.
+    '''
+    terms = self.index.terms
+    return self._bulk_load(
+      (
+        (len(batch), jsonld_to_triples(
+          batch, iri=terms.encode_iri, literal=terms.encode_literal, canonical_id=self.canonical_id,
+        ))
+        for batch in batches(jsonld, batch_size)
+      ),
+      report,
+    )
+  #
+  def update_parallel(self, jsonld, workers=None, batch_size=10000, report=None, executor=None):
+    ''' `bulk_update` with triples generated by a pool of `workers` processes
+    (or the given `executor`), each converting a batch of records at a time
+    to `jsonld_to_encoded_triples`. Batches are merged in the order they
+    were submitted, so the result is identical to that of `update`.
+    '''
+    pool = concurrent.futures.ProcessPoolExecutor(workers) if executor is None else executor
+    try:
+      window = 2 * (workers or os.cpu_count() or 1)
+      return self._bulk_load(
+        (
+          (n_records, self._decode_encoded_triples(encoded))
+          for n_records, encoded in ordered_map(
+            pool, functools.partial(encode_batch, canonical_id=self.canonical_id),
+            batches(jsonld, batch_size), window,
+          )
+        ),
+        report,
+      )
+    finally:
+      if executor is None:
+        pool.shutdown()
+  #
+  def _decode_encoded_triples(self, encoded):
+    iris, values, preds, ids = encoded
+    terms = self.index.terms
+    remap = [
+      terms.encode_iri(value) if iri else terms.encode_literal(value)
+      for iri, value in zip(iris, values)
+    ]
+    it = iter(ids)
+    return (
+      (remap[subj], preds[pred], remap[obj])
+      for subj, pred, obj in zip(it, it, it)
+    )
+  #
+  def _bulk_load(self, batches, report):
+    ''' Insert (n_records, encoded triples) batches with the bulk loader
+    '''
+    stats = {'records': 0, 'triples': 0}
+    start = time.perf_counter()
+    def throughput():
+      stats['seconds'] = time.perf_counter() - start
+      stats['triples_per_second'] = stats['triples'] / stats['seconds'] if stats['seconds'] else 0
+      return dict(stats)
+    # collecting while building large numbers of long-lived containers
+    #  only costs time, there is nothing to collect
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+      with self.index.bulk_loader() as loader:
+        for n_records, triples in batches:
+          if self.log is not None:
+            triples = list(triples)
+          loader.insert(triples)
+          if self.log is not None:
+            decode = self.index.terms.decode
+            self.log.append('+', [(decode(s), p, decode(o)) for s, p, o in triples])
+          stats['records'] += n_records
+          stats['triples'] = loader.count
+          if report is not None:
+            report(throughput())
+    finally:
+      if gc_was_enabled:
+        gc.enable()
+    self._maybe_checkpoint()
+    stats = throughput()
+    if report is not None:
+      report(stats)
+    else:
+      logging.info('bulk loaded {records} records ({triples} triples) in {seconds:.2f}s, {triples_per_second:.0f} triples/s'.format(**stats))
     return self
   #
   def remove(self, jsonld):
-    self.remove_triples(jsonld_to_triples(jsonld))
+    self.remove_triples(jsonld_to_triples(jsonld, canonical_id=self.canonical_id))
     return self
   #
   def remove_triples(self, triples):
+    if self.log is not None:
+      triples = list(triples)
     self.index.remove_triples(triples)
+    # logged once applied, so a write that fails is never replayed
+    if self.log is not None:
+      self.log.append('-', triples)
+    self._maybe_checkpoint()
     return self
   #
   def dump(self, file, fmt='msgpack'):
+    ''' Write the database to `file` one subject at a time. `fmt` is one of
+    'msgpack', 'json' (an object of subjects), 'ndjson' (one {subject: ...}
+    object per line) or 'snapshot'. The database is written as it was
+    when the dump started.
+    '''
+    index = self.index.snapshot()
     if fmt == 'msgpack':
       fw = open(file, 'wb') if type(file) == str else file
       import msgpack
-      from jsonlddb.json import prepare
       packer = msgpack.Packer(encoding='utf-8')
-      for s, po in prepare(self.index.spo).items():
-        fw.write(packer.pack(s))
-        fw.write(packer.pack(po))
+      for s, po in index.iter_spo():
+        fw.write(packer.pack(json.prepare(s)))
+        fw.write(packer.pack(json.prepare(po)))
     elif fmt == 'json':
       fw = open(file, 'w') if type(file) == str else file
-      from jsonlddb import json
-      json.dump(self.index.spo, fw)
+      fw.write('{')
+      for i, (s, po) in enumerate(index.iter_spo()):
+        if i:
+          fw.write(', ')
+        fw.write(json.dumps(json.prepare(s)))
+        fw.write(': ')
+        fw.write(json.dumps(po))
+      fw.write('}')
+    elif fmt == 'ndjson':
+      fw = open(file, 'w') if type(file) == str else file
+      for s, po in index.iter_spo():
+        fw.write(json.dumps({json.prepare(s): po}))
+        fw.write('\n')
+    elif fmt == 'snapshot':
+      from jsonlddb.snapshot import write_snapshot
+      write_snapshot(index, file)
     else:
       raise Exception('Unrecognized fmt for JsonLDDb.dump')
+    if type(file) == str and fmt != 'snapshot':
+      fw.close()
     return self
   #
-  def load(self, file, fmt='msgpack'):
+  def load(self, file, fmt='msgpack', batch_size=10000):
+    ''' Add the contents of a dump to the database, parsing it incrementally
+    and inserting `batch_size` subjects at a time. An empty database
+    loading a 'snapshot' instead queries the memory-mapped snapshot in
+    place (with its own term dictionary, see `jsonlddb.snapshot`).
+    '''
     if fmt == 'msgpack':
       fr = open(file, 'rb') if type(file) == str else file
       import msgpack
       unpacker = msgpack.Unpacker(fr, encoding='utf-8', use_list=False)
-      self.update_triples(
-        (
-          RDFTerm(RDFTermType.IRI, s),
-          p,
-          RDFTerm(RDFTermType.LITERAL, o[0]) if isinstance(o, tuple) else RDFTerm(RDFTermType.IRI, o),
-        )
-        for s, pO in zip(unpacker, unpacker)
-        for p, O in pO.items()
-        for o in O
-      )
+      self._load_records(zip(unpacker, unpacker), batch_size)
     elif fmt == 'json':
       fr = open(file, 'r') if type(file) == str else file
-      from jsonlddb import json
-      self.update_triples(
+      self._load_records(json.iter_items(fr), batch_size)
+    elif fmt == 'ndjson':
+      fr = open(file, 'r') if type(file) == str else file
+      self._load_records(
         (
-          RDFTerm(RDFTermType.IRI, s),
-          p,
-          RDFTerm(RDFTermType.LITERAL, o[0]) if isinstance(o, list) else RDFTerm(RDFTermType.IRI, o),
-        )
-        for s, pO in json.load(fr).items()
-        for p, O in pO.items()
-        for o in O
+          record
+          for line in fr
+          if line.strip()
+          for record in json.loads(line).items()
+        ),
+        batch_size,
       )
+    elif fmt == 'snapshot':
+      from jsonlddb.snapshot import load_snapshot
+      index = load_snapshot(file)
+      if not self.index.spo:
+        self.index = index
+      else:
+        self.update_triples(
+          (s, p, o)
+          for s, pO in index.iter_spo()
+          for p, O in pO.items()
+          for o in O
+        )
     else:
       raise Exception('Unrecognized fmt for JsonLDDb.load')
+    if type(file) == str and fmt != 'snapshot':
+      fr.close()
     return self
+  #
+  def _load_records(self, records, batch_size):
+    ''' Insert dumped (subject, {pred: [obj, ...]}) records
+    '''
+    terms = self.index.terms
+    for batch in batches(records, batch_size):
+      self.update_triples(
+        (terms.intern_iri(s), p, json.prepared_term(o, terms))
+        for s, pO in batch
+        for p, O in pO.items()
+        for o in O
+      )
@@ -0,0 +1,563 @@
+'''
+A single index viewing the union of several (`OverlayIndex`), so frames
+ over databases combined with `with_db` look each posting list up once
+ instead of fanning every lookup out to every database.
+
+Posting lists held by a single member are returned as they are; those
+ spread over several are merged (bitmaps as bitmaps) once and remembered
+ while the members' versions of their predicate are unchanged.
+
+An OverlayIndex may also subtract the triples of a `tombstones` index,
+ which is how `DeltaIndex` keeps a small writable layer over a large
+ read-only base (e.g. a memory mapped snapshot):
+
+  db = JsonLDDatabase(DeltaIndex(load_snapshot(path)))
+
+Databases with term dictionaries of their own are combined through a
+ copy re-encoded in the dictionary of the first (see `translated`),
+ which re-encodes what they write as they write it.
+
+Frames are evaluated over overlays of snapshots (see
+ `JsonLDIndex.snapshot`), whose contents never change. Those are only
+ kept while in use, the next overlay of the same indexes taking over
+ what is still valid of what they merged.
+'''
+import weakref
+import threading
+import collections
+from jsonlddb.chain_set import set_union
+from jsonlddb.index import JsonLDIndex, SegmentedMap, dds_changes, index_uids, write_clock
+from jsonlddb.plan import base_predicate, multi_index_terms
+
+def merge_postings(postings, removed=None):
+  ''' The union of the (non-empty) `postings` less those `removed`
+  '''
+  if len(postings) == 1:
+    merged = postings[0]
+  elif postings:
+    merged = set_union(postings)
+  else:
+    return set()
+  if removed:
+    return {v for v in merged if v not in removed}
+  return merged
+
+def merge_po(pos, removed=None):
+  ''' The union of {pred: objects} dicts less those `removed`
+  '''
+  merged = {}
+  for pred in {pred for po in pos for pred in po}:
+    objs = merge_postings(
+      [po[pred] for po in pos if po.get(pred)],
+      removed.get(pred) if removed else None,
+    )
+    if objs:
+      merged[pred] = objs
+  return merged
+
+class OverlayMap:
+  ''' The union of the mappings `maps` (e.g. `pos[pred]` of each member)
+  less `tombstones`, their values combined with `merge`
+  '''
+  def __init__(self, maps, tombstones=None, merge=merge_postings):
+    self.maps = sorted(maps, key=len, reverse=True)
+    self.tombstones = tombstones if tombstones else None
+    self.merge = merge
+    self._merged = {}
+    self._keys = None
+  #
+  def get(self, key, default=None):
+    value = values = None
+    for m in self.maps:
+      v = m.get(key)
+      if v:
+        if value is None:
+          value = v
+        elif values is None:
+          values = [value, v]
+        else:
+          values.append(v)
+    removed = self.tombstones.get(key) if self.tombstones is not None else None
+    if not removed:
+      if value is None:
+        return default
+      elif values is None:
+        return value
+    merged = self._merged.get(key)
+    if merged is None:
+      merged = self._merged[key] = self.merge(values or ([] if value is None else [value]), removed)
+    return merged if merged else default
+  #
+  def __getitem__(self, key):
+    value = self.get(key)
+    if value is None:
+      raise KeyError(key)
+    return value
+  #
+  def __contains__(self, key):
+    return self.get(key) is not None
+  #
+  def keys(self):
+    if self._keys is None:
+      if len(self.maps) == 1 and self.tombstones is None:
+        self._keys = self.maps[0].keys()
+      else:
+        keys = set().union(*(m.keys() for m in self.maps))
+        if self.tombstones is not None:
+          keys.difference_update(key for key in self.tombstones.keys() if key not in self)
+        self._keys = keys
+    return self._keys
+  #
+  def __len__(self):
+    if self._keys is not None or not self.maps:
+      return len(self.keys())
+    # the largest map plus what the others add, without building the union
+    largest, others = self.maps[0], self.maps[1:]
+    n = len(largest) + len({key for m in others for key in m.keys() if key not in largest})
+    if self.tombstones is not None:
+      n -= sum(1 for key in self.tombstones.keys() if key not in self and any(key in m for m in self.maps))
+    return n
+  #
+  def __iter__(self):
+    return iter(self.keys())
+  #
+  def values(self):
+    for key in self.keys():
+      yield self.get(key)
+  #
+  def items(self):
+    for key in self.keys():
+      yield key, self.get(key)
+
+class OverlayPOS:
+  ''' The `pos` of an OverlayIndex
+  '''
+  def __init__(self, overlay):
+    # (weakly) so that the overlay and its members are freed once unused
+    self.overlay = weakref.proxy(overlay)
+    self._maps = {}
+  #
+  def get(self, pred, default=None):
+    overlay = self.overlay
+    cached = self._maps.get(pred)
+    if cached is not None:
+      time, base, stamp, m = cached
+      if time != write_clock.time and not overlay.frozen:
+        if overlay._stamp(base) == stamp:
+          self._maps[pred] = (write_clock.time, base, stamp, m)
+        else:
+          cached = None
+    if cached is None:
+      time, base = write_clock.time, base_predicate(pred)
+      maps = [m for m in (member.pos.get(pred) for member in overlay.members) if m]
+      tombstones = overlay.tombstones.pos.get(pred) if overlay.tombstones is not None else None
+      m = OverlayMap(maps, tombstones) if maps else None
+      self._maps[pred] = (time, base, overlay._stamp(base), m)
+    return default if m is None else m
+  #
+  def __getitem__(self, pred):
+    value = self.get(pred)
+    if value is None:
+      raise KeyError(pred)
+    return value
+  #
+  def __contains__(self, pred):
+    return self.get(pred) is not None
+  #
+  def keys(self):
+    return {pred for member in self.overlay.members for pred in member.pos.keys() if pred in self}
+  #
+  def __iter__(self):
+    return iter(self.keys())
+  #
+  def items(self):
+    for pred in self.keys():
+      yield pred, self.get(pred)
+
+class OverlayLiteralIndex:
+  ''' The literal indexes (see `JsonLDIndex.literal_index`) of one
+  predicate in each member, matching only objects still in the overlay
+  '''
+  def __init__(self, overlay, pred, literal_indexes):
+    self.overlay = overlay
+    self.pred = pred
+    self.literal_indexes = literal_indexes
+  #
+  def _live(self, obj):
+    return obj in self.overlay.pos.get(self.pred, {})
+  #
+  def ids(self, ops):
+    seen = set()
+    for literal_index in self.literal_indexes:
+      for obj in literal_index.ids(ops):
+        if obj not in seen and self._live(obj):
+          seen.add(obj)
+          yield obj
+  #
+  def search(self, query):
+    best = {}
+    for literal_index in self.literal_indexes:
+      for score, obj in literal_index.search(query):
+        best[obj] = max(score, best.get(obj, score))
+    return [(score, obj) for obj, score in best.items() if self._live(obj)]
+
+class OverlayVersions:
+  ''' The `versions` of an OverlayIndex
+  '''
+  def __init__(self, overlay):
+    self.overlay = weakref.proxy(overlay)
+  #
+  def get(self, pred, default=None):
+    versions = [index_versions.get(pred) for index_versions in self.overlay._versions]
+    if all(version is None for version in versions):
+      return default
+    return sum(version for version in versions if version is not None)
+  #
+  def __getitem__(self, pred):
+    version = self.get(pred)
+    if version is None:
+      raise KeyError(pred)
+    return version
+
+class OverlayIndex:
+  ''' A read-only index over the union of the triples of `members` (which
+  share a term dictionary) less those of `tombstones`, see the module
+  documentation.
+
+  `counts` add up those of the members (less the tombstones), counting
+  triples held by several members more than once; they only serve as
+  planning statistics. `version` and `versions` add up those of all
+  members and so grow with every write to any of them.
+
+  An overlay of snapshots is `frozen` and needn't look for writes.
+  '''
+  def __init__(self, members, tombstones=None, uid=None):
+    self.members = list(members)
+    self.tombstones = tombstones
+    self.terms = multi_index_terms(self._indexes())
+    self.frozen = all(index.frozen for index in self._indexes())
+    self.uid = next(index_uids) if uid is None else uid
+    self.versions = OverlayVersions(self)
+    # the (live) versions of each index
+    self._versions = [index.versions for index in self._indexes()]
+    self.pos = OverlayPOS(self)
+    self._cache = {}
+  #
+  def _indexes(self):
+    return self.members + ([] if self.tombstones is None else [self.tombstones])
+  #
+  def _stamp(self, pred=None):
+    ''' The versions of `pred` (of everything by default) in all indexes
+    '''
+    if pred is None:
+      return [index.version for index in self._indexes()]
+    return [index_versions.get(pred, 0) for index_versions in self._versions]
+  #
+  @property
+  def version(self):
+    return sum(index.version for index in self._indexes())
+  #
+  def _derived(self, name, build):
+    ''' The value `build` derives from the indexes, rebuilt after writes
+    to any of them
+    '''
+    cached = self._cache.get(name)
+    if cached is not None and (self.frozen or cached[0] == write_clock.time):
+      return cached[2]
+    stamp = self._stamp()
+    if cached is None or cached[1] != stamp:
+      cached = (write_clock.time, stamp, build())
+    else:
+      cached = (write_clock.time, stamp, cached[2])
+    self._cache[name] = cached
+    return cached[2]
+  #
+  @property
+  def counts(self):
+    def build():
+      counts = collections.Counter()
+      for member in self.members:
+        counts.update(member.counts)
+      if self.tombstones is not None:
+        counts.subtract(self.tombstones.counts)
+      return {pred: n for pred, n in counts.items() if n > 0}
+    return self._derived('counts', build)
+  #
+  @property
+  def spo(self):
+    return self._derived('spo', lambda: OverlayMap(
+      [member.spo for member in self.members if member.spo],
+      self.tombstones.spo if self.tombstones is not None else None,
+      merge=merge_po,
+    ))
+  #
+  def _adopt(self, cache, maps):
+    ''' Take over what another overlay of the same indexes built from
+    `cache` and `maps` (its `_cache` and `pos._maps`) which is still valid
+    '''
+    stamp = self._stamp()
+    self._cache = {name: cached for name, cached in cache.copy().items() if cached[1] == stamp}
+    self.pos._maps = {
+      pred: cached
+      for pred, cached in maps.copy().items()
+      if cached[2] == self._stamp(cached[1])
+    }
+  #
+  def snapshot(self):
+    ''' An overlay of snapshots of the indexes
+    '''
+    if self.frozen:
+      return self
+    return overlay_of(
+      [member.snapshot() for member in self.members],
+      None if self.tombstones is None else self.tombstones.snapshot(),
+    )
+  #
+  def literal_index(self, pred, kind):
+    return OverlayLiteralIndex(self, pred, [
+      member.literal_index(pred, kind)
+      for member in self.members
+    ])
+  #
+  def insert_triples(self, triples):
+    raise Exception('OverlayIndex is read-only, see DeltaIndex')
+  #
+  def remove_triples(self, triples):
+    raise Exception('OverlayIndex is read-only, see DeltaIndex')
+  #
+  def iter_spo(self):
+    ''' Iterate over (subj, {pred: [obj, ...]}) with ids decoded
+    '''
+    decode = self.terms.decode
+    for subj, po in self.spo.items():
+      yield decode(subj), {
+        pred: [decode(obj) for obj in objs]
+        for pred, objs in po.items()
+      }
+
+def index_has_triple(index, subj, pred, obj):
+  return obj in index.spo.get(subj, {}).get(pred, ())
+
+class DeltaIndex(OverlayIndex):
+  ''' A writable layer over the read-only index `base`: triples inserted
+  are held in `added` and those of `base` removed are recorded in the
+  tombstones `removed`, both JsonLDIndexes, leaving `base` untouched.
+
+  Writes change both layers, so like those of a JsonLDIndex they end by
+  publishing the snapshot `snapshot()` returns without waiting.
+  '''
+  def __init__(self, base):
+    self.base = base
+    self.added = JsonLDIndex(terms=base.terms)
+    self.removed = JsonLDIndex(terms=base.terms)
+    OverlayIndex.__init__(self, [base, self.added], self.removed)
+    self._lock = threading.RLock()
+    self._publish()
+  #
+  def _publish(self):
+    self._published = OverlayIndex.snapshot(self)
+  #
+  def snapshot(self):
+    return self._published
+  #
+  def insert_triples(self, triples):
+    with self._lock:
+      self._insert_triples(triples)
+      self._publish()
+    return self
+  #
+  def remove_triples(self, triples):
+    with self._lock:
+      self._remove_triples(triples)
+      self._publish()
+    return self
+  #
+  def _insert_triples(self, triples):
+    encode = self.terms.encode
+    added, revived = [], []
+    for triple in triples:
+      subj, pred, obj = triple
+      subj, obj = encode(subj), encode(obj)
+      if index_has_triple(self.removed, subj, pred, obj):
+        revived.append(triple)
+      elif not index_has_triple(self.base, subj, pred, obj):
+        added.append(triple)
+    self.removed.remove_triples(revived)
+    self.added.insert_triples(added)
+    return self
+  #
+  def _remove_triples(self, triples):
+    lookup = self.terms.lookup
+    unadded, removed = [], []
+    for triple in triples:
+      subj, pred, obj = triple
+      subj, obj = lookup(subj), lookup(obj)
+      if subj is None or obj is None:
+        continue
+      if index_has_triple(self.added, subj, pred, obj):
+        unadded.append(triple)
+      elif index_has_triple(self.base, subj, pred, obj) and not index_has_triple(self.removed, subj, pred, obj):
+        removed.append(triple)
+    self.added.remove_triples(unadded)
+    self.removed.insert_triples(removed)
+    return self
+  #
+  def bulk_loader(self):
+    return DeltaBulkLoader(self)
+
+class DeltaBulkLoader:
+  ''' Insert encoded (subj id, pred, obj id) triples into a DeltaIndex:
+  those absent from its base with the bulk loader of `added`. They are
+  published on `close`.
+  '''
+  def __init__(self, index):
+    self.index = index
+    self.count = 0
+    index._lock.acquire()
+    self._loader = index.added.bulk_loader()
+  #
+  def __enter__(self):
+    return self
+  #
+  def __exit__(self, *args):
+    self.close()
+  #
+  def insert(self, triples):
+    index = self.index
+    decode = index.terms.decode
+    added, revived = [], []
+    for subj, pred, obj in triples:
+      self.count += 1
+      if index_has_triple(index.removed, subj, pred, obj):
+        revived.append((decode(subj), pred, decode(obj)))
+      elif not index_has_triple(index.base, subj, pred, obj):
+        added.append((subj, pred, obj))
+    if revived:
+      index.removed.remove_triples(revived)
+    self._loader.insert(added)
+    return self
+  #
+  def close(self):
+    if self._loader is None:
+      return
+    try:
+      self._loader.close()
+    finally:
+      self._loader = None
+      self.index._publish()
+      self.index._lock.release()
+
+# Overlays of the member indexes combined by `overlay_of`, least recently
+#  used first, so their merged posting lists outlive a single frame. Those
+#  of snapshots are held as (weak reference, uid, _cache, pos._maps) so as
+#  not to keep old versions alive
+overlays = collections.OrderedDict()
+overlays_lock = threading.Lock()
+max_overlays = 64
+
+def overlay_of(indexes, tombstones=None):
+  ''' The OverlayIndex of `indexes` (less `tombstones`), shared while they
+  are in use
+  '''
+  members = list(indexes) + ([] if tombstones is None else [tombstones])
+  frozen = all(index.frozen for index in members)
+  key = (
+    tuple(index.uid for index in indexes),
+    None if tombstones is None else tombstones.uid,
+    frozen,
+  )
+  with overlays_lock:
+    entry = overlays.get(key)
+    if entry is not None:
+      overlays.move_to_end(key)
+      if not frozen:
+        return entry
+      overlay = entry[0]()
+      if overlay is not None and all(a is b for a, b in zip(overlay._indexes(), members)):
+        return overlay
+    if not frozen:
+      overlay = overlays[key] = OverlayIndex(indexes, tombstones)
+    else:
+      # a stable uid keeps FrameCache entries of the overlay valid
+      overlay = OverlayIndex(indexes, tombstones, uid=None if entry is None else entry[1])
+      if entry is not None:
+        overlay._adopt(entry[2], entry[3])
+      overlays[key] = (weakref.ref(overlay), overlay.uid, overlay._cache, overlay.pos._maps)
+    while len(overlays) > max_overlays:
+      overlays.popitem(last=False)
+  return overlay
+
+class Translation:
+  ''' A JsonLDIndex copy of the triples of another index re-encoded with
+  the TermDictionary `terms`, following the snapshots of that index it
+  is given. The copy keeps one uid, and the version and per-predicate
+  versions of the snapshot it holds.
+  '''
+  def __init__(self, terms, bitmap_fanout):
+    self.terms = terms
+    self.bitmap_fanout = bitmap_fanout
+    self.uid = next(index_uids)
+    self.copy = None
+    # the version copied and its spo (to compare the next with, holding
+    #  term ids alone so the index and its terms can go)
+    self.version = None
+    self.spo = None
+    self._lock = threading.Lock()
+  #
+  def snapshot(self, index):
+    ''' A snapshot of the copy of the snapshot `index`. Only the triples
+    written between the last snapshot copied and `index` are re-encoded
+    when both are JsonLDIndex snapshots (which share what wasn't written).
+    '''
+    with self._lock:
+      if self.version == index.version:
+        return self.copy.snapshot()
+      decode = index.terms.decode
+      if self.spo is not None and type(index.spo) == SegmentedMap:
+        removed, added = dds_changes(self.spo, index.spo)
+      else:
+        self.copy = JsonLDIndex(terms=self.terms, bitmap_fanout=self.bitmap_fanout)
+        removed = ()
+        added = (
+          (subj, pred, obj)
+          for subj, po in index.spo.items()
+          for pred, objs in po.items()
+          for obj in objs
+        )
+      copy = self.copy
+      with copy._lock:
+        copy.remove_triples((decode(subj), pred, decode(obj)) for subj, pred, obj in removed)
+        copy.insert_triples((decode(subj), pred, decode(obj)) for subj, pred, obj in added)
+        # published again as a copy of `index`
+        copy.uid, copy.version, copy.versions = self.uid, index.version, dict(index.versions)
+        copy._publish()
+      self.version = index.version
+      self.spo = index.spo if type(index.spo) == SegmentedMap else None
+      return copy.snapshot()
+
+# The Translations of indexes by `translated`: the term dictionary of the
+#  copies -> {uid of the index copied: Translation}, least recently used
+#  first
+translations = weakref.WeakKeyDictionary()
+translations_lock = threading.Lock()
+max_translations = 64
+
+def translated(index, terms):
+  ''' A snapshot of the triples of the snapshot `index` encoded with the
+  TermDictionary `terms`, so it can be framed with the indexes using it.
+  `index` itself when it already does.
+  '''
+  if index.terms is terms:
+    return index
+  with translations_lock:
+    copies = translations.get(terms)
+    if copies is None:
+      copies = translations[terms] = collections.OrderedDict()
+    translation = copies.get(index.uid)
+    if translation is None:
+      translation = copies[index.uid] = Translation(terms, index.bitmap_fanout)
+      while len(copies) > max_translations:
+        copies.popitem(last=False)
+    else:
+      copies.move_to_end(index.uid)
+  return translation.snapshot(index)
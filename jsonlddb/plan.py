@@ -0,0 +1,721 @@
+'''
+Frames are planned into a tree of constraints. Each constraint can either
+ produce the subjects satisfying it from the pos index (bottom-up) or test
+ a given subject by probing that subject's own relationships (top-down).
+
+At every level constraints are ordered most-selective-first using the
+ cardinality statistics of the indexes: the first one drives the level,
+ the rest are either joined with its results or used to probe them,
+ whichever is estimated to touch fewer postings.
+
+When only the first few results are wanted, `stream` instead pipelines
+ the driver's postings one at a time through probes of the remaining
+ constraints, so nothing is materialized and evaluation stops with the
+ last result consumed. A `$text` constraint drives the streams of its
+ level so that they come best match first. `ordered` evaluates a frame
+ in bulk and produces its results in the order of `stream`, so that
+ iterating over all of them agrees with pages of a few.
+'''
+import heapq
+import functools
+from jsonlddb.chain_set import chain_set_union, chain_set_intersection, is_materialized
+from jsonlddb.ranges import SortedLiterals, range_operators, range_match
+from jsonlddb.text import TextIndex, text_match
+from jsonlddb.rdf import RDFTerm, RDFTermType
+
+# Probing a subject costs roughly this many posting list elements
+probe_cost = 4
+
+def inverse(pred):
+  return pred[1:] if pred.startswith('~') else '~' + pred
+
+def base_predicate(pred):
+  ''' The predicate whose triples back `pred` (itself or its inverse)
+  '''
+  return pred[1:] if pred.startswith('~') else pred
+
+def is_literal_value(v):
+  return type(v) not in [dict, list]
+
+class Param:
+  ''' A slot for the literal value(s) (or '@id's) of a frame, filled at
+  each execution from the `params` given by name (see `compile_frame`)
+  '''
+  __slots__ = ('name',)
+  #
+  def __init__(self, name):
+    self.name = name
+  #
+  def __eq__(self, other):
+    return type(other) == Param and other.name == self.name
+  #
+  def __hash__(self):
+    return hash((Param, self.name))
+  #
+  def __repr__(self):
+    return 'Param({!r})'.format(self.name)
+
+def is_operator_object(obj):
+  ''' Whether the frame value `obj` holds operators ({'$gt': 1, ...})
+  rather than a subframe
+  '''
+  return all(k.startswith('$') for k in obj)
+
+def has_params(values):
+  return any(v.__class__ is Param for v in values)
+
+def multi_index_terms(multi_index):
+  ''' The term dictionary shared by all indexes in `multi_index`
+  '''
+  terms = multi_index[0].terms
+  if len(multi_index) > 1 and any(index.terms is not terms for index in multi_index):
+    raise Exception('Indexes framed together must share a term dictionary')
+  return terms
+
+class PlanContext:
+  ''' State of a single frame execution over `multi_index`: the shared term
+  dictionary, the values bound to Params and memoized estimates, step
+  orders and term lookups.
+
+  Executions of a compiled frame can share memos: `static_ids` persists
+  the lookups of values without Params (once all are known terms) and
+  `memo` the (estimates, steps, ids) of executions with the same params
+  over unchanged indexes.
+  '''
+  def __init__(self, multi_index, params=None, static_ids=None, memo=None):
+    self.multi_index = multi_index
+    self.terms = multi_index_terms(multi_index)
+    self.params = {} if params is None else params
+    self._static_ids = static_ids
+    self._estimates, self._steps, self._ids = ({}, {}, {}) if memo is None else memo
+  #
+  def estimate(self, node):
+    estimate = self._estimates.get(node)
+    if estimate is None:
+      estimate = self._estimates[node] = node.estimate(self)
+    return estimate
+  #
+  def values(self, node):
+    ''' node.values with Params bound
+    '''
+    if not node.has_params:
+      return node.values
+    values = []
+    for v in node.values:
+      if v.__class__ is Param:
+        if v.name not in self.params:
+          raise Exception('Unbound frame parameter {!r}'.format(v.name))
+        bound = self.params[v.name]
+        values.extend(bound if type(bound) == list else [bound])
+      else:
+        values.append(v)
+    return values
+  #
+  def ids(self, node, type):
+    ''' The ids of node.values as terms of `type`, skipping unknown ones
+    '''
+    ids = self._ids.get(node)
+    if ids is None:
+      if self._static_ids is not None:
+        ids = self._static_ids.get(node)
+      if ids is None:
+        values = self.values(node)
+        ids = [
+          id
+          for id in (self.terms.lookup(RDFTerm(type, value)) for value in values)
+          if id is not None
+        ]
+        if self._static_ids is not None and values is node.values and len(ids) == len(values):
+          self._static_ids[node] = ids
+      self._ids[node] = ids
+    return ids
+  #
+  def matches(self, node):
+    ''' The objects matching node's operators in each index
+    '''
+    matches = self._ids.get(node)
+    if matches is None:
+      matches = self._ids[node] = node.matches(self)
+    return matches
+  #
+  def steps(self, plan):
+    ''' Order the constraints of `plan` as (constraint, estimate, strategy)
+    '''
+    steps = self._steps.get(plan)
+    if steps is None and len(plan.constraints) == 1:
+      # nothing to order (nor estimate)
+      steps = self._steps[plan] = [(plan.constraints[0], None, 'scan')]
+    elif steps is None:
+      # (only memoized once complete, memos can be shared between threads)
+      steps = []
+      candidates = None
+      for estimate, _, constraint in sorted(
+        (self.estimate(constraint), i, constraint)
+        for i, constraint in enumerate(plan.constraints)
+      ):
+        if candidates is None:
+          strategy = 'scan'
+          candidates = estimate
+        elif candidates * probe_cost <= estimate:
+          strategy = 'probe'
+        else:
+          strategy = 'join'
+        candidates = min(candidates, estimate)
+        steps.append((constraint, estimate, strategy))
+      self._steps[plan] = steps
+    return steps
+  #
+  def subject_count(self, pred):
+    ''' The number of subjects with some `pred`
+    '''
+    return sum(len(index.pos.get(inverse(pred), ())) for index in self.multi_index)
+  #
+  def triple_count(self, pred):
+    return sum(index.counts.get(base_predicate(pred), 0) for index in self.multi_index)
+  #
+  def has_object(self, pred, subj, obj):
+    return any(
+      obj in index.pos.get(inverse(pred), {}).get(subj, ())
+      for index in self.multi_index
+    )
+  #
+  def objects(self, pred, subj):
+    return chain_set_union(
+      index.pos.get(inverse(pred), {}).get(subj, ())
+      for index in self.multi_index
+    )
+
+class IdConstraint:
+  ''' '@id': value(s)
+  '''
+  pred = '@id'
+  #
+  def __init__(self, values):
+    self.values = values
+    self.has_params = has_params(values)
+  #
+  def estimate(self, ctx):
+    return len(ctx.values(self))
+  #
+  def subjects(self, ctx):
+    return {
+      subj
+      for subj in ctx.ids(self, RDFTermType.IRI)
+      if any(subj in index.spo for index in ctx.multi_index)
+    }
+  #
+  def cardinality(self, ctx):
+    return len(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    return True
+  #
+  def stream(self, ctx):
+    return iter(self.subjects(ctx))
+  #
+  def test(self, ctx, subj):
+    return subj in ctx.ids(self, RDFTermType.IRI)
+  #
+  def predicates(self):
+    return {self.pred}
+  #
+  def explain(self, ctx):
+    return {'pred': self.pred, 'values': ctx.values(self)}
+
+class LiteralConstraint:
+  ''' pred: literal value(s)
+  '''
+  def __init__(self, pred, values):
+    self.pred = pred
+    self.values = values
+    self.has_params = has_params(values)
+  #
+  def estimate(self, ctx):
+    return sum(
+      len(index.pos.get(self.pred, {}).get(obj, ()))
+      for index in ctx.multi_index
+      for obj in ctx.ids(self, RDFTermType.LITERAL)
+    )
+  #
+  def subjects(self, ctx):
+    return chain_set_union(
+      index.pos.get(self.pred, {}).get(obj, set())
+      for index in ctx.multi_index
+      for obj in ctx.ids(self, RDFTermType.LITERAL)
+    )
+  #
+  def cardinality(self, ctx):
+    if self.sized(ctx):
+      # a single posting list, nothing to deduplicate
+      return sum(
+        len(ctx.multi_index[0].pos.get(self.pred, {}).get(obj, ()))
+        for obj in ctx.ids(self, RDFTermType.LITERAL)
+      )
+    return size(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    return len(ctx.multi_index) == 1 and len(ctx.ids(self, RDFTermType.LITERAL)) <= 1
+  #
+  def stream(self, ctx):
+    return unique(
+      subj
+      for index in ctx.multi_index
+      for obj in ctx.ids(self, RDFTermType.LITERAL)
+      for subj in index.pos.get(self.pred, {}).get(obj, ())
+    )
+  #
+  def test(self, ctx, subj):
+    return any(
+      ctx.has_object(self.pred, subj, obj)
+      for obj in ctx.ids(self, RDFTermType.LITERAL)
+    )
+  #
+  def predicates(self):
+    return {self.pred}
+  #
+  def explain(self, ctx):
+    return {'pred': self.pred, 'values': ctx.values(self)}
+
+class ExistsConstraint:
+  ''' pred: {}
+  '''
+  def __init__(self, pred):
+    self.pred = pred
+  #
+  def estimate(self, ctx):
+    return ctx.subject_count(self.pred)
+  #
+  def subjects(self, ctx):
+    # the subjects with pred are the keys of its inverse
+    return chain_set_union(
+      index.pos.get(inverse(self.pred), {}).keys()
+      for index in ctx.multi_index
+    )
+  #
+  def cardinality(self, ctx):
+    if self.sized(ctx):
+      return ctx.subject_count(self.pred)
+    return size(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    return len(ctx.multi_index) == 1
+  #
+  def stream(self, ctx):
+    return unique(
+      subj
+      for index in ctx.multi_index
+      for subj in index.pos.get(inverse(self.pred), {})
+    )
+  #
+  def test(self, ctx, subj):
+    return any(
+      subj in index.pos.get(inverse(self.pred), {})
+      for index in ctx.multi_index
+    )
+  #
+  def predicates(self):
+    return {self.pred}
+  #
+  def explain(self, ctx):
+    return {'pred': self.pred}
+
+class RelatedConstraint:
+  ''' pred: {subframe}
+  '''
+  def __init__(self, pred, plan):
+    self.pred = pred
+    self.plan = plan
+  #
+  def estimate(self, ctx):
+    # objects matching the subframe times the average subjects per object
+    objects = sum(len(index.pos.get(self.pred, ())) for index in ctx.multi_index)
+    fanout = ctx.triple_count(self.pred) / objects if objects else 0
+    return min(ctx.subject_count(self.pred), int(ctx.estimate(self.plan) * fanout + 0.5))
+  #
+  def subjects(self, ctx):
+    return chain_set_union(
+      index.pos.get(self.pred, {}).get(obj, set())
+      for obj in self.plan.subjects(ctx)
+      for index in ctx.multi_index
+    )
+  #
+  def cardinality(self, ctx):
+    return size(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    return False
+  #
+  def stream(self, ctx):
+    return unique(
+      subj
+      for obj in self.plan.stream(ctx)
+      for index in ctx.multi_index
+      for subj in index.pos.get(self.pred, {}).get(obj, ())
+    )
+  #
+  def test(self, ctx, subj):
+    return any(
+      self.plan.test(ctx, obj)
+      for obj in ctx.objects(self.pred, subj)
+    )
+  #
+  def predicates(self):
+    return {self.pred} | self.plan.predicates()
+  #
+  def explain(self, ctx):
+    return {'pred': self.pred, 'frame': self.plan.explain(ctx)}
+
+class AnyConstraint:
+  ''' pred: [value, {subframe}, ...]
+  '''
+  def __init__(self, pred, constraints):
+    self.pred = pred
+    self.constraints = constraints
+  #
+  def estimate(self, ctx):
+    return sum(ctx.estimate(constraint) for constraint in self.constraints)
+  #
+  def subjects(self, ctx):
+    return chain_set_union(
+      constraint.subjects(ctx)
+      for constraint in self.constraints
+    )
+  #
+  def cardinality(self, ctx):
+    return size(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    return False
+  #
+  def stream(self, ctx):
+    return unique(
+      subj
+      for constraint in self.constraints
+      for subj in constraint.stream(ctx)
+    )
+  #
+  def test(self, ctx, subj):
+    return any(constraint.test(ctx, subj) for constraint in self.constraints)
+  #
+  def predicates(self):
+    return set.union(*(constraint.predicates() for constraint in self.constraints))
+  #
+  def explain(self, ctx):
+    return {
+      'pred': self.pred,
+      'any': [
+        dict(constraint.explain(ctx), estimated=ctx.estimate(constraint), actual=count(constraint.subjects(ctx)))
+        for constraint in self.constraints
+      ],
+    }
+
+class RangeConstraint:
+  ''' pred: {'$gt': value, '$lte': value, '$prefix': value, ...}
+
+  The matching objects are found in the sorted literals of each index
+  (in order of their value), their posting lists producing the subjects.
+  '''
+  def __init__(self, pred, ops):
+    unknown = set(ops) - range_operators
+    if unknown:
+      raise Exception('Unrecognized frame operator(s) {}'.format(', '.join(sorted(unknown))))
+    self.pred = pred
+    self.ops = list(ops)
+    self.values = list(ops.values())
+    self.has_params = has_params(self.values)
+  #
+  def operators(self, ctx):
+    return dict(zip(self.ops, ctx.values(self)))
+  #
+  def matches(self, ctx):
+    ops = self.operators(ctx)
+    return [
+      list(index.literal_index(self.pred, SortedLiterals).ids(ops))
+      for index in ctx.multi_index
+    ]
+  #
+  def estimate(self, ctx):
+    return sum(
+      len(index.pos.get(self.pred, {}).get(obj, ()))
+      for index, objs in zip(ctx.multi_index, ctx.matches(self))
+      for obj in objs
+    )
+  #
+  def subjects(self, ctx):
+    return chain_set_union(
+      index.pos.get(self.pred, {}).get(obj, set())
+      for index, objs in zip(ctx.multi_index, ctx.matches(self))
+      for obj in objs
+    )
+  #
+  def cardinality(self, ctx):
+    return size(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    return False
+  #
+  def stream(self, ctx):
+    return unique(
+      subj
+      for index, objs in zip(ctx.multi_index, ctx.matches(self))
+      for obj in objs
+      for subj in index.pos.get(self.pred, {}).get(obj, ())
+    )
+  #
+  def test(self, ctx, subj):
+    ops = self.operators(ctx)
+    for obj in ctx.objects(self.pred, subj):
+      term = ctx.terms.decode(obj)
+      if term.type == RDFTermType.LITERAL and range_match(ops, term.value):
+        return True
+    return False
+  #
+  def predicates(self):
+    return {self.pred}
+  #
+  def explain(self, ctx):
+    return {'pred': self.pred, 'range': self.operators(ctx)}
+
+class TextConstraint:
+  ''' pred: {'$text': query}
+
+  The objects containing every word of the query are found in the
+  TextIndex of each index; streamed, their subjects come in order of
+  their best scoring object.
+  '''
+  def __init__(self, pred, query):
+    self.pred = pred
+    self.values = [query]
+    self.has_params = has_params(self.values)
+  #
+  def query(self, ctx):
+    query, = ctx.values(self)
+    if type(query) != str:
+      raise Exception('$text takes a string')
+    return query
+  #
+  def matches(self, ctx):
+    query = self.query(ctx)
+    return [
+      index.literal_index(self.pred, TextIndex).search(query)
+      for index in ctx.multi_index
+    ]
+  #
+  def estimate(self, ctx):
+    return sum(
+      len(index.pos.get(self.pred, {}).get(obj, ()))
+      for index, matches in zip(ctx.multi_index, ctx.matches(self))
+      for _, obj in matches
+    )
+  #
+  def subjects(self, ctx):
+    return chain_set_union(
+      index.pos.get(self.pred, {}).get(obj, set())
+      for index, matches in zip(ctx.multi_index, ctx.matches(self))
+      for _, obj in matches
+    )
+  #
+  def cardinality(self, ctx):
+    return size(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    return False
+  #
+  def ranked(self, ctx):
+    ''' (index, obj) of the matches, best first, ranked lazily
+    '''
+    heap = [
+      (-score, obj, i)
+      for i, matches in enumerate(ctx.matches(self))
+      for score, obj in matches
+    ]
+    heapq.heapify(heap)
+    while heap:
+      _, obj, i = heapq.heappop(heap)
+      yield ctx.multi_index[i], obj
+  #
+  def stream(self, ctx):
+    return unique(
+      subj
+      for index, obj in self.ranked(ctx)
+      for subj in index.pos.get(self.pred, {}).get(obj, ())
+    )
+  #
+  def test(self, ctx, subj):
+    query = self.query(ctx)
+    for obj in ctx.objects(self.pred, subj):
+      term = ctx.terms.decode(obj)
+      if term.type == RDFTermType.LITERAL and type(term.value) == str and text_match(query, term.value):
+        return True
+    return False
+  #
+  def predicates(self):
+    return {self.pred}
+  #
+  def explain(self, ctx):
+    return {'pred': self.pred, 'text': self.query(ctx)}
+
+def constraint_from_operators(pred, ops):
+  if '$text' in ops:
+    if len(ops) > 1:
+      raise Exception('$text can\'t be combined with other operators')
+    return TextConstraint(pred, ops['$text'])
+  return RangeConstraint(pred, ops)
+
+def constraint_from_object(pred, obj):
+  if pred == '@id':
+    return IdConstraint([obj] if is_literal_value(obj) else obj)
+  elif type(obj) == list:
+    if all(is_literal_value(o) for o in obj):
+      return LiteralConstraint(pred, obj)
+    return AnyConstraint(pred, [constraint_from_object(pred, o) for o in obj])
+  elif obj == {}:
+    return ExistsConstraint(pred)
+  elif type(obj) == dict and is_operator_object(obj):
+    return constraint_from_operators(pred, obj)
+  elif type(obj) == dict:
+    return RelatedConstraint(pred, FramePlan.from_frame(obj))
+  else:
+    return LiteralConstraint(pred, [obj])
+
+def count(it):
+  return sum(1 for _ in it)
+
+def size(subjs):
+  ''' The number of subjects produced, without iterating materialized ones
+  '''
+  return len(subjs) if hasattr(subjs, '__len__') else count(subjs)
+
+def unique(it):
+  seen = set()
+  for v in it:
+    if v not in seen:
+      seen.add(v)
+      yield v
+
+class FramePlan:
+  ''' The conjunction of all constraints of one level of a frame
+  '''
+  def __init__(self, constraints):
+    self.constraints = constraints
+  #
+  @staticmethod
+  def from_frame(frame):
+    return FramePlan([
+      constraint_from_object(pred, obj)
+      for pred, obj in frame.items()
+      if not (pred == '@id' and obj == {})
+    ])
+  #
+  def estimate(self, ctx):
+    if not self.constraints:
+      return sum(len(index.spo) for index in ctx.multi_index)
+    return min(ctx.estimate(constraint) for constraint in self.constraints)
+  #
+  def subjects(self, ctx):
+    if not self.constraints:
+      return chain_set_union(
+        index.spo.keys()
+        for index in ctx.multi_index
+      )
+    steps = iter(ctx.steps(self))
+    driver, _, _ = next(steps)
+    subjs = driver.subjects(ctx)
+    for constraint, _, strategy in steps:
+      if strategy == 'probe':
+        subjs = filter(functools.partial(constraint.test, ctx), subjs)
+      else:
+        subjs = chain_set_intersection((subjs, constraint.subjects(ctx)))
+    return subjs
+  #
+  def cardinality(self, ctx):
+    ''' The number of `subjects`, from the sizes of the index or of the
+    set algebra's results where possible
+    '''
+    if not self.constraints and len(ctx.multi_index) == 1:
+      return len(ctx.multi_index[0].spo)
+    elif len(self.constraints) == 1:
+      return self.constraints[0].cardinality(ctx)
+    return size(self.subjects(ctx))
+  #
+  def sized(self, ctx):
+    ''' Whether `cardinality` comes from the sizes of the index alone,
+    without evaluating the frame
+    '''
+    if not self.constraints:
+      return len(ctx.multi_index) == 1
+    return len(self.constraints) == 1 and self.constraints[0].sized(ctx)
+  #
+  def stream(self, ctx):
+    ''' `subjects` produced one at a time: the driver's are streamed and
+    tested against the other constraints
+    '''
+    if not self.constraints:
+      return unique(
+        subj
+        for index in ctx.multi_index
+        for subj in index.spo.keys()
+      )
+    steps = self.stream_steps(ctx)
+    driver, _, _ = steps[0]
+    tests = [functools.partial(constraint.test, ctx) for constraint, _, _ in steps[1:]]
+    return (
+      subj
+      for subj in driver.stream(ctx)
+      if all(test(subj) for test in tests)
+    )
+  #
+  def stream_steps(self, ctx):
+    ''' The steps of `stream`, its driver first: a TextConstraint's if
+    any, so that ranked results come first
+    '''
+    steps = ctx.steps(self)
+    for i, (constraint, _, _) in enumerate(steps):
+      if type(constraint) == TextConstraint:
+        return [steps[i]] + steps[:i] + steps[i+1:]
+    return steps
+  #
+  def ordered(self, ctx):
+    ''' `subjects` in the order of `stream`: evaluated in bulk, then
+    produced in the order the driver of `stream` streams them
+    '''
+    if len(self.constraints) <= 1:
+      return self.stream(ctx)
+    subjs = self.subjects(ctx)
+    if not is_materialized(subjs):
+      subjs = set(subjs)
+    driver, _, _ = self.stream_steps(ctx)[0]
+    return (subj for subj in driver.stream(ctx) if subj in subjs)
+  #
+  def test(self, ctx, subj):
+    if not self.constraints:
+      return any(subj in index.spo for index in ctx.multi_index)
+    return all(constraint.test(ctx, subj) for constraint, _, _ in ctx.steps(self))
+  #
+  def predicates(self):
+    ''' The predicates (including `~` inverses) this plan reads, '@id'
+    standing for the set of subjects.
+    '''
+    if not self.constraints:
+      return {'@id'}
+    return set.union(*(constraint.predicates() for constraint in self.constraints))
+  #
+  def explain(self, ctx):
+    ''' The chosen steps with their estimated and actual row counts, the
+    actual count of a step being the rows it matches on its own, and the
+    constraint whose stream orders the results (see `ordered`).
+    '''
+    return {
+      'order': self.stream_steps(ctx)[0][0].explain(ctx) if self.constraints else None,
+      'estimated': ctx.estimate(self),
+      'actual': count(self.subjects(ctx)),
+      'steps': [
+        dict(
+          constraint.explain(ctx),
+          strategy=strategy,
+          estimated=ctx.estimate(constraint),
+          actual=count(constraint.subjects(ctx)),
+        )
+        for constraint, _, strategy in ctx.steps(self)
+      ],
+    }
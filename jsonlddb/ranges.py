@@ -0,0 +1,195 @@
+'''
+Sorted secondary indexes over the literal objects of a predicate, used to
+ answer range (`$gt`, `$gte`, `$lt`, `$lte`) and string prefix (`$prefix`)
+ frame operators in O(log N + k) instead of scanning every object.
+
+Numbers and strings are kept apart (they don't compare), other literals
+ (booleans, None, json) are never matched by these operators.
+'''
+import bisect
+from jsonlddb.rdf import RDFTermType
+
+range_operators = {'$gt', '$gte', '$lt', '$lte', '$prefix'}
+number_types = (int, float)
+
+def literal_family(value):
+  ''' The SortedLiterals list comparable to `value` (bools aren't numbers)
+  '''
+  if type(value) in number_types:
+    return 'numbers'
+  elif type(value) == str:
+    return 'strings'
+  return None
+
+def range_bounds(ops):
+  ''' The family of the bounds in `ops` ({operator: value}) which must all
+  be numbers or all strings
+  '''
+  families = {literal_family(v) for v in ops.values()}
+  if len(families) != 1 or None in families:
+    raise Exception('Range operators take either numbers or strings: {}'.format(ops))
+  family, = families
+  if '$prefix' in ops and family != 'strings':
+    raise Exception('$prefix takes a string')
+  return family
+
+def range_match(ops, value):
+  ''' Whether the literal `value` satisfies all of `ops`
+  '''
+  if literal_family(value) != range_bounds(ops):
+    return False
+  for op, bound in ops.items():
+    if op == '$gt' and not value > bound:
+      return False
+    elif op == '$gte' and not value >= bound:
+      return False
+    elif op == '$lt' and not value < bound:
+      return False
+    elif op == '$lte' and not value <= bound:
+      return False
+    elif op == '$prefix' and not value.startswith(bound):
+      return False
+  return True
+
+class SortedChunks:
+  ''' A sorted list held as consecutive sorted chunks of up to
+  2*`chunk_size` items. A copy shares the chunks and either copies a
+  chunk before writing to it, so copies cost what is written to them.
+  '''
+  chunk_size = 512
+  #
+  def __init__(self, items=()):
+    items = sorted(items)
+    self._chunks = [items[i:i+self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+    self._maxes = [chunk[-1] for chunk in self._chunks]
+    self._owned = {id(chunk) for chunk in self._chunks}
+    self._len = len(items)
+  #
+  def copy(self):
+    copy = SortedChunks()
+    copy._chunks, copy._maxes, copy._len = list(self._chunks), list(self._maxes), self._len
+    # both now share every chunk
+    self._owned = set()
+    return copy
+  #
+  def _writable(self, k):
+    chunk = self._chunks[k]
+    if id(chunk) not in self._owned:
+      chunk = self._chunks[k] = chunk[:]
+      self._owned.add(id(chunk))
+    return chunk
+  #
+  def __len__(self):
+    return self._len
+  #
+  def add(self, item):
+    if not self._chunks:
+      self._chunks.append([item])
+      self._maxes.append(item)
+      self._owned.add(id(self._chunks[0]))
+    else:
+      k = min(bisect.bisect_left(self._maxes, item), len(self._chunks) - 1)
+      chunk = self._writable(k)
+      bisect.insort(chunk, item)
+      self._maxes[k] = chunk[-1]
+      if len(chunk) > 2 * self.chunk_size:
+        head, tail = chunk[:self.chunk_size], chunk[self.chunk_size:]
+        self._chunks[k:k+1] = [head, tail]
+        self._maxes[k:k+1] = [head[-1], tail[-1]]
+        self._owned.discard(id(chunk))
+        self._owned.update((id(head), id(tail)))
+    self._len += 1
+  #
+  def discard(self, item):
+    k = bisect.bisect_left(self._maxes, item)
+    if k == len(self._chunks):
+      return
+    i = bisect.bisect_left(self._chunks[k], item)
+    if i == len(self._chunks[k]) or self._chunks[k][i] != item:
+      return
+    chunk = self._writable(k)
+    del chunk[i]
+    if chunk:
+      self._maxes[k] = chunk[-1]
+    else:
+      del self._chunks[k], self._maxes[k]
+      self._owned.discard(id(chunk))
+    self._len -= 1
+  #
+  def __iter__(self):
+    for chunk in self._chunks:
+      yield from chunk
+  #
+  def irange(self, start=None, end=None):
+    ''' The items from `start` (included) up to `end` (excluded), None
+    leaving either unbounded
+    '''
+    k = i = 0
+    if start is not None:
+      k = bisect.bisect_left(self._maxes, start)
+      if k < len(self._chunks):
+        i = bisect.bisect_left(self._chunks[k], start)
+    for chunk in self._chunks[k:]:
+      for item in chunk[i:]:
+        if end is not None and not item < end:
+          return
+        yield item
+      i = 0
+
+class SortedLiterals:
+  ''' The distinct literal objects of one predicate as (value, term id)
+  sorted by value
+  '''
+  def __init__(self, literals=()):
+    by_family = {'numbers': [], 'strings': []}
+    for value, id in literals:
+      family = literal_family(value)
+      if family is not None:
+        by_family[family].append((value, id))
+    self.numbers = SortedChunks(by_family['numbers'])
+    self.strings = SortedChunks(by_family['strings'])
+  #
+  @staticmethod
+  def from_index(index, pred):
+    decode = index.terms.decode
+    return SortedLiterals(
+      (term.value, obj)
+      for term, obj in ((decode(obj), obj) for obj in index.pos.get(pred, {}).keys())
+      if term.type == RDFTermType.LITERAL
+    )
+  #
+  def copy(self):
+    copy = SortedLiterals()
+    copy.numbers, copy.strings = self.numbers.copy(), self.strings.copy()
+    return copy
+  #
+  def add(self, term, id):
+    family = literal_family(term.value)
+    if family is not None and term.type == RDFTermType.LITERAL:
+      getattr(self, family).add((term.value, id))
+  #
+  def discard(self, term, id):
+    family = literal_family(term.value)
+    if family is not None and term.type == RDFTermType.LITERAL:
+      getattr(self, family).discard((term.value, id))
+  #
+  def ids(self, ops):
+    ''' The ids of the objects satisfying `ops`
+    '''
+    values = getattr(self, range_bounds(ops))
+    # (v,) sorts before and (v, inf) after all (v, id) entries
+    starts, ends = [], []
+    for op, bound in ops.items():
+      if op == '$gt':
+        starts.append((bound, float('inf')))
+      elif op == '$gte' or op == '$prefix':
+        starts.append((bound,))
+      elif op == '$lt':
+        ends.append((bound,))
+      elif op == '$lte':
+        ends.append((bound, float('inf')))
+    prefix = ops.get('$prefix')
+    for value, id in values.irange(max(starts, default=None), min(ends, default=None)):
+      if prefix is not None and not value.startswith(prefix):
+        break
+      yield id
@@ -4,25 +4,63 @@ class RDFTermType(enum.Enum):
   IRI = 0
   LITERAL = 1
   #
-  def __hash__(self):
-    if self == RDFTermType.IRI:
-      return 0
-    elif self == RDFTermType.LITERAL:
-      return 1
+  # members are singletons compared by identity, hashing them by identity
+  #  (in C) keeps hashing terms cheap
+  __hash__ = object.__hash__
   #
   def __repr__(self):
-    return 'IRI' if self == RDFTermType.IRI else 'LITERAL'
+    return 'IRI' if self is RDFTermType.IRI else 'LITERAL'
 
 class RDFTerm:
+  ''' An immutable IRI or literal. Values of different types are different
+  terms even when equal in python (1, 1.0 and True). The hash is computed
+  once, on first use.
+
+  Equal terms are interchangeable, a TermDictionary holds a single
+  (interned) RDFTerm for each term it encodes, see `TermDictionary.intern_iri`.
+  '''
+  __slots__ = ('type', 'value', '_hash')
+  #
   def __init__(self, type=None, value=None):
-    self.type = type
-    self.value = value
+    set_type(self, type)
+    set_value(self, value)
+  #
+  def __setattr__(self, attr, value):
+    raise AttributeError('RDFTerms are immutable')
+  #
+  def __delattr__(self, attr):
+    raise AttributeError('RDFTerms are immutable')
+  #
+  def __reduce__(self):
+    return (RDFTerm, (self.type, self.value))
   #
   def __eq__(self, other):
-    return (self.type, hash(type(self.value)), self.value) == (other.type, hash(type(other.value)), other.value)
+    if self is other:
+      return True
+    if other.__class__ is not RDFTerm:
+      return NotImplemented
+    return (
+      self.type is other.type
+      and self.value.__class__ is other.value.__class__
+      and self.value == other.value
+    )
+  #
+  def __ne__(self, other):
+    eq = self.__eq__(other)
+    return eq if eq is NotImplemented else not eq
   #
   def __hash__(self):
-    return hash((self.type, self.value))
+    try:
+      return self._hash
+    except AttributeError:
+      h = hash((self.type, self.value))
+      set_hash(self, h)
+      return h
   #
   def __repr__(self):
     return '{}:{}'.format(repr(self.type), repr(self.value))
+
+# slot setters, bypassing __setattr__
+set_type = RDFTerm.type.__set__
+set_value = RDFTerm.value.__set__
+set_hash = RDFTerm._hash.__set__
@@ -1,4 +1,36 @@
-from jsonlddb.oop import JsonLDDatabase
+'''
+Rules are nodes of '@type': 'Rule' stating that the nodes matching their
+ `given` frame, passed to the function named by `using` (in a `context`),
+ produce jsonld satisfying their `produce` frame. A frame is answered
+ with the output of the rules whose `produce` frame overlaps it.
+
+A RuleEngine materializes the output of each rule in an index of its own
+ and keeps it up to date: after writes to the database a rule is only
+ fired again for the subjects which started (or stopped) matching its
+ `given` frame or whose triples changed (theirs or those of the nodes
+ the subframes of `given` reach from them), so frames with rules cost
+ about as much as plain framing. Those triples are all a rule function
+ sees of the database (see `Rule`).
+
+The functions of rules are independent across the nodes they're given:
+ with an `executor` (a concurrent.futures thread or process pool) a
+ RuleEngine dispatches them to it and `aframe` awaits coroutine functions
+ concurrently. Outputs are applied in the order of their subjects so
+ results don't depend on the order in which they complete.
+'''
+import time
+import asyncio
+import threading
+import itertools
+import collections
+import concurrent.futures
+from jsonlddb import json
+from jsonlddb.compiled import canonical_frame
+from jsonlddb.core import jsonld_to_triples
+from jsonlddb.index import JsonLDIndex
+from jsonlddb.oop import JsonLDDatabase, JsonLDNode
+from jsonlddb.plan import inverse, is_operator_object
+from jsonlddb.rdf import RDFTerm, RDFTermType
 
 def frame_intersection(frame0, frame1):
   return (frame0.keys() & frame1.keys()) and all(
@@ -6,20 +38,344 @@ def frame_intersection(frame0, frame1):
     for k in (frame0.keys() & frame1.keys())
   )
 
-def frame_with_rules(db, frame, rules=None, context={}):
-  if rules is None:
-    rules = db
-  # Apply rule IFF
-  #  1) desired frame overlaps with produce frame
-  #  2) given frame can be satisfied by query
-  tmp = JsonLDDatabase()
-  # Consider all rules
-  for rule in rules[{'@type': 'Rule'}]:
-    # such that desired frame overlaps with produce frame
-    if frame_intersection(frame, rule['produce'][0]):
-      # and given frame satisfies query
-      for matching_doc in db[rule['given'][0]]:
-        # Add rule-created triples
-        tmp.update(context[rule['using'][0]](matching_doc))
-  # Frame injecting tmp values
-  return db.with_db(tmp)[frame]
+def json_value(v):
+  return v.value if isinstance(v, json.JSON) else v
+
+def indexes_of(db):
+  return [d.index for d in [db._db] + db._additional]
+
+def multi_index_stamp(db):
+  return tuple((index.uid, index.version) for index in indexes_of(db))
+
+def node_json(node):
+  ''' A plain (picklable) form of `node` for functions run in other
+  processes: its own values, related nodes by '@id'
+  '''
+  return dict(
+    {
+      pred: [
+        {'@id': obj._subj} if isinstance(obj, JsonLDNode) else obj
+        for obj in objs
+      ]
+      for pred, objs in node.items()
+    },
+    **{'@id': node._subj}
+  )
+
+def timed_call(fn, arg):
+  start = time.perf_counter()
+  return fn(arg), time.perf_counter() - start
+
+async def timed_await(fn, arg, semaphore):
+  async with semaphore:
+    start = time.perf_counter()
+    return await fn(arg), time.perf_counter() - start
+
+class Rule:
+  ''' A rule with the output it produced for each subject matching `given`
+  and `stats` of its evaluation.
+
+  The function of a rule is given a node framed from the triples of its
+  subject and of the nodes the subframes of `given` reach from it (e.g.
+  the friends of {'knows': {}}, not theirs), and nothing else: those are
+  the triples whose changes fire it again, so its output can't depend on
+  any other. Functions reading further must say so in `given`.
+  '''
+  def __init__(self, given, using, produce, terms, canonical_id):
+    self.given = given
+    self.using = using
+    self.produce = produce
+    self.output = JsonLDDatabase(index=JsonLDIndex(terms=terms), canonical_id=canonical_id)
+    # subject -> (signature of its triples, triples produced for it)
+    self.fired = {}
+    # how many subjects produced each triple
+    self.support = collections.Counter()
+    self.stamp = None
+    # the task of the `RuleEngine._arefresh` in progress
+    self.refreshing = None
+    self.stats = {'refreshes': 0, 'fired': 0, 'retracted': 0, 'seconds': 0.0, 'function_seconds': 0.0}
+  #
+  def apply(self, retract, fired, batch_size):
+    ''' Retract the output of the subjects `retract` and replace that of
+    the subjects in `fired` [(subj, signature, jsonld)], writing the net
+    change of the output in batches
+    '''
+    # whether each triple touched was in the output before
+    touched = {}
+    for subj in itertools.chain(retract, (subj for subj, _, _ in fired if subj in self.fired)):
+      _, triples = self.fired.pop(subj)
+      for triple in triples:
+        touched.setdefault(triple, True)
+        self.support[triple] -= 1
+        if not self.support[triple]:
+          del self.support[triple]
+    for subj, signature, jsonld in fired:
+      triples = set(jsonld_to_triples(jsonld, canonical_id=self.output.canonical_id))
+      for triple in triples:
+        touched.setdefault(triple, triple in self.support)
+        self.support[triple] += 1
+      self.fired[subj] = (signature, triples)
+    removed = [triple for triple, was in touched.items() if was and triple not in self.support]
+    added = [triple for triple, was in touched.items() if not was and triple in self.support]
+    for i in range(0, len(removed), batch_size):
+      self.output.remove_triples(removed[i:i+batch_size])
+    for i in range(0, len(added), batch_size):
+      self.output.update_triples(added[i:i+batch_size])
+    self.stats['fired'] += len(fired)
+    self.stats['retracted'] += len(retract)
+
+class RuleEngine:
+  ''' Frames `db` with the materialized output of the rules in `rules`
+  (defaulting to `db`) whose functions are found in `context`, run on
+  `executor` when given (see the module documentation). Outputs are
+  written `batch_size` triples at a time.
+  '''
+  def __init__(self, db, rules=None, context={}, executor=None, batch_size=1000):
+    self.db = db
+    self.rules = db if rules is None else rules
+    self.context = context
+    self.executor = executor
+    self.batch_size = batch_size
+    self.terms = db._db.index.terms
+    # canonical (given, using, produce) -> Rule
+    self._rules = {}
+    # produced predicate -> [Rule]
+    self._by_predicate = {}
+    self._rules_stamp = None
+    self._lock = threading.Lock()
+  #
+  def _load_rules(self):
+    ''' (Re)read the rules when they changed, keeping those already known
+    '''
+    stamp = multi_index_stamp(self.rules)
+    if stamp == self._rules_stamp:
+      return
+    rules = {}
+    for node in self.rules[{'@type': 'Rule'}]:
+      given, using, produce = (
+        json_value(node['given'][0]), node['using'][0], json_value(node['produce'][0]),
+      )
+      key = canonical_frame([given, using, produce])
+      rules[key] = self._rules.get(key) or Rule(given, using, produce, self.terms, self.db._db.canonical_id)
+    self._rules = rules
+    self._by_predicate = {}
+    for rule in rules.values():
+      for pred in rule.produce:
+        self._by_predicate.setdefault(pred, []).append(rule)
+    self._rules_stamp = stamp
+  #
+  def _reached(self, multi_index, subj, given):
+    ''' The triples of `subj` and of the nodes `given` reaches from it,
+    those its rule function is given (see `Rule`)
+    '''
+    id = self.terms.lookup(RDFTerm(RDFTermType.IRI, subj))
+    triples = set()
+    self._reached_triples(multi_index, id, given, triples)
+    return triples
+  #
+  def _reached_triples(self, multi_index, id, frame, triples):
+    ''' Add the triples of `id` to `triples` and recurse into the nodes
+    related to it through the subframes of `frame`
+    '''
+    for index in multi_index:
+      for pred, objs in index.spo.get(id, {}).items():
+        triples.update((id, pred, obj) for obj in objs)
+    for pred, subframe in frame.items():
+      subframes = [
+        f for f in (subframe if type(subframe) == list else [subframe])
+        if type(f) == dict and (f == {} or not is_operator_object(f))
+      ]
+      if pred == '@id' or not subframes:
+        continue
+      # the objects of `pred` (subjects for a `~pred`)
+      for obj in set().union(*(index.pos.get(inverse(pred), {}).get(id, ()) for index in multi_index)):
+        for f in subframes:
+          self._reached_triples(multi_index, obj, f, triples)
+  #
+  def _changes(self, rule):
+    ''' The subjects `rule` must be fired for [(subj, signature, node)]
+    and those whose output must be retracted since it was last refreshed
+    '''
+    fire, matching = [], set()
+    multi_index = self.db._multi_index()
+    for node in self.db[rule.given]:
+      subj = node['@id']
+      matching.add(subj)
+      triples = self._reached(multi_index, subj, rule.given)
+      signature = hash(frozenset(triples))
+      fired = rule.fired.get(subj)
+      if fired is None or fired[0] != signature:
+        fire.append((subj, signature, self._given_node(node, triples)))
+    fire.sort(key=lambda f: str(f[0]))
+    return fire, [subj for subj in rule.fired if subj not in matching]
+  #
+  def _given_node(self, node, triples):
+    ''' `node` as its rule function sees it: framed from its reached
+    `triples` alone, so that what the function reads is what fires it
+    again when changed
+    '''
+    spo, pos = {}, {}
+    for subj, pred, obj in triples:
+      spo.setdefault(subj, {}).setdefault(pred, set()).add(obj)
+      pos.setdefault(pred, {}).setdefault(obj, set()).add(subj)
+      pos.setdefault('~' + pred, {}).setdefault(subj, set()).add(obj)
+    given = JsonLDDatabase(index=JsonLDIndex(spo, pos, terms=self.terms), canonical_id=self.db._db.canonical_id)
+    return JsonLDNode(given, node._subj, frame=node._frame, depth=node._depth)
+  #
+  def _call(self, fn, nodes):
+    ''' [(jsonld, seconds)] of `fn` applied to each of `nodes`
+    '''
+    if self.executor is None:
+      return [timed_call(fn, node) for node in nodes]
+    if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+      nodes = [node_json(node) for node in nodes]
+    return list(self.executor.map(timed_call, itertools.repeat(fn), nodes))
+  #
+  def _refresh(self, rule):
+    ''' Fire `rule` for the subjects whose match changed since last time
+    '''
+    stamp = multi_index_stamp(self.db)
+    if stamp == rule.stamp:
+      return
+    start = time.perf_counter()
+    fire, retract = self._changes(rule)
+    outputs = self._call(self.context[rule.using], [node for _, _, node in fire])
+    self._apply(rule, stamp, fire, retract, outputs, start)
+  #
+  async def _arefresh(self, rule, concurrency):
+    ''' _refresh awaiting coroutine functions, at most `concurrency` at
+    once. A refresh of the same rule in progress is waited for rather than
+    repeated.
+    '''
+    loop = asyncio.get_running_loop()
+    while multi_index_stamp(self.db) != rule.stamp:
+      task = rule.refreshing
+      if task is not None and not task.done() and task.get_loop() is loop:
+        # then look again, it may have refreshed from an older stamp
+        await asyncio.wait([task])
+        continue
+      task = rule.refreshing = loop.create_task(self._arefresh_once(rule, concurrency))
+      try:
+        await task
+      finally:
+        if rule.refreshing is task:
+          rule.refreshing = None
+      return
+  #
+  async def _arefresh_once(self, rule, concurrency):
+    ''' The refresh of `_arefresh`, not applied when another refreshed the
+    rule while its functions were awaited
+    '''
+    stamp = multi_index_stamp(self.db)
+    start = time.perf_counter()
+    with self._lock:
+      base = rule.stamp
+      if stamp == base:
+        return
+      fire, retract = self._changes(rule)
+    fn = self.context[rule.using]
+    nodes = [node for _, _, node in fire]
+    if asyncio.iscoroutinefunction(fn):
+      semaphore = asyncio.Semaphore(concurrency)
+      outputs = await asyncio.gather(*(timed_await(fn, node, semaphore) for node in nodes))
+    else:
+      outputs = await asyncio.get_running_loop().run_in_executor(None, self._call, fn, nodes)
+    with self._lock:
+      # the changes are relative to the output as it was, not as another
+      #  refresh (e.g. `frame` from another thread) left it
+      if rule.stamp == base:
+        self._apply(rule, stamp, fire, retract, outputs, start)
+  #
+  def _apply(self, rule, stamp, fire, retract, outputs, start):
+    rule.apply(
+      retract,
+      [(subj, signature, jsonld) for (subj, signature, _), (jsonld, _) in zip(fire, outputs)],
+      self.batch_size,
+    )
+    rule.stamp = stamp
+    rule.stats['refreshes'] += 1
+    rule.stats['function_seconds'] += sum(seconds for _, seconds in outputs)
+    rule.stats['seconds'] += time.perf_counter() - start
+  #
+  def relevant_rules(self, frame):
+    ''' The rules whose `produce` frame overlaps `frame`
+    '''
+    with self._lock:
+      self._load_rules()
+      candidates = {
+        id(rule): rule
+        for pred in frame
+        for rule in self._by_predicate.get(pred, ())
+      }
+      return [rule for rule in candidates.values() if frame_intersection(frame, rule.produce)]
+  #
+  def frame(self, frame):
+    ''' `frame` applied to `db` together with the output of the relevant rules
+    '''
+    framed = self.db
+    for rule in self.relevant_rules(frame):
+      with self._lock:
+        self._refresh(rule)
+      framed = framed.with_db(rule.output)
+    return framed[frame]
+  #
+  async def aframe(self, frame, concurrency=64):
+    ''' `frame` awaiting the functions of the rules to refresh, coroutine
+    functions are run `concurrency` at a time and others on the executor
+    '''
+    framed = self.db
+    for rule in self.relevant_rules(frame):
+      await self._arefresh(rule, concurrency)
+      framed = framed.with_db(rule.output)
+    return framed[frame]
+  #
+  def stats(self):
+    ''' The evaluation statistics of each rule: the number of refreshes,
+    of subjects fired and retracted, the seconds spent refreshing and the
+    (summed) seconds of its function calls
+    '''
+    with self._lock:
+      self._load_rules()
+      return [
+        dict(rule.stats, given=rule.given, using=rule.using, produce=rule.produce)
+        for rule in self._rules.values()
+      ]
+
+# Engines of `frame_with_rules`, least recently used first
+rule_engines = collections.OrderedDict()
+rule_engines_lock = threading.Lock()
+max_rule_engines = 64
+
+def rule_engine(db, rules=None, context={}, executor=None):
+  ''' The RuleEngine of `db`, `rules` and `context`, shared between calls
+  '''
+  key = (
+    tuple(index.uid for index in indexes_of(db)),
+    canonical_frame(db._frame),
+    None if rules is None else tuple(index.uid for index in indexes_of(rules)),
+    id(context),
+  )
+  with rule_engines_lock:
+    engine = rule_engines.get(key)
+    # (the engine references its context so ids aren't reused while cached)
+    if engine is not None and engine.context is context:
+      rule_engines.move_to_end(key)
+      engine.executor = executor
+      return engine
+    engine = rule_engines[key] = RuleEngine(db, rules, context, executor=executor)
+    while len(rule_engines) > max_rule_engines:
+      rule_engines.popitem(last=False)
+  return engine
+
+def frame_with_rules(db, frame, rules=None, context={}, executor=None):
+  ''' Apply rule IFF
+   1) desired frame overlaps with produce frame
+   2) given frame can be satisfied by query
+  see RuleEngine
+  '''
+  return rule_engine(db, rules, context, executor).frame(frame)
+
+async def aframe_with_rules(db, frame, rules=None, context={}, executor=None, concurrency=64):
+  ''' frame_with_rules awaiting coroutine functions (see RuleEngine.aframe)
+  '''
+  return await rule_engine(db, rules, context, executor).aframe(frame, concurrency)
@@ -0,0 +1,213 @@
+'''
+A binary snapshot of an index which can be memory-mapped and queried in
+ place: startup only parses a small header, and processes mapping the same
+ snapshot share its pages.
+
+Layout (arrays are native int64):
+  b'JLDSNAP1', header length (<q), header (json), aligned sections
+
+The header lists the predicates, per-predicate counts and the position of
+ every array: the term table (offsets into the concatenated term keys)
+ and the keys/offsets/values of the SPO table and of each POS/PSO table
+ (see CompactJsonLDIndex). Terms are stored sorted by `term_key`, their
+ rank being their id, so they can be looked up by binary search.
+'''
+import sys
+import mmap
+import uuid
+import struct
+from jsonlddb import json
+from jsonlddb.compact import CompactJsonLDIndex, CompactMap, CompactSPO, ids_array, sorted_find
+from jsonlddb.rdf import RDFTerm, RDFTermType
+from jsonlddb.terms import TermDictionary
+
+magic = b'JLDSNAP1'
+
+value_encoders = {
+  str: (b's', lambda v: v.encode()),
+  int: (b'i', lambda v: str(v).encode()),
+  float: (b'f', lambda v: repr(v).encode()),
+  bool: (b'b', lambda v: b'1' if v else b'0'),
+  type(None): (b'n', lambda v: b''),
+  uuid.UUID: (b'u', lambda v: str(v).encode()),
+  json.JSON: (b'j', lambda v: json.dumps(v.value).encode()),
+}
+
+value_decoders = {
+  b's'[0]: lambda b: b.decode(),
+  b'i'[0]: lambda b: int(b),
+  b'f'[0]: lambda b: float(b),
+  b'b'[0]: lambda b: b == b'1',
+  b'n'[0]: lambda b: None,
+  b'u'[0]: lambda b: uuid.UUID(b.decode()),
+  b'j'[0]: lambda b: json.JSON(json.loads(b.decode())),
+}
+
+def term_key(term):
+  ''' An injective bytes encoding of an RDFTerm
+  '''
+  encoder = value_encoders.get(type(term.value))
+  if encoder is None:
+    raise Exception('Unsupported value type for a snapshot: {}'.format(type(term.value)))
+  tag, encode = encoder
+  return (b'I' if term.type is RDFTermType.IRI else b'L') + tag + encode(term.value)
+
+def term_from_key(key):
+  return RDFTerm(
+    RDFTermType.IRI if key[0] == b'I'[0] else RDFTermType.LITERAL,
+    value_decoders[key[1]](bytes(key[2:])),
+  )
+
+class TermKeys:
+  ''' The sorted sequence of term keys stored in a snapshot
+  '''
+  def __init__(self, offsets, data):
+    self._offsets = offsets
+    self._data = data
+  #
+  def __len__(self):
+    return len(self._offsets) - 1
+  #
+  def __getitem__(self, i):
+    return bytes(self._data[self._offsets[i]:self._offsets[i+1]])
+
+class SnapshotTermDictionary(TermDictionary):
+  ''' A TermDictionary whose first ids are the terms of a snapshot, found by
+  binary search; terms new to the snapshot are assigned ids following them.
+  '''
+  def __init__(self, keys):
+    TermDictionary.__init__(self)
+    self.keys = keys
+  #
+  def _snapshot_id(self, type, value):
+    return sorted_find(self.keys, term_key(RDFTerm(type, value)))
+  #
+  def encode_iri(self, value):
+    id = self.iris.get((value.__class__, value))
+    if id is None:
+      id = self._snapshot_id(RDFTermType.IRI, value)
+    if id is None:
+      id = TermDictionary.encode_iri(self, value)
+    return id
+  #
+  def encode_literal(self, value):
+    id = self.literals.get((value.__class__, value))
+    if id is None:
+      id = self._snapshot_id(RDFTermType.LITERAL, value)
+    if id is None:
+      id = TermDictionary.encode_literal(self, value)
+    return id
+  #
+  def lookup(self, term):
+    id = TermDictionary.lookup(self, term)
+    if id is None:
+      id = self._snapshot_id(term.type, term.value)
+    return id
+  #
+  def decode(self, id):
+    if id < len(self.keys):
+      return term_from_key(self.keys[id])
+    return self.terms[id - len(self.keys)]
+  #
+  def __len__(self):
+    return len(self.keys) + len(self.terms)
+
+def write_snapshot(index, file):
+  ''' Write the contents of `index` to `file` (a path or binary file)
+  '''
+  decode = index.terms.decode
+  triples = [
+    (subj, pred, obj)
+    for subj, po in index.spo.items()
+    for pred, objs in po.items()
+    for obj in objs
+  ]
+  keys = sorted(
+    (term_key(decode(id)), id)
+    for id in {subj for subj, _, _ in triples} | {obj for _, _, obj in triples}
+  )
+  rank = {id: i for i, (_, id) in enumerate(keys)}
+  compact = CompactJsonLDIndex(terms=index.terms)
+  compact._build([(rank[subj], pred, rank[obj]) for subj, pred, obj in triples])
+  #
+  term_offsets = ids_array([0])
+  for key, _ in keys:
+    term_offsets.append(term_offsets[-1] + len(key))
+  sections = []
+  def section(data):
+    sections.append(data)
+    return len(sections) - 1
+  def table(compact_map):
+    return {
+      'keys': section(compact_map._keys),
+      'offsets': section(compact_map._offsets),
+      'values': section(compact_map._values),
+    }
+  header = {
+    'byteorder': sys.byteorder,
+    'terms': {
+      'offsets': section(memoryview(term_offsets)),
+      'data': section(b''.join(key for key, _ in keys)),
+    },
+    'spo': dict(table(compact._spo), preds=section(compact._spo._preds)),
+    'preds': compact._spo._pred_names,
+    'pos': {pred: table(compact_map) for pred, compact_map in compact._pos.items()},
+    'counts': compact._counts,
+  }
+  position = 0
+  header['sections'] = []
+  for data in sections:
+    length = memoryview(data).nbytes
+    header['sections'].append([position, length])
+    position = align(position + length)
+  header_bytes = json.dumps(header).encode()
+  fw = open(file, 'wb') if type(file) == str else file
+  fw.write(magic)
+  fw.write(struct.pack('<q', len(header_bytes)))
+  fw.write(header_bytes)
+  fw.write(b'\0' * (data_start(len(header_bytes)) - len(magic) - 8 - len(header_bytes)))
+  for (position, length), data in zip(header['sections'], sections):
+    fw.write(data)
+    fw.write(b'\0' * (align(position + length) - position - length))
+  if type(file) == str:
+    fw.close()
+
+def align(n):
+  return (n + 7) & ~7
+
+def data_start(header_length):
+  ''' Sections are positioned relative to the (aligned) end of the header
+  '''
+  return align(len(magic) + 8 + header_length)
+
+def load_snapshot(file):
+  ''' A CompactJsonLDIndex over the memory-mapped snapshot in `file` (a path
+  or a binary file) with its own SnapshotTermDictionary.
+  '''
+  fr = open(file, 'rb') if type(file) == str else file
+  mm = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+  if type(file) == str:
+    fr.close()
+  if mm[:len(magic)] != magic:
+    raise Exception('Not a jsonlddb snapshot')
+  header_length, = struct.unpack('<q', mm[len(magic):len(magic) + 8])
+  header = json.loads(mm[len(magic) + 8:len(magic) + 8 + header_length].decode())
+  if header['byteorder'] != sys.byteorder:
+    raise Exception('Snapshot was written with a different byte order')
+  view = memoryview(mm)[data_start(header_length):]
+  def section(i, format='q'):
+    position, length = header['sections'][i]
+    return view[position:position + length].cast(format)
+  def table(spec):
+    return CompactMap(section(spec['keys']), section(spec['offsets']), section(spec['values']))
+  terms = SnapshotTermDictionary(TermKeys(section(header['terms']['offsets']), section(header['terms']['data'], 'B')))
+  spo = header['spo']
+  return CompactJsonLDIndex.from_tables(
+    CompactSPO(
+      section(spo['keys']), section(spo['offsets']), section(spo['values']),
+      section(spo['preds']), header['preds'],
+    ),
+    {pred: table(spec) for pred, spec in header['pos'].items()},
+    header['counts'],
+    terms,
+  )
@@ -0,0 +1,85 @@
+import threading
+from jsonlddb.rdf import RDFTerm, RDFTermType
+
+class TermDictionary:
+  ''' Map every RDFTerm to a dense integer id (and back again) so that
+  indexes store and intersect plain ints rather than RDFTerm objects.
+
+  Terms are keyed on (type(value), value) in one dict per term type; this
+  keeps 1, 1.0 and True apart just like RDFTerm.__eq__ while hashing in C.
+
+  Ids are never recycled; a term keeps its id for the lifetime of the
+  dictionary even after every triple referencing it is removed. Each
+  index has a dictionary of its own unless given one to share, so its
+  terms are freed along with it.
+
+  It doubles as the interning table of terms: `decode` and the `intern_*`
+  methods return the single RDFTerm it keeps for each.
+
+  Dictionaries are shared between threads (e.g. by writers and readers
+  re-encoding other databases, see `overlay.translated`): new ids are
+  assigned under a lock, known ones are found without taking it. A term
+  is appended before its id is published, so any id found decodes.
+  '''
+  def __init__(self):
+    self.iris = {}
+    self.literals = {}
+    self.terms = []
+    self._lock = threading.Lock()
+  #
+  def encode(self, term):
+    ''' Obtain the id of `term`, assigning a new one if necessary
+    '''
+    return self.encode_value(term.type, term.value)
+  #
+  def encode_value(self, type, value):
+    ''' Like `encode` for RDFTerm(type, value) without building it
+    '''
+    if type is RDFTermType.IRI:
+      return self.encode_iri(value)
+    else:
+      return self.encode_literal(value)
+  #
+  def encode_iri(self, value):
+    key = (value.__class__, value)
+    id = self.iris.get(key)
+    if id is None:
+      with self._lock:
+        # unless another thread assigned it meanwhile
+        id = self.iris.get(key)
+        if id is None:
+          self.terms.append(RDFTerm(RDFTermType.IRI, value))
+          id = self.iris[key] = len(self) - 1
+    return id
+  #
+  def encode_literal(self, value):
+    key = (value.__class__, value)
+    id = self.literals.get(key)
+    if id is None:
+      with self._lock:
+        # unless another thread assigned it meanwhile
+        id = self.literals.get(key)
+        if id is None:
+          self.terms.append(RDFTerm(RDFTermType.LITERAL, value))
+          id = self.literals[key] = len(self) - 1
+    return id
+  #
+  def intern_iri(self, value):
+    ''' The RDFTerm of the IRI `value`, shared by all its uses
+    '''
+    return self.decode(self.encode_iri(value))
+  #
+  def intern_literal(self, value):
+    return self.decode(self.encode_literal(value))
+  #
+  def lookup(self, term):
+    ''' Obtain the id of `term` or None if it was never encoded
+    '''
+    ids = self.iris if term.type is RDFTermType.IRI else self.literals
+    return ids.get((term.value.__class__, term.value))
+  #
+  def decode(self, id):
+    return self.terms[id]
+  #
+  def __len__(self):
+    return len(self.terms)
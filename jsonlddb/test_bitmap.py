@@ -0,0 +1,48 @@
+import random
+from jsonlddb.bitmap import Bitmap, array_max, bitmap_intersection, bitmap_union, popcount
+from jsonlddb.index import JsonLDIndex
+from jsonlddb.oop import JsonLDDatabase
+
+def test_bitmap():
+  r = random.Random(0)
+  # sparse and dense chunks
+  a_ids = set(r.sample(range(200000), 3000)) | set(range(70000, 70000 + 2 * array_max))
+  b_ids = set(r.sample(range(200000), 3000)) | set(range(72000, 72000 + 2 * array_max, 2))
+  a, b = Bitmap(a_ids), Bitmap(b_ids)
+  assert len(a) == len(a_ids) and list(a) == sorted(a_ids)
+  assert a.nbytes() < 2 * len(a_ids)
+  assert list(a & b) == sorted(a_ids & b_ids)
+  assert list(a | b) == sorted(a_ids | b_ids)
+  assert len(a & b) == len(a_ids & b_ids) and len(a | b) == len(a_ids | b_ids)
+  assert 10**9 not in a
+  for id in r.sample(sorted(a_ids), 1000):
+    assert id in a
+    a.discard(id)
+    a_ids.discard(id)
+    assert id not in a
+  assert len(a) == len(a_ids) and list(a) == sorted(a_ids)
+  assert a == a_ids and a != b
+
+def test_bitmap_combinations_are_new():
+  a = Bitmap(range(0, 5000, 3))
+  for combined in [bitmap_intersection([a]), bitmap_union([a])]:
+    assert combined == a and combined is not a
+    combined.add(1)
+    assert 1 not in a
+  assert popcount(0b1011) == 3 and popcount(0) == 0
+
+def test_bitmap_index():
+  jsonld = [
+    {'@id': str(i), '@type': ['Thing'] + (['Even'] if i % 2 == 0 else []) + (['Third'] if i % 3 == 0 else [])}
+    for i in range(60)
+  ]
+  db = JsonLDDatabase(index=JsonLDIndex(bitmap_fanout=8)).update(jsonld)
+  bulk_db = JsonLDDatabase(index=JsonLDIndex(bitmap_fanout=8)).bulk_update(jsonld)
+  set_db = JsonLDDatabase(index=JsonLDIndex(bitmap_fanout=None)).update(jsonld)
+  assert all(type(subjs) == Bitmap for subjs in db.index.pos['@type'].values())
+  assert all(type(subjs) == Bitmap for subjs in bulk_db.index.pos['@type'].values())
+  for query in [{'@type': 'Even'}, {'@type': ['Even', 'Third']}, {'@type': 'Third', '~@type': {}}]:
+    assert set(db[query]['@id']) == set(set_db[query]['@id']) == set(bulk_db[query]['@id'])
+  db.remove([{'@id': str(i), '@type': 'Even'} for i in range(0, 60, 2)])
+  assert len(db[{'@type': 'Even'}]) == 0
+  assert len(db[{'@type': 'Thing'}]) == 60
@@ -0,0 +1,47 @@
+from jsonlddb.cache import FrameCache
+from jsonlddb.oop import JsonLDDatabase
+
+def test_frame_cache():
+  cache = FrameCache(max_entries=2)
+  db = JsonLDDatabase(cache=cache).update([
+    {'@id': '0', '@type': 'Person', 'name': 'a'},
+    {'@id': '1', '@type': 'Person', 'name': 'b'},
+  ])
+  assert len(db[{'@type': 'Person'}]) == 2
+  assert set(db[{'@type': 'Person'}]['@id']) == {'0', '1'}
+  assert db[{'@type': 'Person', 'name': 'a'}][0]['@id'] == '0'
+  # key order is irrelevant
+  assert len(db[{'name': 'a', '@type': 'Person'}]) == 1
+  assert cache.hits >= 2
+  # writes invalidate
+  misses = cache.misses
+  db.update({'@id': '2', '@type': 'Person'})
+  assert len(db[{'@type': 'Person'}]) == 3
+  assert cache.misses == misses + 1 and cache.invalidations == 1
+  # additional databases take part in the key
+  other = JsonLDDatabase().update({'@id': '3', '@type': 'Person'})
+  assert len(db.with_db(other)[{'@type': 'Person'}]) == 4
+  assert cache.stats()['entries'] <= 2 and cache.evictions > 0
+
+def test_frame_cache_predicate_invalidation():
+  cache = FrameCache()
+  db = JsonLDDatabase(cache=cache).update([
+    {'@id': 'd0', '@type': 'Dataset', 'storedIn': {'@id': 's0', 'name': 'store'}},
+    {'@id': 'd1', '@type': 'Dataset'},
+  ])
+  frame = {'@type': 'Dataset', 'storedIn': {'name': 'store'}}
+  assert db[frame][0]['@id'] == 'd0'
+  # writes to unrelated predicates of existing subjects keep the entry
+  db.update({'@id': 'd0', 'lastSeen': 1})
+  db.remove({'@id': 'd0', 'lastSeen': 1})
+  assert db[frame][0]['@id'] == 'd0'
+  assert cache.invalidations == 0
+  # but writes through the inverse of a read predicate do not
+  db.update({'@id': 'd1', 'storedIn': {'@id': 's0'}})
+  assert len(db[frame]) == 2
+  assert cache.invalidations == 1
+  # new subjects invalidate frames reading all subjects
+  assert len(db[{}]) == 3
+  db.update({'@id': 'x', 'lastSeen': 2})
+  assert len(db[{}]) == 4
+  assert cache.invalidations == 2
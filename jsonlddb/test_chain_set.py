@@ -89,3 +89,18 @@ def test_chain_set_intersection():
     ]),
     set(range(5, 10)),
   )
+
+def test_chain_set_materialized():
+  from array import array
+  from jsonlddb.compact import PostingList
+  a, b = set(range(10)), {}.fromkeys(range(5, 15)).keys()
+  c = PostingList(array('q', range(0, 1000, 2)))
+  # bulk results are sets, leaving the inputs untouched
+  assert chain_set_intersection([a, b, c]) == {6, 8}
+  assert chain_set_union([a, b, c]) == set(range(15)) | set(range(0, 1000, 2))
+  assert a == set(range(10)) and len(b) == 10
+  # mixed with iterators
+  assert_chain_set_eq(chain_set_intersection([c, a, range(5, 9)]), {6, 8})
+  assert_chain_set_eq(chain_set_intersection([a, iter([1, 1, 2, 11])]), {1, 2})
+  assert_chain_set_eq(chain_set_union([c, iter([1, 2, 1])]), set(range(0, 1000, 2)) | {1})
+  assert list(chain_set_intersection([set(), range(10)])) == []
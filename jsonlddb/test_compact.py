@@ -0,0 +1,55 @@
+from jsonlddb.compact import CompactJsonLDIndex
+from jsonlddb.oop import JsonLDDatabase
+
+def test_compact_index():
+  jsonld = [
+    {'@id': '0', '@type': 'Person', 'owns': {'@id': '2', '@type': 'Car', 'model': 'S'}},
+    {'@id': '1', '@type': 'Person', 'spouseOf': {'@id': '0'}},
+    {'@id': '3', '@type': 'Car', 'model': 'X'},
+  ]
+  dict_db = JsonLDDatabase().update(jsonld)
+  compact_db = JsonLDDatabase(index=CompactJsonLDIndex()).update(jsonld)
+  for query in [
+    {},
+    {'@type': 'Car'},
+    {'@type': 'Car', '~owns': {'@type': 'Person'}},
+    {'~spouseOf': {'owns': {}}},
+    {'model': ['S', 'X']},
+  ]:
+    assert set(compact_db[query]['@id']) == set(dict_db[query]['@id'])
+  assert set(compact_db['model']) == {'S', 'X'}
+  assert set(compact_db[{'@id': '0'}][0].keys()) == {'@type', 'owns'}
+  # buffered writes apply in order
+  compact_db.remove({'@id': '3', 'model': 'X'})
+  compact_db.update({'@id': '3', 'model': 'Y'})
+  assert set(compact_db['model']) == {'S', 'Y'}
+  # compacting an existing index
+  compact = CompactJsonLDIndex.from_index(dict_db.index)
+  assert set(compact.spo) == set(dict_db.index.spo)
+  assert set(compact.pos['@type']) == set(dict_db.index.pos['@type'])
+
+def test_compact_index_merges_writes():
+  import random
+  from jsonlddb.index import JsonLDIndex
+  from jsonlddb.rdf import RDFTerm, RDFTermType
+  rng = random.Random(0)
+  dict_index = JsonLDIndex()
+  compact = CompactJsonLDIndex(terms=dict_index.terms)
+  term = lambda i: RDFTerm(RDFTermType.IRI, str(i))
+  inserted = []
+  for _ in range(20):
+    triples = [(term(rng.randrange(30)), rng.choice('abc'), term(rng.randrange(30))) for _ in range(20)]
+    if inserted and rng.random() < 0.3:
+      triples = set(rng.sample(inserted, 10))
+      inserted = [triple for triple in inserted if triple not in triples]
+      dict_index.remove_triples(triples)
+      compact.remove_triples(triples)
+    else:
+      inserted.extend(triples)
+      dict_index.insert_triples(triples)
+      compact.insert_triples(triples)
+    assert {s: {p: set(o) for p, o in po.items()} for s, po in compact.spo.items()} == dict_index.spo
+    assert compact.counts == {p: n for p, n in dict_index.counts.items() if n}
+    for pred in compact.counts:
+      for key in (pred, '~' + pred):
+        assert {k: set(v) for k, v in compact.pos[key].items()} == dict_index.pos[key]
@@ -35,3 +35,35 @@ def test_jsonld_triple_conversion():
     list(jsonld_to_triples({
       'k': {1, 2},
     }))
+
+def test_canonical_id():
+  import uuid
+  from jsonlddb import json
+  from jsonlddb.core import canonical_uuid, canonical_blake2b
+  literals = [('a', 'b'), ('c', 1.5), ('d', json.JSON({'e': ['é']}))]
+  # compatible with the ids of earlier versions
+  assert canonical_uuid(literals) == uuid.uuid5(
+    uuid.UUID('00000000-0000-0000-0000-000000000000'),
+    '[["a", "b"], ["c", 1.5], ["d", {"e": ["\\u00e9"]}]]',
+  )
+  for canonical_id in [canonical_uuid, canonical_blake2b]:
+    assert canonical_id(literals) == canonical_id(list(literals))
+    assert canonical_id([('a', 1)]) != canonical_id([('a', 1.0)])
+    subjs = {
+      subj
+      for subj, _, _ in jsonld_to_triples([{'a': 'b'}, {'a': 'b'}, {'a': 'c'}], canonical_id=canonical_id)
+    }
+    assert len(subjs) == 2
+
+def test_blank_node_labels():
+  import uuid
+  from jsonlddb.core import jsonld_id
+  u = uuid.uuid4()
+  # '_:<uuid>' labels (see jsonld_id) read back as the blank node's UUID
+  assert jsonld_id(u) == '_:{}'.format(u)
+  subj, _, _ = next(jsonld_to_triples({'@id': jsonld_id(u), 'n': 1}))
+  assert subj == RDFTerm(RDFTermType.IRI, u)
+  # other labels stay strings
+  for label in ['_:b0', '_:{}'.format(str(u).upper())]:
+    subj, _, _ = next(jsonld_to_triples({'@id': label, 'n': 1}))
+    assert subj == RDFTerm(RDFTermType.IRI, label)
@@ -15,3 +15,18 @@ def test_json():
   assert str(JSON(json_test)) == json.dumps(json_test)
   assert repr(json_test_obj) == repr(json_test)
   assert hash(json_test_obj) == hash(JSON(loads(dumps(json_test_obj))))
+  # hashes are cached until the value is changed
+  json_test_obj['g'] = 2
+  assert hash(json_test_obj) != hash(JSON(json_test))
+  json_test_obj['g'] = 1
+  assert hash(json_test_obj) == hash(JSON(json_test))
+  import pickle
+  assert pickle.loads(pickle.dumps(json_test_obj)).__dict__ == {'value': json_test_obj.value}
+
+def test_iter_items():
+  import io
+  from jsonlddb.json import iter_items
+  obj = {'a': {'b': [1, 2.5, None]}, 'c': 12345, 'd': ' , : } ', 'e': []}
+  for chunk_size in [1, 3, 2**16]:
+    assert list(iter_items(io.StringIO(json.dumps(obj, indent=1)), chunk_size)) == list(obj.items())
+  assert list(iter_items(io.StringIO(' { } '))) == []
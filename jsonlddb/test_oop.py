@@ -1,4 +1,6 @@
+from jsonlddb.core import jsonld_to_triples
 from jsonlddb.oop import JsonLDDatabase
+from jsonlddb.index import JsonLDIndex
 
 def test_jsonlddb_framing():
   db = JsonLDDatabase().update([
@@ -87,3 +89,198 @@ def test_jsonlddb_framing():
   expected = {'4', '6'}
   result = set(db[query]['@id'])
   assert result == expected
+
+def test_jsonlddb_bulk_update():
+  jsonld = [
+    {
+      '@id': str(i),
+      '@type': 'Person',
+      'age': i % 7,
+      'knows': [{'@id': str((i + 1) % 20)}, {'@id': str((i + 2) % 20)}],
+      'address': {'city': 'c{}'.format(i % 3)},
+    }
+    for i in range(20)
+  ]
+  db = JsonLDDatabase().update(jsonld)
+  reports = []
+  # sharing the term dictionary, ids compare equal
+  bulk_db = JsonLDDatabase(JsonLDIndex(terms=db.index.terms)).update({'@id': '0', 'name': 'zero'})
+  bulk_db.bulk_update(iter(jsonld), batch_size=6, report=reports.append)
+  bulk_db.remove({'@id': '0', 'name': 'zero'})
+  assert bulk_db.index.spo == db.index.spo
+  assert bulk_db.index.pos == db.index.pos
+  assert bulk_db.index.counts == db.index.counts
+  assert reports[-1]['records'] == 20
+  assert reports[-1]['triples'] == len(list(jsonld_to_triples(jsonld)))
+  assert set(bulk_db[{'address': {'city': 'c1'}}]['@id']) == {str(i) for i in range(1, 20, 3)}
+
+def test_jsonlddb_update_parallel():
+  jsonld = [
+    {'@id': str(i), 'knows': {'@id': str(i // 2)}, 'tag': {'name': 't{}'.format(i % 4)}, 'data': {'@value': [i % 2]}}
+    for i in range(40)
+  ]
+  db = JsonLDDatabase().update(jsonld)
+  parallel_db = JsonLDDatabase(JsonLDIndex(terms=db.index.terms)).update_parallel(jsonld, workers=2, batch_size=7)
+  assert parallel_db.index.spo == db.index.spo
+  assert parallel_db.index.pos == db.index.pos
+
+def test_jsonlddb_dump_load(tmp_path):
+  db = JsonLDDatabase().update([
+    {'@id': '0', '@type': 'Person', 'age': 30, 'knows': {'@id': '1'}},
+    {'@id': '1', '@type': 'Person', 'data': {'@value': {'a': [1, 2]}}},
+  ])
+  for fmt in ['json', 'ndjson']:
+    path = str(tmp_path / ('db.' + fmt))
+    db.dump(path, fmt=fmt)
+    loaded = JsonLDDatabase().load(path, fmt=fmt, batch_size=1)
+    assert dict(loaded.index.iter_spo()) == dict(db.index.iter_spo())
+
+def test_jsonlddb_snapshot_isolation():
+  from jsonlddb import CompactJsonLDIndex
+  from jsonlddb.overlay import DeltaIndex
+  for index in [None, CompactJsonLDIndex(), DeltaIndex(CompactJsonLDIndex())]:
+    db = JsonLDDatabase(index=index).update([
+      {'@id': str(i), '@type': 'T', 'n': i}
+      for i in range(100)
+    ])
+    nodes = iter(db[{'@type': 'T'}])
+    seen = {next(nodes)['@id']}
+    # writes while iterating aren't seen by the iteration
+    db.update([{'@id': str(i), '@type': 'T', 'n': i} for i in range(100, 200)])
+    db.remove([{'@id': str(i), '@type': 'T', 'n': i} for i in range(50)])
+    seen.update(node['@id'] for node in nodes)
+    assert seen == {str(i) for i in range(100)}
+    assert len(db[{'@type': 'T'}]) == 150
+    assert {node['@id'] for node in db[{'n': {'$gte': 190}}]} == {str(i) for i in range(190, 200)}
+  # writes copy the segments they change, sharing the rest with snapshots
+  db = JsonLDDatabase().update([{'@id': str(i), 'n': i} for i in range(5000)])
+  snapshot = db.index.snapshot()
+  db.update({'@id': '0', 'n': -1}).remove({'@id': '4999', 'n': 4999})
+  shared = [a is b for a, b in zip(snapshot.spo._segments.values(), db.index.spo._segments.values())]
+  assert len(shared) > 10 and shared.count(False) == 2
+  # range queries across many literal index chunks see their own version
+  nodes = iter(db[{'n': {'$gte': 10, '$lt': 4000}}])
+  db.update([{'@id': 'x{}'.format(i), 'n': i * 2 + 0.5} for i in range(2000)])
+  assert len(list(nodes)) == 3990
+  assert len(db[{'n': {'$gte': 10, '$lt': 4000}}]) == 3990 + 1995
+
+def test_jsonlddb_readers_never_wait():
+  import threading
+  from jsonlddb import CompactJsonLDIndex
+  from jsonlddb.overlay import DeltaIndex
+  from jsonlddb.rdf import RDFTerm, RDFTermType
+  for index in [None, CompactJsonLDIndex(), DeltaIndex(CompactJsonLDIndex())]:
+    db = JsonLDDatabase(index=index).update({'@id': 'a', '@type': 'T'})
+    encode = db.index.terms.encode
+    counts = []
+    read = lambda: counts.append(len(db[{'@type': 'T'}]))
+    with db.index.bulk_loader() as loader:
+      loader.insert([(encode(RDFTerm(RDFTermType.IRI, 'b')), '@type', encode(RDFTerm(RDFTermType.LITERAL, 'T')))])
+      # a frame while the loader is open sees the index as it was
+      thread = threading.Thread(target=read)
+      thread.start()
+      thread.join(5)
+    read()
+    assert counts == [1, 2]
+
+def test_jsonlddb_concurrent_readers():
+  import threading
+  db = JsonLDDatabase()
+  errors = []
+  def write():
+    for batch in range(50):
+      db.update([{'@id': '{}/{}'.format(batch, i), '@type': 'T', 'n': i} for i in range(10)])
+  def read():
+    try:
+      for _ in range(50):
+        # each write is seen whole or not at all
+        assert len([node['@id'] for node in db[{'@type': 'T'}]]) % 10 == 0
+        assert len(db[{'n': {'$lt': 5}}]) % 5 == 0
+    except Exception as e:
+      errors.append(e)
+  threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert errors == []
+  assert len(db[{'@type': 'T'}]) == 500
+
+def test_jsonlddb_async(monkeypatch):
+  import asyncio
+  import concurrent.futures
+  from jsonlddb.cache import FrameCache
+  from jsonlddb.plan import FramePlan
+  async def main(executor):
+    db = JsonLDDatabase()
+    await db.aupdate(({'@id': str(i), '@type': 'T', 'n': i % 3} for i in range(100)), batch_size=7, executor=executor)
+    frame = db[{'@type': 'T', 'n': 1}]
+    assert [node['@id'] async for node in frame.aiter(chunk_size=5, executor=executor)] == [node['@id'] for node in frame]
+    assert await frame.acount(chunk_size=5, executor=executor) == len(frame) == 33
+    assert await db[{'n': 2}].acount(executor=executor) == 33
+    # abandoned iterations stop
+    async def consume():
+      async for _ in db[{'@type': 'T', 'n': 0}].aiter(chunk_size=1, executor=executor):
+        await asyncio.sleep(1)
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    try:
+      await task
+      assert False
+    except asyncio.CancelledError:
+      pass
+  asyncio.run(main(None))
+  with concurrent.futures.ThreadPoolExecutor(4) as executor:
+    asyncio.run(main(executor))
+  # without an executor frames are streamed, never evaluated in bulk
+  db = JsonLDDatabase(cache=FrameCache()).update([{'@id': str(i), '@type': 'T', 'n': i % 3} for i in range(100)])
+  frame = db[{'@type': 'T', 'n': 1}]
+  def subjects(self, ctx):
+    assert False, 'evaluated in bulk'
+  monkeypatch.setattr(FramePlan, 'subjects', subjects)
+  async def streamed():
+    return [node['@id'] async for node in frame.aiter(chunk_size=7)], await frame.acount(chunk_size=7)
+  ids, n = asyncio.run(streamed())
+  assert len(ids) == n == 33 and set(ids) == {str(i) for i in range(1, 100, 3)}
+  assert db.cache.stats()['misses'] == 0
+
+def test_jsonlddb_to_jsonld():
+  db = JsonLDDatabase().update([
+    {'@id': 'a', '@type': 'T', 'name': 'A', 'data': {'@value': {'x': 1}}, 'knows': [{'@id': 'b'}, {'@id': 'c'}], 'address': {'city': 'X'}},
+    {'@id': 'b', '@type': 'T', 'name': 'B', 'knows': {'@id': 'c'}},
+    {'@id': 'c', 'name': 'C'},
+  ])
+  c = {'@id': 'c', 'name': ['C']}
+  b = {'@id': 'b', '@type': ['T'], 'knows': [c], 'name': ['B']}
+  [a] = db[{'@id': 'a'}].to_jsonld(depth=2)
+  assert a['data'] == [{'@value': {'x': 1}}]
+  # blank nodes are labelled with their uuid
+  assert a['address'] == [{'@id': '_:{}'.format(db[{'city': 'X'}][0]['@id']), 'city': ['X']}]
+  assert sorted(a['knows'], key=lambda node: node['@id']) == [
+    {'@id': 'b', '@type': ['T'], 'knows': [{'@id': 'c'}], 'name': ['B']},
+    c,
+  ]
+  assert db[{'@type': 'T', 'name': 'B'}].to_jsonld() == [b]
+  assert db[{'@id': 'b'}][0].to_jsonld(depth=0) == {'@id': 'b'}
+  assert sorted(db[{'@type': 'T'}]['@id'].to_jsonld()) == ['a', 'b']
+  assert db[{'city': 'X'}]['@id'].to_jsonld() == [a['address'][0]['@id']]
+  # nodes reached more than once at a depth share a document, changing
+  #  json values leaves the database untouched
+  a, b = sorted(db[{'@type': 'T'}].to_jsonld(depth=2), key=lambda node: node['@id'])
+  [c_of_a] = [node for node in a['knows'] if node['@id'] == 'c']
+  assert c_of_a is b['knows'][0]
+  a['data'][0]['@value']['x'] = 2
+  assert db[{'@id': 'a'}][0].to_jsonld()['data'] == [{'@value': {'x': 1}}]
+  # exports round trip, blank nodes included
+  triples = lambda db: {
+    (s, p, o) for s, po in db.index.iter_spo() for p, os in po.items() for o in os
+  }
+  exported = db[{}].to_jsonld()
+  assert triples(JsonLDDatabase().update(exported)) == triples(db)
+  written = triples(db)
+  assert triples(db.update(exported)) == written and len(db[{}]) == 4
+  # reprs
+  assert db[{'@id': 'b'}]._repr() == {'@type': 'T', 'name': 'B', 'knows': {'name': 'C'}}
+  assert str(db[{'@id': 'b'}].depth(2)) == "{'@type': 'T', 'name': 'B', 'knows': {'name': ...}}"
+  assert db[{'@id': 'b'}][0].limit(1).skip(1)._repr() == {'name': 'B'}
@@ -0,0 +1,58 @@
+from jsonlddb.oop import JsonLDDatabase
+from jsonlddb.index import JsonLDIndex
+from jsonlddb.compact import CompactJsonLDIndex
+from jsonlddb.core import jsonld_frame_with_multi_index
+from jsonlddb.overlay import OverlayIndex, DeltaIndex
+from jsonlddb.rdf import RDFTerm, RDFTermType
+
+people = [
+  {'@id': str(i), '@type': 'Person', 'age': i % 5, 'knows': {'@id': str((i + 1) % 20)}}
+  for i in range(20)
+]
+
+def test_overlay_index():
+  a = JsonLDIndex()
+  b = CompactJsonLDIndex(terms=a.terms)
+  JsonLDDatabase(a).update(people[:12])
+  JsonLDDatabase(b).update(people[8:])
+  overlay = OverlayIndex([a, b])
+  for frame in [
+    {},
+    {'@type': 'Person'},
+    {'age': 3},
+    {'age': {'$gte': 3}},
+    {'knows': {'age': 1}},
+    {'~knows': {}},
+  ]:
+    assert set(jsonld_frame_with_multi_index([overlay], frame)) == set(jsonld_frame_with_multi_index([a, b], frame))
+  assert len(overlay.pos['age']) == 5
+  assert len(overlay.spo) == 20
+  # merged posting lists follow the members
+  person = overlay.terms.lookup(RDFTerm(RDFTermType.LITERAL, 'Person'))
+  assert len(overlay.pos['@type'][person]) == 20
+  JsonLDDatabase(a).update([{'@id': 'x', '@type': 'Person'}])
+  assert len(set(jsonld_frame_with_multi_index([overlay], {'@type': 'Person'}))) == 21
+
+def test_with_db():
+  db = JsonLDDatabase().update(people[:10])
+  other = JsonLDDatabase().update(people[10:])
+  assert len(db[{'@type': 'Person'}]) == 10
+  assert len(db.with_db(other)[{'@type': 'Person'}]) == 20
+  assert sorted(n['@id'] for n in db.with_db(other)[{'age': 4}]) == ['14', '19', '4', '9']
+
+def test_delta_index():
+  base = CompactJsonLDIndex()
+  JsonLDDatabase(base).update(people)
+  db = JsonLDDatabase(DeltaIndex(base))
+  db.remove([{'@id': '3', 'age': 3}, {'@id': '4', '@type': 'Person'}])
+  db.update([{'@id': 'new', '@type': 'Person', 'age': 3}, {'@id': '3', 'age': 2}])
+  assert sorted(n['@id'] for n in db[{'age': 3}]) == ['13', '18', '8', 'new']
+  assert len(db[{'@type': 'Person'}]) == 20
+  assert sorted(n['@id'] for n in db[{'age': {'$lte': 2}, '@id': ['3', '4']}]) == ['3']
+  # removals are tombstones, the base is untouched
+  assert len(base.pos['age']) == 5 and base.counts['@type'] == 20
+  assert db.index.removed.counts == {'age': 1, '@type': 1}
+  # writing a removed triple back revives it
+  db.update([{'@id': '4', '@type': 'Person'}])
+  assert len(db[{'@type': 'Person'}]) == 21
+  assert db.index.removed.counts == {'age': 1}
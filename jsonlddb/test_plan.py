@@ -0,0 +1,161 @@
+from jsonlddb.oop import JsonLDDatabase
+
+def test_plan_order():
+  db = JsonLDDatabase().update([
+    {
+      '@type': 'Person',
+      'email': 'p{}@example.com'.format(i),
+      'owns': {'@type': 'Car', 'model': 'm{}'.format(i % 3)},
+    }
+    for i in range(50)
+  ])
+  # the selective literal drives, the type is probed
+  plan = db.explain({'@type': 'Person', 'email': 'p3@example.com'})
+  assert [(step['pred'], step['strategy']) for step in plan['steps']] == [
+    ('email', 'scan'), ('@type', 'probe'),
+  ]
+  assert plan['actual'] == 1 and plan['order']['pred'] == 'email'
+  assert plan['steps'][1]['estimated'] == plan['steps'][1]['actual'] == 50
+  # nested frames are planned independently
+  plan = db.explain({'@type': 'Person', 'owns': {'model': 'm1'}})
+  assert plan['steps'][0]['pred'] == 'owns'
+  assert plan['steps'][0]['frame']['actual'] == 1
+  assert plan['actual'] == len(db[{'@type': 'Person', 'owns': {'model': 'm1'}}]) == 17
+  # lists may mix literals and frames
+  assert len(db[{'owns': [{'model': 'm1'}, {'model': 'm2'}]}]) == 33
+
+def test_plan_stream():
+  from jsonlddb.core import jsonld_frame_with_multi_index
+  from jsonlddb.rdf import RDFTerm, RDFTermType
+  db = JsonLDDatabase().update([
+    {
+      '@id': str(i),
+      '@type': 'Person',
+      'age': i % 7,
+      'knows': [{'@id': str((i + 1) % 30)}, {'@id': str((i + 2) % 30)}],
+    }
+    for i in range(30)
+  ])
+  for frame in [
+    {},
+    {'@type': 'Person', 'age': 3},
+    {'knows': {'age': [1, 2]}},
+    {'@type': 'Person', 'knows': {'knows': {'age': 0}}},
+    {'age': [0, {'knows': {'@id': '5'}}]},
+  ]:
+    full = set(jsonld_frame_with_multi_index([db.index], frame))
+    streamed = list(jsonld_frame_with_multi_index([db.index], frame, skip=0, limit=100))
+    assert len(streamed) == len(full) and set(streamed) == full
+    # pages are consistent with each other
+    pages = [
+      subj
+      for skip in range(0, 30, 4)
+      for subj in jsonld_frame_with_multi_index([db.index], frame, skip=skip, limit=4)
+    ]
+    assert pages == streamed
+  # as are indexed nodes
+  streamed = jsonld_frame_with_multi_index([db.index], {'age': 3}, limit=100)
+  assert [db.index.terms.lookup(RDFTerm(RDFTermType.IRI, db[{'age': 3}][i]['@id'])) for i in range(4)] == list(streamed)
+
+def test_plan_cardinality():
+  db = JsonLDDatabase().update([
+    {'@id': str(i), '@type': 'Person', 'age': i % 7, 'knows': {'@id': str((i + 1) % 30)}}
+    for i in range(30)
+  ])
+  other = JsonLDDatabase().update({'@id': '30', '@type': 'Person', 'age': 3})
+  for frame in db, db.with_db(other):
+    for query in [{}, {'@type': 'Person'}, {'age': 3}, {'age': [3, 4]}, {'knows': {}}, {'knows': {'age': 3}}, {'@type': 'Person', 'age': 3}]:
+      assert len(frame[query]) == sum(1 for _ in frame[query])
+      assert frame[query].estimate_len() >= len(frame[query])
+  assert len(db['age']) == 7
+
+def test_compiled_frame():
+  from jsonlddb.compiled import compile_frame
+  from jsonlddb.plan import Param
+  from jsonlddb.cache import FrameCache
+  db = JsonLDDatabase().update([
+    {'@id': str(i), '@type': 'Person', 'age': i % 7, 'knows': {'@id': str((i + 1) % 30)}}
+    for i in range(30)
+  ])
+  frame = {'@type': 'Person', 'knows': {'age': Param('age')}}
+  assert compile_frame(frame) is compile_frame({'knows': {'age': Param('age')}, '@type': 'Person'})
+  for age in [3, [3, 4], 10]:
+    expected = {'knows': {'age': age}, '@type': 'Person'}
+    assert set(db[frame].bind(age=age)['@id']) == set(db[expected]['@id'])
+    assert len(db[frame].bind(age=age)) == len(db[expected])
+  # nodes are framed with the params filled in
+  assert db[frame].bind(age=3)[0]['knows'][0]['age'][0] == 3
+  # params are part of cache keys
+  cached = JsonLDDatabase(index=db.index, cache=FrameCache())
+  assert [len(cached[frame].bind(age=age)) for age in [3, 4, 3]] == [len(db[{'knows': {'age': age}}]) for age in [3, 4, 3]]
+  # compiled plans follow writes
+  db.update({'@id': '30', '@type': 'Person', 'knows': {'@id': '3'}})
+  assert len(db[frame].bind(age=3)) == len(db[{'@type': 'Person', 'knows': {'age': 3}}]) == 5
+
+def test_range_constraint():
+  from jsonlddb.compact import CompactJsonLDIndex
+  from jsonlddb.plan import Param
+  records = [
+    {'@id': str(i), '@type': 'Person', 'age': i, 'name': 'n{:02d}'.format(i)}
+    for i in range(30)
+  ] + [{'@id': 'x', 'age': '15', 'name': True}]
+  for db in [JsonLDDatabase(), JsonLDDatabase(CompactJsonLDIndex())]:
+    db.update(records)
+    ids = lambda frame: sorted(node['@id'] for node in db[frame])
+    adults = db[{'@type': 'Person', 'age': {'$gte': 18, '$lt': Param('max')}}]
+    assert sorted(node['@id'] for node in adults.bind(max=21)) == ['18', '19', '20']
+    assert ids({'age': {'$gt': 14, '$lte': 15.0}}) == ['15']
+    assert ids({'name': {'$prefix': 'n2'}}) == [str(i) for i in range(20, 30)]
+    assert ids({'age': [{'$lt': 2}, {'$gt': 27}]}) == ['0', '1', '28', '29']
+    # probed rather than scanned
+    assert ids({'@id': ['3', '4', 'x'], 'age': {'$gt': 3}}) == ['4']
+    # the sorted literals follow writes
+    db.update([{'@id': 'y', '@type': 'Person', 'age': 19.5}])
+    db.remove([{'@id': '18', 'age': 18}])
+    assert len(adults.bind(max=20)) == 2
+
+def test_text_constraint():
+  from jsonlddb.cache import FrameCache
+  for cache in [None, FrameCache()]:
+    db = JsonLDDatabase(cache=cache).update([
+      {'@id': 'a', '@type': 'Dataset', 'description': 'Climate data for Europe, daily climate readings'},
+      {'@id': 'b', '@type': 'Dataset', 'description': 'Ocean climate model output and data'},
+      {'@id': 'c', '@type': 'Paper', 'description': 'On climate data'},
+      {'@id': 'd', '@type': 'Dataset', 'description': 'Gene expression data'},
+    ] + [
+      {'@id': 'n{}'.format(i), '@type': 'Dataset', 'description': 'climate data' + ' filler' * (30 - i)}
+      for i in range(20)
+    ])
+    ids = lambda frame: sorted(node['@id'] for node in db[frame])
+    assert ids({'description': {'$text': 'CLIMATE data'}}) == ['a', 'b', 'c'] + sorted('n{}'.format(i) for i in range(20))
+    assert ids({'description': {'$text': 'climate weather'}}) == []
+    # results come best match first, paged or not
+    datasets = db[{'@type': 'Dataset', 'description': {'$text': 'data climate'}}]
+    assert [datasets[0]['@id'], datasets[1]['@id']] == ['a', 'b']
+    assert [node['@id'] for node in datasets][:4] == ['a', 'b', 'n19', 'n18']
+    assert [node['@id'] for node in datasets] == [datasets[i]['@id'] for i in range(len(datasets))]
+    assert db.explain({'@type': 'Dataset', 'description': {'$text': 'data climate'}})['order']['pred'] == 'description'
+    # the text index follows writes
+    db.remove([{'@id': 'a', 'description': 'Climate data for Europe, daily climate readings'}])
+    db.update([{'@id': 'e', '@type': 'Dataset', 'description': 'climate data'}])
+    assert [datasets[0]['@id'], datasets[1]['@id']] == ['e', 'b']
+    assert [node['@id'] for node in datasets][:2] == ['e', 'b']
+
+def test_pages_follow_iteration():
+  from jsonlddb.cache import FrameCache
+  from jsonlddb.materialize import ellipse
+  records = [
+    {'@id': str(i), 'age': i % 5, 'knows': [{'@id': str((i * 7) % 40)}, {'@id': str((i * 3) % 40)}]}
+    for i in range(40)
+  ]
+  db = JsonLDDatabase().update(records)
+  cached = JsonLDDatabase(cache=FrameCache()).update(records)
+  for query in [{'knows': {'age': 2}}, {'age': [1, 2]}, {}, {'age': 3, 'knows': {}}, {'age': [1, 2], 'knows': {'age': 2}}]:
+    frame = db[query]
+    ids = [node['@id'] for node in frame]
+    # whether or not frames are cached
+    assert [node['@id'] for node in cached[query]] == [node['@id'] for node in cached[query]] == ids
+    assert [frame[i]['@id'] for i in range(len(frame))] == ids
+    # slices show the same page
+    page = lambda a, b: [v for v in frame['@id'][a:b]._repr() if v is not ellipse]
+    assert page(3, 9) == ids[3:9] and page(5, 10) == ids[5:10]
@@ -37,3 +37,167 @@ def test_rules():
   assert 'test!' in frame_with_rules(docs, { '@type': 'Thing' }, rules=rules, context=context)['name']
   # Too broad, shouldn't resolve
   assert 'test!' not in frame_with_rules(docs.with_db(rules), {}, context=context)['name']
+
+def test_rule_engine():
+  from jsonlddb.rules import RuleEngine
+  calls = []
+  def shout(ld):
+    calls.append(ld['@id'])
+    return {'@id': ld['@id'], 'loud': [name.upper() for name in ld['name']]}
+  rules = JsonLDDatabase().update([
+    {
+      '@type': 'Rule',
+      'given': {'@value': {'@type': 'Person', 'name': {}}},
+      'using': 'shout',
+      'produce': {'@value': {'@type': 'Person', 'loud': {}}},
+    }
+  ])
+  docs = JsonLDDatabase().update([
+    {'@id': str(i), '@type': 'Person', 'name': 'p{}'.format(i)}
+    for i in range(5)
+  ])
+  engine = RuleEngine(docs, rules=rules, context={'shout': shout})
+  assert sorted(engine.frame({'loud': {}})['loud']) == ['P0', 'P1', 'P2', 'P3', 'P4']
+  assert len(calls) == 5
+  # materialized: nothing is fired again without writes, nor for other frames
+  assert len(engine.frame({'loud': 'P3'})) == 1
+  assert len(engine.frame({'name': {}})['loud']) == 0
+  assert len(calls) == 5
+  # only subjects whose match changed are fired again
+  docs.update([{'@id': '5', '@type': 'Person', 'name': 'p5'}, {'@id': '1', 'name': 'q1'}])
+  docs.remove([{'@id': '2', 'name': 'p2'}])
+  assert sorted(engine.frame({'@type': 'Person', 'loud': {}})['loud']) == ['P0', 'P1', 'P3', 'P4', 'P5', 'Q1']
+  assert sorted(calls[5:]) == ['1', '5']
+
+def label(ld):
+  return {'@id': ld['@id'], 'label': 'L' + ld['@id']}
+
+def label_rules(*usings):
+  return JsonLDDatabase().update([
+    {
+      '@type': 'Rule',
+      'given': {'@value': {'@type': 'Thing'}},
+      'using': using,
+      'produce': {'@value': {'@type': 'Thing', 'label': {}}},
+    }
+    for using in usings
+  ])
+
+def test_rules_parallel():
+  import asyncio
+  import concurrent.futures
+  from jsonlddb.rules import RuleEngine, aframe_with_rules
+  async def alabel(ld):
+    await asyncio.sleep(0)
+    return label(ld)
+  docs = JsonLDDatabase().update([{'@id': str(i), '@type': 'Thing'} for i in range(20)])
+  expected = sorted('L{}'.format(i) for i in range(20))
+  for executor in [concurrent.futures.ThreadPoolExecutor(4), concurrent.futures.ProcessPoolExecutor(2)]:
+    with executor:
+      engine = RuleEngine(docs, rules=label_rules('label'), context={'label': label}, executor=executor)
+      assert sorted(engine.frame({'label': {}})['label']) == expected
+      stats, = engine.stats()
+      assert stats['fired'] == 20 and stats['refreshes'] == 1
+  # coroutine functions are awaited, others run in a thread
+  rules = label_rules('label', 'alabel')
+  context = {'label': label, 'alabel': alabel}
+  framed = asyncio.run(aframe_with_rules(docs, {'label': {}}, rules=rules, context=context, concurrency=4))
+  assert sorted(framed['label']) == expected
+
+def test_rule_engine_related_nodes():
+  from jsonlddb.rules import RuleEngine
+  def friend(ld):
+    return {'@id': ld['@id'], 'friend': ld['knows'][0]['name'][0]}
+  rules = JsonLDDatabase().update([
+    {
+      '@type': 'Rule',
+      'given': {'@value': {'@type': 'P', 'knows': {'name': {}}}},
+      'using': 'friend',
+      'produce': {'@value': {'@type': 'P', 'friend': {}}},
+    }
+  ])
+  docs = JsonLDDatabase().update([
+    {'@id': 'a', '@type': 'P', 'knows': {'@id': 'b'}},
+    {'@id': 'b', 'name': 'bob'},
+  ])
+  engine = RuleEngine(docs, rules=rules, context={'friend': friend})
+  assert list(engine.frame({'@type': 'P', 'friend': {}})['friend']) == ['bob']
+  # changes to the nodes the given frame reaches fire the rule again
+  docs.remove({'@id': 'b', 'name': 'bob'}).update({'@id': 'b', 'name': 'robert'})
+  assert list(engine.frame({'@type': 'P', 'friend': {}})['friend']) == ['robert']
+
+def test_rules_concurrent_refreshes():
+  import asyncio
+  import threading
+  from jsonlddb.rules import RuleEngine
+  calls = []
+  async def alabel(ld):
+    calls.append(ld['@id'])
+    await asyncio.sleep(0)
+    return label(ld)
+  docs = JsonLDDatabase().update([{'@id': str(i), '@type': 'Thing'} for i in range(5)])
+  engine = RuleEngine(docs, rules=label_rules('alabel'), context={'alabel': alabel})
+  async def frames():
+    return await asyncio.gather(*(engine.aframe({'label': {}}) for _ in range(4)))
+  # concurrent refreshes of a rule fire it once
+  for framed in asyncio.run(frames()):
+    assert sorted(framed['label']) == ['L0', 'L1', 'L2', 'L3', 'L4']
+  assert sorted(calls) == ['0', '1', '2', '3', '4']
+  docs.remove({'@id': '3', '@type': 'Thing'}).update({'@id': '5', '@type': 'Thing'})
+  for framed in asyncio.run(frames()):
+    assert sorted(framed['label']) == ['L0', 'L1', 'L2', 'L4', 'L5']
+  assert calls[5:] == ['5']
+  # nor is a refresh applied over one made while it awaited its function
+  started, gate = threading.Event(), threading.Event()
+  def gated_label(ld):
+    if threading.current_thread() is not threading.main_thread():
+      started.set()
+      gate.wait()
+    return label(ld)
+  engine = RuleEngine(docs, rules=label_rules('label'), context={'label': gated_label})
+  engine.frame({'label': {}})
+  docs.remove({'@id': '4', '@type': 'Thing'}).update({'@id': '6', '@type': 'Thing'})
+  async def interleaved():
+    refresh = asyncio.ensure_future(engine.aframe({'label': {}}))
+    while not started.is_set():
+      await asyncio.sleep(0.001)
+    engine.frame({'label': {}})
+    gate.set()
+    return await refresh
+  assert sorted(asyncio.run(interleaved())['label']) == ['L0', 'L1', 'L2', 'L5', 'L6']
+  stats, = engine.stats()
+  assert stats['fired'] == 6 and stats['retracted'] == 1 and stats['refreshes'] == 2
+
+def test_rule_engine_given_triples():
+  from jsonlddb.rules import RuleEngine
+  def names(ld):
+    friends = list(ld['knows'])
+    return {
+      '@id': ld['@id'],
+      'friends': [name for friend in friends for name in friend['name']],
+      'friends_of_friends': [name for friend in friends for fof in friend['knows'] for name in fof['name']],
+      'known_by': [by['@id'] for by in ld['~knows']],
+    }
+  rules = JsonLDDatabase().update([
+    {
+      '@type': 'Rule',
+      'given': {'@value': {'@type': 'P', 'knows': {}}},
+      'using': 'names',
+      'produce': {'@value': {'@type': 'P', 'friends': {}}},
+    }
+  ])
+  docs = JsonLDDatabase().update([
+    {'@id': 'a', '@type': 'P', 'name': 'ann', 'knows': {'@id': 'b'}},
+    {'@id': 'b', 'name': 'bob', 'knows': {'@id': 'c'}},
+    {'@id': 'c', 'name': 'cat', 'knows': {'@id': 'a'}},
+  ])
+  engine = RuleEngine(docs, rules=rules, context={'names': names})
+  a = lambda pred: list(engine.frame({'@type': 'P', 'friends': {}})[0][pred])
+  # the friends `given` reaches are seen, and changes to them tracked
+  assert a('friends') == ['bob']
+  docs.remove({'@id': 'b', 'name': 'bob'}).update({'@id': 'b', 'name': 'rob'})
+  assert a('friends') == ['rob']
+  # what it doesn't reach is never seen rather than seen and not tracked
+  assert a('friends_of_friends') == [] and a('known_by') == []
+  docs.remove({'@id': 'c', 'name': 'cat'}).update({'@id': 'c', 'name': 'kit'})
+  assert a('friends_of_friends') == [] and a('friends') == ['rob']
@@ -0,0 +1,28 @@
+import uuid
+from jsonlddb.oop import JsonLDDatabase
+from jsonlddb.index import JsonLDIndex
+
+def test_snapshot(tmp_path):
+  path = str(tmp_path / 'db.snapshot')
+  db = JsonLDDatabase().update([
+    {'@id': '0', '@type': 'Person', 'age': 30, 'score': 1.5, 'member': True, 'nick': None},
+    {'@id': '1', '@type': 'Person', 'knows': {'@id': '0'}, 'ref': uuid.UUID(int=1)},
+    {'@type': 'Thing', 'data': {'@value': {'a': [1, 2]}}},
+  ])
+  db.dump(path, fmt='snapshot')
+  snapshot_db = JsonLDDatabase().load(path, fmt='snapshot')
+  assert type(snapshot_db.index.terms).__name__ == 'SnapshotTermDictionary'
+  for query in [{}, {'@type': 'Person'}, {'knows': {'age': 30}}, {'member': True}, {'age': 30.0}]:
+    assert set(snapshot_db[query]['@id']) == set(db[query]['@id'])
+  assert list(snapshot_db['data']) == [{'a': [1, 2]}]
+  assert set(snapshot_db['ref']) == {uuid.UUID(int=1)}
+  assert len(snapshot_db[{'@type': 'Unknown'}]) == 0
+  # writes on top of a snapshot
+  snapshot_db.update({'@id': '2', '@type': 'Person', 'knows': {'@id': '1'}})
+  assert set(snapshot_db[{'knows': {'@type': 'Person'}}]['@id']) == {'1', '2'}
+  # databases sharing the snapshot's terms can be framed together
+  other = JsonLDDatabase(index=JsonLDIndex(terms=snapshot_db.index.terms)).update({'@id': '3', '@type': 'Person'})
+  assert len(snapshot_db.with_db(other)[{'@type': 'Person'}]) == 4
+  # loading into a non-empty database merges
+  merged = JsonLDDatabase().update({'@id': '4', '@type': 'Person'}).load(path, fmt='snapshot')
+  assert set(merged[{'@type': 'Person'}]['@id']) == {'0', '1', '4'}
@@ -0,0 +1,89 @@
+from jsonlddb.oop import JsonLDDatabase
+from jsonlddb.rdf import RDFTerm, RDFTermType
+from jsonlddb.terms import TermDictionary
+
+def test_term_dictionary():
+  terms = TermDictionary()
+  a = terms.encode(RDFTerm(RDFTermType.IRI, 'a'))
+  one = terms.encode(RDFTerm(RDFTermType.LITERAL, 1))
+  true = terms.encode(RDFTerm(RDFTermType.LITERAL, True))
+  assert len({a, one, true}) == 3
+  assert terms.encode(RDFTerm(RDFTermType.IRI, 'a')) == a
+  assert terms.lookup(RDFTerm(RDFTermType.IRI, 'b')) is None
+  assert terms.decode(one) == RDFTerm(RDFTermType.LITERAL, 1)
+
+def test_index_stores_ids():
+  db = JsonLDDatabase().update({'@id': 'a', 'v': [1, True]})
+  assert all(type(subj) == int for subj in db.index.spo)
+  assert all(type(obj) == int for obj in db.index.pos['v'])
+  assert set(db['v']) == {1, True}
+
+def test_term_dictionary_per_database():
+  import gc
+  import weakref
+  db = JsonLDDatabase().update({'@id': 'a', 'v': 1})
+  scratch = JsonLDDatabase().update([{'@id': str(i), 'v': i} for i in range(100)])
+  assert scratch.index.terms is not db.index.terms and len(db.index.terms) == 2
+  # framed together through a copy in the terms of the first
+  assert sorted(n['@id'] for n in db.with_db(scratch)[{'v': 1}]) == ['1', 'a']
+  scratch.update({'@id': 'b', 'v': 1})
+  assert sorted(n['@id'] for n in db.with_db(scratch)[{'v': 1}]) == ['1', 'a', 'b']
+  # the terms of a database go with it
+  terms = weakref.ref(scratch.index.terms)
+  del scratch
+  gc.collect()
+  assert terms() is None
+
+def test_term_dictionary_threads():
+  import sys
+  import random
+  import threading
+  terms = TermDictionary()
+  values = list(range(2000))
+  results = []
+  def encode():
+    order = random.sample(values, len(values))
+    results.append({value: terms.encode_literal(value) for value in order})
+  threads = [threading.Thread(target=encode) for _ in range(8)]
+  # switching threads as often as possible
+  interval = sys.getswitchinterval()
+  sys.setswitchinterval(1e-6)
+  try:
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  finally:
+    sys.setswitchinterval(interval)
+  # every thread got the same id for a term, decoding to that term
+  assert all(ids == results[0] for ids in results) and len(terms) == len(values)
+  assert all(terms.decode(id) == RDFTerm(RDFTermType.LITERAL, value) for value, id in results[0].items())
+
+def test_translated_copies():
+  import threading
+  db = JsonLDDatabase().update({'@id': 'a', 'v': 1})
+  other = JsonLDDatabase().update([{'@id': str(i), 'v': i} for i in range(100)])
+  copy = lambda: db.with_db(other)._multi_index()[0].members[1]
+  # the copy keeps its uid, and the versions of the index it copies
+  first = copy()
+  assert copy() is first and first.uid == copy().uid
+  assert (first.version, first.versions) == (other.index.version, other.index.versions)
+  other.update({'@id': 'b', 'v': 1}).remove({'@id': '1', 'v': 1})
+  second = copy()
+  assert second.uid == first.uid and second.version == other.index.version
+  assert sorted(n['@id'] for n in db.with_db(other)[{'v': 1}]) == ['a', 'b']
+  # reading through copies while the first database is written to
+  stop = threading.Event()
+  def read():
+    while not stop.is_set():
+      list(db.with_db(other)[{'v': 1}])
+      other.update({'@id': 'c', 'v': len(db.index.terms)})
+  reader = threading.Thread(target=read)
+  reader.start()
+  try:
+    for i in range(200):
+      db.update({'@id': 'w{}'.format(i), 'name': 'v{}'.format(i)})
+  finally:
+    stop.set()
+    reader.join()
+  assert all(list(db[{'@id': 'w{}'.format(i)}]['name']) == ['v{}'.format(i)] for i in range(200))
@@ -0,0 +1,87 @@
+import os
+import pytest
+from jsonlddb.oop import JsonLDDatabase
+
+def test_wal(tmp_path):
+  path = str(tmp_path / 'db')
+  db = JsonLDDatabase.open(path, fsync=False)
+  db.update([
+    {'@id': '0', '@type': 'Person', 'age': 30},
+    {'@id': '1', '@type': 'Person', 'knows': {'@id': '0'}},
+  ])
+  db.remove({'@id': '0', 'age': 30})
+  db.bulk_update([{'@id': '2', '@type': 'Person', 'data': {'@value': {'a': 1}}}])
+  db.close()
+  # a write torn by a crash is dropped
+  with open(os.path.join(path, 'log'), 'a') as fw:
+    fw.write('["+", [["3", "@type", "Per')
+  db = JsonLDDatabase.open(path, fsync=False)
+  assert set(db[{'@type': 'Person'}]['@id']) == {'0', '1', '2'}
+  assert list(db[{'@id': '0'}]['age']) == []
+  assert list(db['data']) == [{'a': 1}]
+  # checkpoints snapshot the database and empty the log
+  db.update({'@id': '3', '@type': 'Person'}).checkpoint()
+  assert os.path.getsize(os.path.join(path, 'log')) == 0
+  db.update({'@id': '4', '@type': 'Person'})
+  db.close()
+  for mmap in [False, True]:
+    db = JsonLDDatabase.open(path, fsync=False, mmap=mmap)
+    assert set(db[{'@type': 'Person'}]['@id']) == {'0', '1', '2', '3', '4'}
+    db.close()
+  # checkpoints are made once the log outgrows checkpoint_bytes
+  db = JsonLDDatabase.open(path, fsync=False, checkpoint_bytes=0)
+  db.update({'@id': '5', '@type': 'Person'})
+  assert os.path.getsize(os.path.join(path, 'log')) == 0
+  db.close()
+  assert len(JsonLDDatabase.open(path)[{'@type': 'Person'}]) == 6
+
+def test_wal_term_types(tmp_path):
+  path = str(tmp_path / 'db')
+  records = [
+    {'@type': 'Blank', 'name': 'b', 'knows': {'name': 'c'}},
+    {'@id': 'x', 'n': {'@value': 1}, 'm': 1, 'f': 1.0, 'ok': True, 'no': None},
+  ]
+  triples = lambda db: {(s, p, o) for s, po in db.index.iter_spo() for p, os in po.items() for o in os}
+  db = JsonLDDatabase.open(path, fsync=False)
+  db.update(records)
+  written = triples(db)
+  db.close()
+  # replayed terms keep their types (UUID blank nodes, JSON literals)
+  db = JsonLDDatabase.open(path, fsync=False)
+  assert triples(db) == written
+  # writing the same records again matches the replayed triples
+  db.update(records)
+  assert len(db[{'@type': 'Blank'}]) == 1 and len(db[{'name': {}}]) == 2
+  db.remove(records)
+  assert len(db[{'@type': 'Blank'}]) == 0 and len(db[{}]) == 0
+  db.close()
+
+def test_wal_canonical_id(tmp_path):
+  from jsonlddb.core import canonical_blake2b
+  path = str(tmp_path / 'db')
+  db = JsonLDDatabase.open(path, fsync=False, canonical_id=canonical_blake2b)
+  db.update({'@type': 'Blank', 'name': 'b'})
+  db.close()
+  # the scheme is recorded with the database
+  with pytest.raises(Exception, match='canonical_blake2b'):
+    JsonLDDatabase.open(path, fsync=False)
+  db = JsonLDDatabase.open(path, fsync=False, canonical_id=canonical_blake2b)
+  db.update({'@type': 'Blank', 'name': 'b'})
+  assert len(db[{'@type': 'Blank'}]) == 1
+  db.close()
+
+def test_wal_missing_removal(tmp_path):
+  path = str(tmp_path / 'db')
+  db = JsonLDDatabase.open(path, fsync=False)
+  db.update([{'@id': 'a', 'name': 'x'}, {'@id': 'b', 'name': 'y', 'n': 1}])
+  # removing what isn't there changes nothing, and doesn't stop reopening
+  db.remove({'@id': 'a', 'name': 'y'})
+  db.remove({'@id': 'b', 'name': 'x'})
+  db.remove({'@id': 'b', 'name': 'z'})
+  db.close()
+  db = JsonLDDatabase.open(path, fsync=False)
+  assert list(db[{'@id': 'a'}]['name']) == ['x']
+  assert list(db[{'@id': 'b'}]['name']) == ['y']
+  db.remove([{'@id': 'a', 'name': 'x'}, {'@id': 'b', 'name': 'y', 'n': 1}])
+  db.close()
+  assert len(JsonLDDatabase.open(path)[{}]) == 0
@@ -0,0 +1,98 @@
+'''
+An inverted index from the words of the string literal objects of a
+ predicate to those objects, answering the `$text` frame operator:
+
+  db[{'@type': 'Dataset', 'description': {'$text': 'climate data'}}]
+
+matches the subjects with a description containing every word of the
+ query (case insensitively). Matches are scored tf-idf style so that,
+ paged with skip/limit, the best come first.
+'''
+import re
+import math
+import collections
+from jsonlddb.rdf import RDFTermType
+from jsonlddb.index import HashedSegmentedMap, SegmentedMap
+
+word_re = re.compile(r'\w+')
+
+def tokenize(text):
+  return word_re.findall(text.lower())
+
+class TextIndex:
+  ''' The distinct string literal objects of one predicate by word. A
+  copy shares the segments and postings of the original, each copying
+  those it writes to.
+  '''
+  def __init__(self, literals=()):
+    # word -> {term id: occurrences}
+    self.postings = HashedSegmentedMap()
+    # term id -> number of words
+    self.lengths = SegmentedMap()
+    # the ids of the postings written since the last copy
+    self._owned = set()
+    for value, id in literals:
+      self._add(value, id)
+  #
+  @staticmethod
+  def from_index(index, pred):
+    decode = index.terms.decode
+    return TextIndex(
+      (term.value, obj)
+      for term, obj in ((decode(obj), obj) for obj in index.pos.get(pred, {}).keys())
+      if term.type == RDFTermType.LITERAL and type(term.value) == str
+    )
+  #
+  def copy(self):
+    copy = TextIndex()
+    copy.postings, copy.lengths = self.postings.copy(), self.lengths.copy()
+    self._owned = set()
+    return copy
+  #
+  def _writable(self, word):
+    postings = self.postings.get(word)
+    if postings is None or id(postings) not in self._owned:
+      postings = self.postings[word] = {} if postings is None else dict(postings)
+      self._owned.add(id(postings))
+    return postings
+  #
+  def _add(self, value, id):
+    words = tokenize(value)
+    for word, n in collections.Counter(words).items():
+      self._writable(word)[id] = n
+    self.lengths[id] = len(words)
+  #
+  def add(self, term, id):
+    if term.type == RDFTermType.LITERAL and type(term.value) == str:
+      self._add(term.value, id)
+  #
+  def discard(self, term, id):
+    if term.type == RDFTermType.LITERAL and type(term.value) == str and id in self.lengths:
+      for word in set(tokenize(term.value)):
+        postings = self._writable(word)
+        del postings[id]
+        if not postings:
+          del self.postings[word]
+      del self.lengths[id]
+  #
+  def search(self, query):
+    ''' (score, term id) of the objects containing every word of `query`
+    '''
+    postings = [self.postings.get(word) for word in set(tokenize(query))]
+    if not postings or None in postings:
+      return []
+    postings.sort(key=len)
+    ids = postings[0].keys()
+    for other in postings[1:]:
+      ids = ids & other.keys()
+    n = len(self.lengths)
+    idfs = [(p, math.log(1 + n / len(p))) for p in postings]
+    return [
+      (sum(p[id] * idf for p, idf in idfs) / math.sqrt(self.lengths[id]), id)
+      for id in ids
+    ]
+
+def text_match(query, value):
+  ''' Whether the string `value` contains every word of `query`
+  '''
+  return set(tokenize(query)) <= set(tokenize(value))
@@ -0,0 +1,83 @@
+'''
+An append-only log of the triples inserted into and removed from a
+ database, so writes are durable at a cost proportional to the change
+ rather than to the dataset.
+
+Each `append` writes one line `[op, [[subj, pred, obj], ...]]` (op being
+ '+' or '-', terms written as their snapshot `term_key` so they keep
+ their type, e.g. UUID blank nodes and JSON literals) and flushes it,
+ optionally fsync-ing. A line is only complete once its newline is
+ written, so a write cut short by a crash loses that batch alone and is
+ skipped on replay.
+'''
+import os
+from jsonlddb import json
+from jsonlddb.snapshot import term_key, term_from_key
+
+class TripleLog:
+  ''' The log at `path`, opened for appending. With `fsync` every batch
+  survives a system crash once appended, without it a process crash.
+  '''
+  def __init__(self, path, fsync=True):
+    self.path = path
+    self.fsync = fsync
+    if os.path.exists(path):
+      self._repair()
+    self._fw = open(path, 'a', encoding='utf-8')
+  #
+  def _repair(self, block_size=2**12):
+    ''' Cut a torn write from the end of the log so appends follow the
+    last complete batch
+    '''
+    with open(self.path, 'rb+') as f:
+      end = pos = f.seek(0, os.SEEK_END)
+      while pos > 0:
+        start = max(0, pos - block_size)
+        f.seek(start)
+        i = f.read(pos - start).rfind(b'\n')
+        if i >= 0:
+          pos = start + i + 1
+          break
+        pos = start
+      if pos < end:
+        f.truncate(pos)
+  #
+  @property
+  def size(self):
+    return self._fw.tell()
+  #
+  def append(self, op, triples):
+    ''' Log the insertion ('+') or removal ('-') of a batch of triples
+    '''
+    self._fw.write(json.dumps([
+      op, [[term_key(s).decode(), p, term_key(o).decode()] for s, p, o in triples],
+    ]))
+    self._fw.write('\n')
+    self._fw.flush()
+    if self.fsync:
+      os.fsync(self._fw.fileno())
+  #
+  def replay(self):
+    ''' Iterate over the logged (op, triples) batches in order
+    '''
+    with open(self.path, 'r', encoding='utf-8') as fr:
+      for line in fr:
+        if not line.endswith('\n'):
+          # torn write
+          return
+        op, triples = json.loads(line)
+        yield op, [
+          (term_from_key(s.encode()), p, term_from_key(o.encode()))
+          for s, p, o in triples
+        ]
+  #
+  def truncate(self):
+    ''' Drop all logged batches (once they are persisted otherwise)
+    '''
+    self._fw.truncate(0)
+    self._fw.seek(0)
+    if self.fsync:
+      os.fsync(self._fw.fileno())
+  #
+  def close(self):
+    self._fw.close()